@@ -1,16 +1,23 @@
 import os
 import logging
-from flask import Flask, render_template, send_from_directory
+import mimetypes
+from urllib.parse import quote
+from flask import Flask, Response, abort, render_template, request, send_from_directory
 from flask_migrate import Migrate
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy.pool import NullPool
+from werkzeug.security import safe_join
+from werkzeug.wsgi import wrap_file
 from app.admin import setup_admin
 from app.routes import register_routes
 from app.celery_app import celery, make_celery
 from app.tasks import example_task
-from app.models import init_db  # Import the init_db function
+from app.models import Base, engine, remove_session
+from app.views.metrics import instrument_app
+
 
 # Define the SQLAlchemy and Migrate instances globally
-db = SQLAlchemy()
+db = SQLAlchemy(metadata=Base.metadata)
 migrate = Migrate()
 
 def create_app():
@@ -28,17 +35,18 @@ def create_app():
 
     # Configurations
     app.config.from_object('config.Config')
+    # Flask-SQLAlchemy (used by Flask-Migrate) borrows connections from the models'
+    # engine and keeps none itself, so the app has one connection pool.
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = {"creator": engine.raw_connection, "poolclass": NullPool}
 
     # Initialize SQLAlchemy and Migrate
     db.init_app(app)
     migrate.init_app(app, db)
-
-    # Initialize the database (create tables)
-    with app.app_context():
-        init_db()
+    app.teardown_appcontext(remove_session)
 
     setup_admin(app)
     register_routes(app)
+    instrument_app(app)
 
     celery = make_celery(app)
 
@@ -70,6 +78,22 @@ def create_app():
     
     @app.route('/media/<path:filename>')
     def media_files(filename):
-        return send_from_directory(app.config['MEDIA_ROOT'], filename)
+        # Range and conditional requests are answered here; the bytes go out by sendfile, or by nginx.
+        if app.config['MEDIA_ACCEL_PREFIX']:
+            path = safe_join(app.config['MEDIA_ROOT'], filename)
+            if path is None or not os.path.isfile(path):
+                abort(404)
+            response = Response(mimetype=mimetypes.guess_type(filename)[0] or 'application/octet-stream')
+            response.headers['X-Accel-Redirect'] = app.config['MEDIA_ACCEL_PREFIX'].rstrip('/') + '/' + quote(filename)
+            return response
+        response = send_from_directory(app.config['MEDIA_ROOT'], filename, max_age=app.config['MEDIA_MAX_AGE'])
+        if response.status_code == 206 and request.environ.get('SERVER_SOFTWARE', '').startswith('gunicorn/'):
+            # Werkzeug copies a byte range through Python; gunicorn sendfiles Content-Length bytes
+            # from wherever its file wrapper starts, so hand it the file seeked to the range.
+            response.response.close()
+            file = open(safe_join(app.config['MEDIA_ROOT'], filename), 'rb')
+            file.seek(response.content_range.start)
+            response.response = wrap_file(request.environ, file)
+        return response
 
     return app, db
\ No newline at end of file
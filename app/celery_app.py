@@ -1,17 +1,46 @@
 import os
 from dotenv import load_dotenv
 from celery import Celery
+from kombu import Exchange, Queue
+from config import Config
 
 load_dotenv()  # Load environment variables from .env file
 
 broker = os.getenv('CELERY_BROKER_URL')
 backend = os.getenv('CELERY_BACKEND_URL')
-celery = Celery('app', broker=broker, backend=backend)
+celery = Celery('app', broker=broker, backend=backend, include=['app.tasks'])
 
-# ...additional Celery configuration...
+# Quick bookkeeping jobs and long computations get separate queues, so a
+# worker busy with a PCA never sits on metadata jobs in its prefetch buffer.
+LIGHT_QUEUE = 'light'
+HEAVY_QUEUE = 'heavy'
+HEAVY_TASKS = (
+    'app.tasks.build_upload_metadata_task', 'app.tasks.build_pyramid_task', 'app.tasks.build_chunk_store_task',
+    'app.tasks.build_plane_index_task',
+    'app.tasks.analyze_image_task',
+    'app.tasks.get_statistics_task', 'app.tasks.segment_image_task', 'app.tasks.accumulate_pca_task',
+    'app.tasks.apply_pca_basis_task',
+)
+
+celery.conf.update(
+    task_queues=tuple(Queue(name, Exchange(name), routing_key=name) for name in (LIGHT_QUEUE, HEAVY_QUEUE)),
+    task_default_queue=LIGHT_QUEUE,
+    task_routes={name: {"queue": HEAVY_QUEUE} for name in HEAVY_TASKS},
+    # Tasks size their compute pools and BLAS threads from the same setting.
+    worker_concurrency=Config.CELERY_WORKER_CONCURRENCY,
+    worker_prefetch_multiplier=Config.CELERY_PREFETCH_MULTIPLIER,
+    # Acknowledge after the task ran, so a crashed worker's job is redelivered; tasks are idempotent.
+    task_acks_late=True,
+    task_reject_on_worker_lost=True,
+    task_track_started=True,
+    result_expires=Config.CELERY_RESULT_EXPIRES,
+    # Redis redelivers unacknowledged messages after this long; it must outlast the longest task.
+    broker_transport_options={"visibility_timeout": Config.CELERY_HEAVY_TIME_LIMIT + 600},
+    broker_connection_retry_on_startup=True,
+)
 
 def make_celery(app):
-    celery.conf.update(app.config)
+    # Celery takes its settings from above; Flask's config is not copied in.
     TaskBase = celery.Task
 
     class ContextTask(TaskBase):
@@ -20,4 +49,4 @@ def make_celery(app):
                 return TaskBase.__call__(self, *args, **kwargs)
 
     celery.Task = ContextTask
-    return celery
\ No newline at end of file
+    return celery
@@ -1,10 +1,24 @@
-from sqlalchemy.orm import sessionmaker
+import os
+from sqlalchemy.orm import scoped_session, sessionmaker
 from .base import Base, engine  # Updated import
-from app.models.image_process import ImageMetadata, ImageStatistics, PCAResults  # Import models to register them
+from app.models.image_process import ImageMetadata, ImageStatistics, PCAResults, SegmentationResults, CachedResult, BatchJob  # Import models to register them
 from app.models.post import Post  # Import the Post model
 
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+# Loaded rows stay usable after commit, so a view can keep working with an image it committed changes for.
+SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine, expire_on_commit=False)
+
+# One session per thread, removed when the Flask request or the Celery task that used it ends.
+db_session = scoped_session(SessionLocal)
+
+def remove_session(exception=None):
+    db_session.remove()
+
+MIGRATIONS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'migrations')
 
 def init_db():
-    ImageMetadata, ImageStatistics, PCAResults , Post  # Import models to register them
-    Base.metadata.create_all(bind=engine)  # Create all tables
+    # Upgrades the database to the latest Alembic migration, as `flask db upgrade`
+    # does. The app never runs this on start, so several processes starting at
+    # once can't race on a fresh database; deploys run the upgrade once instead.
+    # Needs the app context of create_app.
+    from flask_migrate import upgrade
+    upgrade(directory=MIGRATIONS_DIR)
@@ -1,6 +1,38 @@
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import make_url
 from sqlalchemy.orm import declarative_base
 from config import Config
 
 Base = declarative_base()
-engine = create_engine(Config.SQLALCHEMY_DATABASE_URI, echo=True)
+
+
+def engine_options(uri):
+    """Keyword arguments for ``create_engine``: pooling for server databases, thread sharing for SQLite."""
+    options = {"echo": Config.SQLALCHEMY_ECHO, "pool_pre_ping": True}
+    if make_url(uri).get_backend_name() == 'sqlite':
+        options["connect_args"] = {"check_same_thread": False}
+    else:
+        options.update({
+            "pool_size": Config.DB_POOL_SIZE,
+            "max_overflow": Config.DB_MAX_OVERFLOW,
+            "pool_recycle": Config.DB_POOL_RECYCLE
+        })
+    return options
+
+
+def make_engine(uri):
+    engine = create_engine(uri, **engine_options(uri))
+    if engine.dialect.name == 'sqlite':
+        @event.listens_for(engine, "connect")
+        def _sqlite_pragmas(dbapi_connection, connection_record):
+            # WAL lets readers proceed while a worker writes; busy_timeout waits for the lock instead of failing.
+            cursor = dbapi_connection.cursor()
+            if Config.SQLITE_WAL and engine.url.database not in (None, '', ':memory:'):
+                cursor.execute("PRAGMA journal_mode=WAL")
+                cursor.execute("PRAGMA synchronous=NORMAL")
+            cursor.execute(f"PRAGMA busy_timeout={Config.SQLITE_BUSY_TIMEOUT}")
+            cursor.close()
+    return engine
+
+
+engine = make_engine(Config.SQLALCHEMY_DATABASE_URI)
@@ -4,26 +4,86 @@ from .base import Base  # Updated import
 class ImageMetadata(Base):
     __tablename__ = 'image_metadata'
     id = Column(Integer, primary_key=True)
-    request_id = Column(String, nullable=False)
+    request_id = Column(String, nullable=False, unique=True, index=True)
     filename = Column(String, nullable=False)
     dimensions = Column(String, nullable=False)
     file_path = Column(String, nullable=False)
     upload_time = Column(String, nullable=False)
+    page_index = Column(JSON, nullable=True)
+    content_hash = Column(String, nullable=True)
+    pyramid = Column(JSON, nullable=True)
+    tiff_metadata = Column(JSON, nullable=True)
+    chunk_store = Column(JSON, nullable=True)
+    # Shape, dtype and histogram bins of the PlaneSummary rows, set once every row is stored
+    plane_index = Column(JSON, nullable=True)
 
 class ImageStatistics(Base):
     __tablename__ = 'image_statistics'
     id = Column(Integer, primary_key=True)
-    image_id = Column(Integer, nullable=False)
+    image_id = Column(Integer, nullable=False, index=True)
     channel = Column(Integer, nullable=False)
     mean = Column(Float, nullable=False)
     std = Column(Float, nullable=False)
     min = Column(Float, nullable=False)
     max = Column(Float, nullable=False)
 
+class PlaneSummary(Base):
+    __tablename__ = 'plane_summaries'
+    id = Column(Integer, primary_key=True)
+    image_id = Column(Integer, nullable=False, index=True)
+    time = Column(Integer, nullable=False)
+    z = Column(Integer, nullable=False)
+    channel = Column(Integer, nullable=False)
+    count = Column(Integer, nullable=False)
+    sum = Column(Float, nullable=False)
+    sum_sq = Column(Float, nullable=False)
+    min = Column(Float, nullable=False)
+    max = Column(Float, nullable=False)
+    # Counts of the bins from hist_offset on, over the bins recorded in ImageMetadata.plane_index
+    hist_offset = Column(Integer, nullable=False)
+    histogram = Column(JSON, nullable=False)
+
 class PCAResults(Base):
     __tablename__ = 'pca_results'
     id = Column(Integer, primary_key=True)
-    image_id = Column(Integer, nullable=False)
+    image_id = Column(Integer, nullable=False, index=True)
     components = Column(Integer, nullable=False)
     explained_variance = Column(JSON, nullable=False)
     file_path = Column(String, nullable=False)
+    # Fitted mean and components (StreamingPCA.basis), reusable on other images and regions without a refit
+    basis = Column(JSON, nullable=True)
+    # Region, sample fraction and reused basis the projection was made with; None for a full-image fit
+    selection = Column(JSON, nullable=True)
+
+class SegmentationResults(Base):
+    __tablename__ = 'segmentation_results'
+    id = Column(Integer, primary_key=True)
+    image_id = Column(Integer, nullable=False, index=True)
+    channel = Column(Integer, nullable=False)
+    method = Column(String, nullable=False)
+    threshold = Column(Float, nullable=False)
+    file_path = Column(String, nullable=False)
+
+class CachedResult(Base):
+    __tablename__ = 'result_cache'
+    id = Column(Integer, primary_key=True)
+    key = Column(String, nullable=False, unique=True, index=True)
+    content_hash = Column(String, nullable=False)
+    operation = Column(String, nullable=False)
+    params = Column(JSON, nullable=False)
+    result = Column(JSON, nullable=True)
+    file_path = Column(String, nullable=True)
+    size_bytes = Column(Integer, nullable=False, default=0)
+    last_access = Column(DateTime, nullable=False, index=True)
+
+class BatchJob(Base):
+    __tablename__ = 'batch_jobs'
+    id = Column(Integer, primary_key=True)
+    batch_id = Column(String, nullable=False, unique=True, index=True)
+    operations = Column(JSON, nullable=False)
+    components = Column(Integer, nullable=True)
+    shared_basis = Column(JSON, nullable=True)
+    items = Column(JSON, nullable=False)
+    status = Column(String, nullable=False)
+    created_time = Column(String, nullable=False)
+    finished_time = Column(String, nullable=True)
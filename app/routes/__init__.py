@@ -1,11 +1,26 @@
 from app.views.image_reord_api import (
     upload_image, get_metadata, get_slice,
-    analyze_image, get_statistics
+    analyze_image, get_statistics, get_planes, get_job,
+    start_chunked_upload, upload_chunk, get_upload, finalize_upload,
+    get_pyramid, get_tile, segment_image, get_hyperslab, start_batch, get_batch, get_metrics
 )
 
 def register_routes(app):
     app.add_url_rule("/upload", view_func=upload_image, methods=["POST"])
+    app.add_url_rule("/uploads", view_func=start_chunked_upload, methods=["POST"])
+    app.add_url_rule("/uploads/<request_id>", view_func=upload_chunk, methods=["PUT"])
+    app.add_url_rule("/uploads/<request_id>", view_func=get_upload, methods=["GET"])
+    app.add_url_rule("/uploads/<request_id>/finalize", view_func=finalize_upload, methods=["POST"])
     app.add_url_rule("/metadata/<request_id>", view_func=get_metadata, methods=["GET"])
     app.add_url_rule("/slice/<request_id>", view_func=get_slice, methods=["GET"])
+    app.add_url_rule("/hyperslab/<request_id>", view_func=get_hyperslab, methods=["GET"])
+    app.add_url_rule("/tiles/<request_id>", view_func=get_pyramid, methods=["GET"])
+    app.add_url_rule("/tiles/<request_id>/<int:level>/<int:y>/<int:x>", view_func=get_tile, methods=["GET"])
     app.add_url_rule("/analyze/<request_id>", view_func=analyze_image, methods=["POST"])
+    app.add_url_rule("/segment/<request_id>", view_func=segment_image, methods=["POST"])
     app.add_url_rule("/statistics/<request_id>", view_func=get_statistics, methods=["GET"])
+    app.add_url_rule("/planes/<request_id>", view_func=get_planes, methods=["GET"])
+    app.add_url_rule("/jobs/<task_id>", view_func=get_job, methods=["GET"])
+    app.add_url_rule("/batch", view_func=start_batch, methods=["POST"])
+    app.add_url_rule("/batch/<batch_id>", view_func=get_batch, methods=["GET"])
+    app.add_url_rule("/metrics", view_func=get_metrics, methods=["GET"])
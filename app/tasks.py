@@ -1,84 +1,623 @@
 from app.celery_app import celery
+from celery.signals import task_postrun, task_prerun, worker_process_init, worker_process_shutdown, worker_shutdown
 from datetime import datetime
+from sqlalchemy import insert
+from sqlalchemy.exc import IntegrityError, OperationalError
 from app.views.image_processor import ImageProcessor
-from app.models import SessionLocal
-from app.models.image_process import ImageMetadata, ImageStatistics, PCAResults
-from app.views.image_processor import ImageProcessor
-import tifffile
+from app.models import db_session, engine, remove_session
+from app.models.image_process import (
+    BatchJob, ImageMetadata, ImageStatistics, PCAResults, PlaneSummary, SegmentationResults,
+)
+from app.views.chunk_store import CHUNK_STORE_DIR, is_chunk_store, write_chunk_store
+from app.views.metrics import (
+    TASK_PEAK_RSS, TASK_SECONDS, TASKS, instrument_engine, peak_rss_bytes, record_written, reset_peak_rss, snapshots,
+    timed,
+)
+from app.views.parallel import ComputeBackend, blas_threads, limit_blas_threads
+from app.views.plane_index import build_plane_index, merge_rows, merge_totals
+from app.views.pyramid import PYRAMID_DIR, build_pyramid
+from app.views.tiff_metadata import ensure_tiff_metadata
+from app.views.result_cache import atomic_output_path, cache_key, ensure_content_hash, result_cache
+from app.views.stream_pca import StreamingPCA
+from config import Config
+import numpy as np
 import os
+import shutil
+import time
 
-UPLOAD_DIR = "uploads"
+# Transient database errors (a locked SQLite file, a dropped connection) are
+# retried with exponential backoff; every task is safe to run again.
+RETRY_OPTIONS = {
+    "autoretry_for": (OperationalError,),
+    "retry_backoff": True,
+    "retry_backoff_max": 600,
+    "retry_jitter": True,
+    "max_retries": Config.CELERY_MAX_RETRIES,
+}
+LIGHT_TASK = dict(RETRY_OPTIONS, soft_time_limit=Config.CELERY_LIGHT_TIME_LIMIT,
+                  time_limit=Config.CELERY_LIGHT_TIME_LIMIT + 60)
+HEAVY_TASK = dict(RETRY_OPTIONS, soft_time_limit=Config.CELERY_HEAVY_TIME_LIMIT,
+                  time_limit=Config.CELERY_HEAVY_TIME_LIMIT + 300)
 
-@celery.task
-def upload_image_task(file_path, request_id):
-    processor = ImageProcessor(file_path)
+def progress_reporter(task, request_id):
+    """Return a progress(done, total) callback publishing PROGRESS state once per percent."""
+    last = {"percent": None}
+
+    def report(done, total):
+        percent = int(100 * done / total) if total else 100
+        if percent == last["percent"] or task.request.id is None or task.request.is_eager:
+            return
+        last["percent"] = percent
+        task.update_state(state="PROGRESS", meta={"request_id": request_id, "progress": percent})
+
+    return report
+
+@worker_process_init.connect
+def limit_worker_threads(**kwargs):
+    # Each prefork child keeps to its share of BLAS/OpenMP threads, even for unsplit work.
+    limit_blas_threads(blas_threads())
+
+@task_postrun.connect
+def remove_task_session(task=None, **kwargs):
+    # Eager tasks run inside the caller's request and share its session.
+    if task is not None and not task.request.is_eager:
+        remove_session()
+
+instrument_engine(engine)
+task_starts = {}
+
+@task_prerun.connect
+def start_task_metrics(task_id=None, task=None, **kwargs):
+    task_starts[task_id] = time.perf_counter()
+    if not task.request.is_eager:
+        reset_peak_rss()
+
+@task_postrun.connect
+def record_task_metrics(task_id=None, task=None, state=None, **kwargs):
+    start = task_starts.pop(task_id, None)
+    TASKS.inc(1, task.name, state or "UNKNOWN")
+    if start is not None:
+        TASK_SECONDS.observe(time.perf_counter() - start, task.name)
+    # An eager task shares the web process, whose peak it cannot tell apart.
+    if not task.request.is_eager:
+        TASK_PEAK_RSS.observe(peak_rss_bytes(), task.name)
+        snapshots.flush()
+
+@worker_process_shutdown.connect
+@worker_shutdown.connect
+def remove_metrics_snapshot(**kwargs):
+    # Prefork children exit through worker_process_shutdown, solo and thread pools through worker_shutdown.
+    snapshots.remove()
+
+def find_image(request_id):
+    """
+    Look up an image for a long-running task, ending the read transaction so
+    the connection goes back to the pool while the task computes.
+    """
+    db = db_session()
+    image = db.query(ImageMetadata).filter(ImageMetadata.request_id == request_id).first()
+    db.commit()
+    return image
+
+def statistics_rows(image_id, stats):
+    """ImageStatistics rows of one image, for a multi-row INSERT."""
+    return [
+        {
+            "image_id": image_id,
+            "channel": stat['channel'],
+            "mean": stat['mean'],
+            "std": stat['std'],
+            "min": stat['min'],
+            "max": stat['max']
+        }
+        for stat in stats
+    ]
+
+def pca_row(image_id, result):
+    return {
+        "image_id": image_id,
+        "components": result["components"],
+        "file_path": result["file_path"],
+        "explained_variance": result["explained_variance"],
+        "basis": result.get("basis"),
+        "selection": result.get("selection")
+    }
+
+def pca_params(components, dtype, region=None, sample=1.0, basis=None):
+    """Result cache parameters of a PCA; a full-image fit keeps the keys it always had."""
+    params = {"components": components, "dtype": dtype}
+    if region:
+        params["region"] = region
+    if sample < 1:
+        params["sample"] = sample
+    if basis is not None:
+        params["basis"] = cache_key(None, "pca_basis", basis)
+    return params
+
+def pca_selection(region=None, sample=1.0, basis_id=None, batch_id=None):
+    """
+    Region, sample fraction, stored basis or batch whose shared basis a PCA
+    was made with, or None for a full-image fit.
+    """
+    selection = {}
+    if region:
+        selection["region"] = region
+    if sample < 1:
+        selection["sample"] = sample
+    if basis_id is not None:
+        selection["basis_id"] = basis_id
+    if batch_id is not None:
+        selection["batch_id"] = batch_id
+    return selection or None
+
+def stored_basis(basis_id):
+    """The fitted basis stored with a PCAResults row, or None."""
+    db = db_session()
+    row = db.query(PCAResults).filter(PCAResults.id == basis_id).first()
+    db.commit()
+    return row.basis if row else None
+
+def _plane_rows(image, times, zs):
+    # PlaneSummary rows of the planes in the ``times`` and ``zs`` ranges, selected in SQL.
+    sizes = image.plane_index["shape"]
+    query = db_session().query(
+        PlaneSummary.time, PlaneSummary.z, PlaneSummary.channel, PlaneSummary.count, PlaneSummary.sum,
+        PlaneSummary.sum_sq, PlaneSummary.min, PlaneSummary.max, PlaneSummary.hist_offset, PlaneSummary.histogram
+    ).filter(PlaneSummary.image_id == image.id)
+    for column, selected, size in ((PlaneSummary.time, times, sizes[0]), (PlaneSummary.z, zs, sizes[1])):
+        start, stop, step = selected.indices(size)
+        query = query.filter(column >= start, column < stop)
+        if step > 1:
+            query = query.filter((column - start) % step == 0)
+    return query
+
+def stored_plane_statistics(image, times=slice(None), zs=slice(None), histogram=True):
+    """
+    RunningStats of every channel over the planes of the ``times`` and ``zs``
+    ranges, merged from the plane index built at ingest, or None until it is
+    built. The whole stack comes from the totals stored with the index; a
+    range loads only its own PlaneSummary rows.
+    """
+    info = image.plane_index
+    if not info:
+        return None
+    whole = all(len(range(*selected.indices(size))) == size for selected, size in zip((times, zs), info["shape"]))
+    if whole and "totals" in info:
+        return merge_totals(info, histogram)
+    db = db_session()
+    rows = _plane_rows(image, times, zs).all()
+    db.commit()
+    return merge_rows(info, rows, histogram)
+
+def stored_plane_page(image, times, zs, offset, limit):
+    """``limit`` PlaneSummary rows of the ``times`` and ``zs`` ranges from ``offset`` on, in (T, Z, C) order."""
+    db = db_session()
+    rows = _plane_rows(image, times, zs).order_by(
+        PlaneSummary.time, PlaneSummary.z, PlaneSummary.channel
+    ).offset(offset).limit(limit).all()
+    db.commit()
+    return rows
+
+@celery.task(**LIGHT_TASK)
+def upload_image_task(file_path, request_id, content_hash=None):
+    """
+    Register an upload from its page index. Reading the whole file, to hash
+    it when ``content_hash`` is not given and to parse every IFD, is left to
+    build_upload_metadata_task on the heavy queue.
+    """
+    db = db_session()
+    if db.query(ImageMetadata.id).filter(ImageMetadata.request_id == request_id).first():
+        # Redelivered after the row was stored; only make sure the ingest steps are queued.
+        queue_ingest(request_id)
+        return
+
+    with ImageProcessor(file_path) as processor:
+        shape = processor.shape
+        page_index = processor.page_index
     metadata = {
         "request_id": request_id,
         "filename": os.path.basename(file_path),
-        "dimensions": str(processor.shape),
+        "dimensions": str(shape),
         "file_path": file_path,
-        "upload_time": datetime.now().isoformat()
+        "upload_time": datetime.now().isoformat(),
+        "page_index": page_index,
+        "content_hash": content_hash
     }
     
-    db = SessionLocal()
     db.add(ImageMetadata(**metadata))
+    try:
+        db.commit()
+    except IntegrityError:
+        # Another delivery of this message stored it first.
+        db.rollback()
+
+    queue_ingest(request_id)
+
+def queue_ingest(request_id):
+    """
+    Queue the content hash and TIFF metadata, the pyramid, the plane index
+    and, when enabled, the chunk store built from a stored upload.
+    """
+    build_upload_metadata_task.delay(request_id)
+    build_pyramid_task.delay(request_id)
+    build_plane_index_task.delay(request_id)
+    if Config.CHUNK_STORE_ENABLED:
+        build_chunk_store_task.delay(request_id)
+
+@celery.task(**HEAVY_TASK)
+def build_upload_metadata_task(request_id):
+    """Hash an upload unless it was hashed while streaming in, and parse every IFD into its TIFF metadata."""
+    image = find_image(request_id)
+
+    if not image:
+        return {"error": "Image not found"}
+    ensure_content_hash(image)
+    tiff_metadata = ensure_tiff_metadata(image)
+
+    return {"request_id": request_id, "image_id": image.id, "page_count": tiff_metadata["page_count"]}
+
+@celery.task(bind=True, **HEAVY_TASK)
+def build_pyramid_task(self, request_id):
+    image = find_image(request_id)
+
+    if not image:
+        return {"error": "Image not found"}
+    if image.pyramid and os.path.exists(image.pyramid["file_path"]):
+        return {"request_id": request_id, "image_id": image.id, "levels": len(image.pyramid["levels"])}
+
+    output_path = os.path.join(PYRAMID_DIR, f"{request_id}.ome.tif")
+    temp_path = atomic_output_path(output_path)
+    with ImageProcessor(image.file_path, image.page_index) as processor, timed('pyramid.build'):
+        pyramid = build_pyramid(processor.stack, temp_path, Config.PYRAMID_TILE_SIZE,
+                                progress=progress_reporter(self, request_id))
+    os.replace(temp_path, output_path)
+    record_written('pyramid', output_path)
+    pyramid["file_path"] = output_path
+
+    db = db_session()
+    db.query(ImageMetadata).filter(ImageMetadata.id == image.id).update({"pyramid": pyramid})
     db.commit()
-    db.close()
-    
 
-@celery.task
-def analyze_image_task(image_id, components):
-    db = SessionLocal()
-    image = db.query(ImageMetadata).filter(ImageMetadata.file_path.contains(image_id)).first()
-    db.close()
-    
+    return {"request_id": request_id, "image_id": image.id, "levels": len(pyramid["levels"])}
+
+@celery.task(bind=True, **HEAVY_TASK)
+def build_chunk_store_task(self, request_id):
+    """Rewrite an upload into its chunked analysis store, which processors then read instead."""
+    image = find_image(request_id)
+
+    if not image:
+        return {"error": "Image not found"}
+    if image.chunk_store and is_chunk_store(image.chunk_store["path"]):
+        return {"request_id": request_id, "image_id": image.id, "chunks": image.chunk_store["chunks"]}
+
+    output_path = os.path.join(CHUNK_STORE_DIR, f"{request_id}.zarr")
+    temp_path = atomic_output_path(output_path)
+    backend = ComputeBackend.from_config()
+    try:
+        with ImageProcessor(image.file_path, image.page_index) as processor, timed('chunk_store.write'):
+            store = write_chunk_store(processor.stack, temp_path, Config.CHUNK_STORE_CHUNKS,
+                                      Config.CHUNK_STORE_COMPRESSOR, backend.workers, backend.executor,
+                                      progress=progress_reporter(self, request_id))
+        # Left over from a delivery that stopped between moving the store into place and recording it.
+        shutil.rmtree(output_path, ignore_errors=True)
+        os.replace(temp_path, output_path)
+    finally:
+        shutil.rmtree(temp_path, ignore_errors=True)
+    store["path"] = output_path
+    record_written('chunk_store', output_path)
+
+    db = db_session()
+    db.query(ImageMetadata).filter(ImageMetadata.id == image.id).update({"chunk_store": store})
+    db.commit()
+
+    return {"request_id": request_id, "image_id": image.id, "chunks": store["chunks"]}
+
+@celery.task(bind=True, **HEAVY_TASK)
+def build_plane_index_task(self, request_id):
+    """Summarize every (T, Z, C) plane of an upload, for statistics that never read its pixels again."""
+    image = find_image(request_id)
+
     if not image:
         return {"error": "Image not found"}
+    if image.plane_index:
+        return {"request_id": request_id, "image_id": image.id, "bins": image.plane_index["bins"]}
+
+    backend = ComputeBackend.from_config()
+    with ImageProcessor(image.file_path, image.page_index) as processor, timed('plane_index.build'):
+        index = build_plane_index(processor.stack, Config.PLANE_INDEX_BINS, backend.workers, backend.executor,
+                                  progress=progress_reporter(self, request_id))
+
+    db = db_session()
+    # Rows of another delivery of this task are replaced, in the same transaction that marks the index built.
+    db.query(PlaneSummary).filter(PlaneSummary.image_id == image.id).delete()
+    db.execute(insert(PlaneSummary), index.rows(image.id))
+    db.query(ImageMetadata).filter(ImageMetadata.id == image.id).update({"plane_index": index.info()})
+    db.commit()
+
+    return {"request_id": request_id, "image_id": image.id, "bins": index.info()["bins"]}
+
+@celery.task(bind=True, **HEAVY_TASK)
+def analyze_image_task(self, image_id, components, record=True, dtype='float32', region=None, sample=1.0,
+                       basis_id=None):
+    """
+    PCA of one image, written as ``dtype`` (see OUTPUT_DTYPES); with
+    ``record`` False the caller stores the PCAResults row (see batches).
+    ``region`` (see ``region_bounds``) limits the fit and projection to T/Z
+    ranges and a Y/X region, ``sample`` fits on that fraction of its pixels,
+    and ``basis_id`` projects with the basis stored on that PCAResults row
+    instead of fitting.
+    """
+    image = find_image(image_id)
     
-    processor = ImageProcessor(image.file_path)
-    pca_result = processor.perform_pca(components)
+    if not image:
+        return {"request_id": image_id, "error": "Image not found"}
     
-    output_path = os.path.join(UPLOAD_DIR, f"pca_{image_id}.tif")
-    tifffile.imwrite(output_path, pca_result)
+    basis = None
+    if basis_id is not None:
+        basis = stored_basis(basis_id)
+        if not basis:
+            return {"request_id": image_id, "error": f"Stored PCA basis {basis_id} not found"}
+        components = basis["n_components"]
     
-    db = SessionLocal()
-    db.add(PCAResults(
-        image_id=image.id,
-        components=components,
-        file_path=output_path,
-        explained_variance=[]
-    ))
-    db.commit()
-    db.close()
+    content_hash = ensure_content_hash(image)
+    params = pca_params(components, dtype, region, sample, basis)
+    cached = result_cache.get(content_hash, "pca", params)
+    if cached:
+        result, output_path = cached["result"], cached["file_path"]
+    else:
+        output_path = result_cache.file_path(content_hash, "pca", params)
+        temp_path = atomic_output_path(output_path)
+        with ImageProcessor.from_image(image, backend=ComputeBackend.from_config()) as processor:
+            try:
+                pca_result, pca = processor.perform_pca(
+                    components, temp_path, dtype=dtype, region=region, sample=sample,
+                    pca=StreamingPCA.from_basis(basis) if basis else None, progress=progress_reporter(self, image_id)
+                )
+            except (IndexError, ValueError) as e:
+                return {"request_id": image_id, "error": str(e)}
+            shape, stored = list(pca_result.shape), pca_result.dtype
+            del pca_result
+        os.replace(temp_path, output_path)
+        record_written('pca', output_path)
+        result = {
+            "pca_result": shape,
+            "components": components,
+            "explained_variance": pca.explained_variance_.tolist(),
+            "dtype": stored.name,
+            "basis": pca.basis()
+        }
+        if stored.kind != 'f':
+            # The projected values mapped onto the integer type's minimum and maximum, per component.
+            result["value_range"] = np.transpose(pca.projection_range()).tolist()
+        selection = pca_selection(region, sample, basis_id)
+        if selection:
+            result["selection"] = selection
+        result_cache.put(content_hash, "pca", params, result=result, file_path=output_path)
+    
+    result = dict(result, request_id=image_id, image_id=image.id, file_path=output_path)
+    if record:
+        db = db_session()
+        recorded = db.query(PCAResults).filter(
+            PCAResults.image_id == image.id, PCAResults.file_path == output_path
+        ).first()
+        if not recorded:
+            recorded = PCAResults(**pca_row(image.id, result))
+            db.add(recorded)
+            db.commit()
+        result["pca_result_id"] = recorded.id
     
-    return {"file_path": output_path}
+    return result
 
-@celery.task
-def get_statistics_task(image_id):
-    db = SessionLocal()
-    image = db.query(ImageMetadata).filter(ImageMetadata.file_path.contains(image_id)).first()
-    db.close()
+@celery.task(bind=True, **HEAVY_TASK)
+def get_statistics_task(self, image_id, record=True):
+    """Per-channel statistics of one image; with ``record`` False the caller stores the rows."""
+    image = find_image(image_id)
     
     if not image:
-        return {"error": "Image not found"}
+        return {"request_id": image_id, "error": "Image not found"}
+    
+    content_hash = ensure_content_hash(image)
+    cached = result_cache.get(content_hash, "statistics", {})
+    merged = None if cached else stored_plane_statistics(image, histogram=False)
+    if cached:
+        stats = cached["result"]
+    elif merged is not None:
+        # Merged from the plane index summarized at ingest, without reading a pixel.
+        stats = merged.to_list()
+    else:
+        with ImageProcessor.from_image(image, backend=ComputeBackend.from_config()) as processor:
+            stats = processor.calculate_statistics(progress=progress_reporter(self, image_id))
+        result_cache.put(content_hash, "statistics", {}, result=stats)
+    
+    db = db_session()
+    if record and not db.query(ImageStatistics.id).filter(ImageStatistics.image_id == image.id).first():
+        # One multi-row INSERT rather than a flush per channel.
+        db.execute(insert(ImageStatistics), statistics_rows(image.id, stats))
+        db.commit()
+    
+    return {"request_id": image_id, "image_id": image.id, "statistics": stats}
+
+@celery.task(bind=True, **HEAVY_TASK)
+def segment_image_task(self, image_id, channel, method):
+    image = find_image(image_id)
+    
+    if not image:
+        return {"request_id": image_id, "error": "Image not found"}
     
-    processor = ImageProcessor(image.file_path)
-    stats = processor.calculate_statistics()
+    content_hash = ensure_content_hash(image)
+    params = {"channel": channel, "method": method}
+    cached = result_cache.get(content_hash, "segmentation", params)
+    if cached:
+        result, output_path = cached["result"], cached["file_path"]
+    else:
+        output_path = result_cache.file_path(content_hash, "segmentation", params)
+        temp_path = atomic_output_path(output_path)
+        try:
+            with ImageProcessor.from_image(image, backend=ComputeBackend.from_config()) as processor:
+                threshold = processor.save_segmentation(channel, temp_path, method,
+                                                        progress=progress_reporter(self, image_id))
+                shape = list(processor.shape[:2] + processor.shape[3:])
+        except (IndexError, ValueError) as e:
+            return {"request_id": image_id, "error": str(e)}
+        os.replace(temp_path, output_path)
+        record_written('segmentation', output_path)
+        result = {"mask": shape, "channel": channel, "method": method, "threshold": threshold}
+        result_cache.put(content_hash, "segmentation", params, result=result, file_path=output_path)
     
-    db = SessionLocal()
-    for stat in stats:
-        db.add(ImageStatistics(
+    db = db_session()
+    recorded = db.query(SegmentationResults).filter(
+        SegmentationResults.image_id == image.id,
+        SegmentationResults.channel == channel,
+        SegmentationResults.method == method
+    ).first()
+    if not recorded:
+        db.add(SegmentationResults(
             image_id=image.id,
-            channel=stat['channel'],
-            mean=stat['mean'],
-            std=stat['std'],
-            min=stat['min'],
-            max=stat['max']
+            channel=channel,
+            method=method,
+            threshold=result["threshold"],
+            file_path=output_path
         ))
+        db.commit()
+    
+    return dict(result, request_id=image_id, image_id=image.id, file_path=output_path)
+
+@celery.task(bind=True, **HEAVY_TASK)
+def accumulate_pca_task(self, image_id):
+    """Channel mean and co-moment of one image, merged into a batch's shared basis."""
+    image = find_image(image_id)
+    
+    if not image:
+        return {"request_id": image_id, "error": "Image not found"}
+    
+    content_hash = ensure_content_hash(image)
+    cached = result_cache.get(content_hash, "pca_accumulator", {})
+    if cached:
+        accumulator = cached["result"]
+    else:
+        with ImageProcessor.from_image(image, backend=ComputeBackend.from_config()) as processor:
+            accumulator = processor.accumulate_pca(progress=progress_reporter(self, image_id)).accumulator()
+        result_cache.put(content_hash, "pca_accumulator", {}, result=accumulator)
+    
+    return {"request_id": image_id, "image_id": image.id, "accumulator": accumulator}
+
+@celery.task(bind=True, **LIGHT_TASK)
+def shared_pca_basis_task(self, accumulators, batch_id, components):
+    """Merge the accumulations of a batch's images into one PCA basis stored on the batch."""
+    errors = [f"{a['request_id']}: {a['error']}" for a in accumulators if a.get("error")]
+    channels = {len(a["accumulator"]["mean"]) for a in accumulators if not a.get("error")}
+    if errors:
+        basis = {"error": "Shared PCA basis not fitted, " + "; ".join(errors)}
+    elif len(channels) > 1:
+        basis = {"error": f"Shared PCA basis needs equal channel counts, got {sorted(channels)}"}
+    else:
+        pca = StreamingPCA(components)
+        for accumulator in accumulators:
+            pca.merge(StreamingPCA.from_accumulator(components, accumulator["accumulator"]))
+        try:
+            basis = pca.finalize().basis()
+        except ValueError as e:
+            basis = {"error": str(e)}
+    
+    db = db_session()
+    db.query(BatchJob).filter(BatchJob.batch_id == batch_id).update({"shared_basis": basis})
+    db.commit()
+    
+    return {"batch_id": batch_id, "error": basis.get("error")}
+
+@celery.task(bind=True, **HEAVY_TASK)
+def apply_pca_basis_task(self, image_id, batch_id):
+    """Project one image onto its batch's shared PCA basis."""
+    db = db_session()
+    batch = db.query(BatchJob).filter(BatchJob.batch_id == batch_id).first()
     db.commit()
-    db.close()
+    basis = batch.shared_basis if batch else None
+    if not basis or basis.get("error"):
+        return {"request_id": image_id, "error": (basis or {}).get("error", "Shared PCA basis not found")}
     
-    return stats
+    image = find_image(image_id)
+    
+    if not image:
+        return {"request_id": image_id, "error": "Image not found"}
+    
+    content_hash = ensure_content_hash(image)
+    params = {"components": basis["n_components"], "basis": cache_key(None, "pca_basis", basis)}
+    cached = result_cache.get(content_hash, "pca_shared", params)
+    if cached:
+        result, output_path = cached["result"], cached["file_path"]
+    else:
+        output_path = result_cache.file_path(content_hash, "pca_shared", params)
+        temp_path = atomic_output_path(output_path)
+        with ImageProcessor.from_image(image, backend=ComputeBackend.from_config()) as processor:
+            try:
+                pca_result, _ = processor.perform_pca(output_path=temp_path, pca=StreamingPCA.from_basis(basis),
+                                                      progress=progress_reporter(self, image_id))
+            except ValueError as e:
+                return {"request_id": image_id, "error": str(e)}
+            shape, stored = list(pca_result.shape), pca_result.dtype
+            del pca_result
+        os.replace(temp_path, output_path)
+        record_written('pca', output_path)
+        result = {
+            "pca_result": shape,
+            "components": basis["n_components"],
+            "explained_variance": basis["explained_variance"],
+            "dtype": stored.name
+        }
+        result_cache.put(content_hash, "pca_shared", params, result=result, file_path=output_path)
+    
+    return dict(result, request_id=image_id, image_id=image.id, file_path=output_path)
+
+@celery.task(bind=True, **LIGHT_TASK)
+def finalize_batch_task(self, results, batch_id):
+    """Store a batch's per-item results, inserting statistics and PCA rows in bulk."""
+    db = db_session()
+    batch = db.query(BatchJob).filter(BatchJob.batch_id == batch_id).first()
+    if batch.status == "finished":
+        succeeded = sum(1 for item in batch.items if item["state"] == "SUCCESS")
+        return {"batch_id": batch_id, "succeeded": succeeded, "failed": len(batch.items) - succeeded}
+    items = [dict(item, state="FAILURE" if result.get("error") else "SUCCESS", result=result)
+             for item, result in zip(batch.items, results)]
+    done = [item for item in items if item["state"] == "SUCCESS"]
+    
+    image_ids = {item["result"]["image_id"] for item in done}
+    have_statistics = {image_id for (image_id,) in db.query(ImageStatistics.image_id).filter(
+        ImageStatistics.image_id.in_(image_ids)).distinct()}
+    # PCA outputs are recorded once per file, as by analyze_image_task.
+    have_pca = {tuple(row) for row in db.query(PCAResults.image_id, PCAResults.file_path).filter(
+        PCAResults.image_id.in_(image_ids))}
+    statistics, pca = [], []
+    for item in done:
+        result = item["result"]
+        if item["operation"] == "statistics" and result["image_id"] not in have_statistics:
+            statistics.extend(statistics_rows(result["image_id"], result["statistics"]))
+            have_statistics.add(result["image_id"])
+        elif item["operation"] == "pca" and (result["image_id"], result["file_path"]) not in have_pca:
+            if batch.shared_basis:
+                result = dict(result, basis=batch.shared_basis, selection=pca_selection(batch_id=batch_id))
+            pca.append(pca_row(result["image_id"], result))
+            have_pca.add((result["image_id"], result["file_path"]))
+    if statistics:
+        db.execute(insert(ImageStatistics), statistics)
+    if pca:
+        db.execute(insert(PCAResults), pca)
+    
+    batch.items = items
+    batch.status = "finished"
+    batch.finished_time = datetime.now().isoformat()
+    db.commit()
+    
+    return {"batch_id": batch_id, "succeeded": len(done), "failed": len(items) - len(done)}
+
+@celery.task(**LIGHT_TASK)
+def fail_batch_task(request, exc, traceback, batch_id):
+    """Error callback of a batch's chord: an item raised, so the results were not collected."""
+    db = db_session()
+    db.query(BatchJob).filter(BatchJob.batch_id == batch_id).update({
+        "status": "failed",
+        "finished_time": datetime.now().isoformat()
+    })
+    db.commit()
 
 @celery.task
 def example_task():
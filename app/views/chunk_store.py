@@ -0,0 +1,258 @@
+# chunk_store.py - Chunked, compressed (T, Z, C, Y, X) analysis stores in the Zarr v2 directory layout
+import json
+import os
+import time
+import zlib
+import numpy as np
+from .metrics import BYTES_READ, DECODE_SECONDS
+from .parallel import ComputeBackend
+from .sub_stack import SubStack
+from .tiff_stack import AXES, TiffStack
+
+CHUNK_STORE_DIR = os.path.join("media", "stores")
+COMPRESSORS = ('zlib', 'none')
+METADATA_FILE = '.zarray'
+ZLIB_LEVEL = 1
+
+
+def is_chunk_store(path):
+    return os.path.isfile(os.path.join(path, METADATA_FILE))
+
+
+def open_stack(file_path, page_index=None):
+    """
+    Open a chunk store directory as a ChunkStore and anything else as a
+    TiffStack; a SubStack's ``page_index`` reopens the same region of it.
+    """
+    if page_index is not None and "region" in page_index:
+        return SubStack(open_stack(file_path, page_index["source"]), page_index["region"], owned=True)
+    if is_chunk_store(file_path):
+        return ChunkStore(file_path)
+    return TiffStack(file_path, page_index)
+
+
+def chunk_shape(shape, chunks):
+    """``chunks`` clipped to ``shape``, at least 1 along every axis."""
+    return tuple(max(1, min(int(size), n)) for size, n in zip(chunks, shape))
+
+
+def _as_slice(positions):
+    # Positions selected from one chunk by a slice are always an arithmetic progression.
+    step = int(positions[1] - positions[0]) if len(positions) > 1 else 1
+    return slice(int(positions[0]), int(positions[-1]) + 1, step)
+
+
+def _encode(chunk, compressor):
+    data = np.ascontiguousarray(chunk).tobytes()
+    return zlib.compress(data, ZLIB_LEVEL) if compressor == 'zlib' else data
+
+
+def _write_blocks(stack, path, blocks, chunks, compressor):
+    # Read the planes of each (T, Z, C) block of chunks once, then write its Y/X chunks.
+    height, width = stack.shape[3:]
+    block = np.zeros(chunks[:3] + (height, width), dtype=stack.dtype)
+    padded = np.zeros(chunks, dtype=stack.dtype)
+    stored = 0
+    pages = {}
+    for t0, z0, c0 in blocks:
+        extent = [min(size, n - start) for size, n, start in zip(chunks[:3], stack.shape[:3], (t0, z0, c0))]
+        if extent != list(chunks[:3]):
+            block[:] = 0
+        for dt in range(extent[0]):
+            for dz in range(extent[1]):
+                for dc in range(extent[2]):
+                    block[dt, dz, dc] = stack.plane(t0 + dt, z0 + dz, c0 + dc, pages, cache=False)
+        for y0 in range(0, height, chunks[3]):
+            for x0 in range(0, width, chunks[4]):
+                chunk = block[..., y0:y0 + chunks[3], x0:x0 + chunks[4]]
+                if chunk.shape != chunks:
+                    # Edge chunks are stored full size, padded with the fill value.
+                    padded[:] = 0
+                    padded[..., :chunk.shape[3], :chunk.shape[4]] = chunk
+                    chunk = padded
+                key = (t0 // chunks[0], z0 // chunks[1], c0 // chunks[2], y0 // chunks[3], x0 // chunks[4])
+                data = _encode(chunk, compressor)
+                with open(os.path.join(path, '.'.join(map(str, key))), 'wb') as f:
+                    f.write(data)
+                stored += len(data)
+    return stored
+
+
+def _write_blocks_file(file_path, page_index, path, blocks, chunks, compressor):
+    # Runs in a worker: each opens its own handle and writes whole chunks, so no file is shared.
+    with open_stack(file_path, page_index) as stack:
+        return _write_blocks(stack, path, blocks, chunks, compressor)
+
+
+def write_chunk_store(stack, path, chunks=(1, 1, 1, 256, 256), compressor='zlib', workers=1, executor='thread',
+                      progress=None):
+    """
+    Rewrite ``stack`` into a chunk store directory at ``path``.
+
+    The layout is a Zarr v2 array (``.zarray`` plus one file per chunk,
+    named by its dot-separated chunk coordinates), so zarr can open it too.
+    ``chunks`` is the (T, Z, C, Y, X) chunk shape, clipped to the stack.
+    Chunks are compressed with fast zlib (level 1), or stored raw with
+    'none', which lets readers memory-map them. Each (T, Z, C) block of
+    chunks is read once, plane by plane; with several ``workers`` blocks
+    are written in parallel. ``progress(done, total)`` counts blocks.
+
+    Returns the description stored with ``ImageMetadata``.
+    """
+    if compressor not in COMPRESSORS:
+        raise ValueError(f"Unknown compressor {compressor!r}, expected one of {', '.join(COMPRESSORS)}")
+    chunks = chunk_shape(stack.shape, chunks)
+    os.makedirs(path)
+    with open(os.path.join(path, METADATA_FILE), 'w') as f:
+        json.dump({
+            "zarr_format": 2,
+            "shape": list(stack.shape),
+            "chunks": list(chunks),
+            "dtype": stack.dtype.str,
+            "compressor": {"id": "zlib", "level": ZLIB_LEVEL} if compressor == 'zlib' else None,
+            "fill_value": 0,
+            "order": "C",
+            "filters": None,
+            "dimension_separator": "."
+        }, f, indent=2)
+    with open(os.path.join(path, '.zattrs'), 'w') as f:
+        json.dump({"axes": list(AXES)}, f)
+
+    blocks = [(t, z, c) for t in range(0, stack.shape[0], chunks[0])
+              for z in range(0, stack.shape[1], chunks[1]) for c in range(0, stack.shape[2], chunks[2])]
+    backend = ComputeBackend(executor, min(workers, len(blocks)))
+    if backend.parallel:
+        groups = [[blocks[i] for i in group]
+                  for group in np.array_split(np.arange(len(blocks)), min(len(blocks), 4 * backend.workers))]
+        stored = sum(backend.run(_write_blocks_file, [
+            (stack.file_path, stack.page_index, path, group, chunks, compressor) for group in groups
+        ], sizes=[len(group) for group in groups], progress=progress))
+    else:
+        stored = 0
+        for i, block in enumerate(blocks):
+            stored += _write_blocks(stack, path, [block], chunks, compressor)
+            if progress is not None:
+                progress(i + 1, len(blocks))
+    return {"chunks": list(chunks), "compressor": compressor, "stored_bytes": stored}
+
+
+class ChunkStore:
+    """
+    Read-only (T, Z, C, Y, X) view of a store written by ``write_chunk_store``.
+
+    Offers the reading interface of TiffStack (``plane``, ``read``,
+    ``iter_planes``, ``asarray``), plus ``read_region`` for any strided
+    sub-volume. Every read decodes only the chunks it overlaps, so a Y/X
+    region or a per-pixel time course costs a few chunks, not whole planes.
+    Raw chunks are memory-mapped; compressed ones are decoded and, when
+    ``page_cache`` is set (see ``StackCache``), cached under
+    ``(cache_key, chunk coordinates)``.
+    """
+
+    def __init__(self, path, page_index=None):
+        self.file_path = path
+        self.page_index = None
+        self.page_cache = None
+        self.cache_key = None
+        with open(os.path.join(path, METADATA_FILE)) as f:
+            metadata = json.load(f)
+        self.shape = tuple(metadata["shape"])
+        self.ndim = len(self.shape)
+        self.dtype = np.dtype(metadata["dtype"])
+        self.chunks = tuple(metadata["chunks"])
+        self.compressor = (metadata["compressor"] or {"id": "none"})["id"]
+        if self.compressor not in COMPRESSORS or metadata.get("filters"):
+            raise ValueError(f"Unsupported chunk store encoding {metadata['compressor']!r} in {path}")
+        self.fill_value = metadata.get("fill_value") or 0
+
+    @property
+    def is_memmapped(self):
+        return self.compressor == 'none'
+
+    def read_chunk(self, key, cache=True):
+        """Decode the chunk at chunk coordinates ``key``, shaped like ``chunks``."""
+        if self.page_cache is not None:
+            chunk = self.page_cache.get((self.cache_key, key))
+            if chunk is not None:
+                return chunk
+        path = os.path.join(self.file_path, '.'.join(map(str, key)))
+        if not os.path.exists(path):
+            # Zarr leaves chunks holding only the fill value unwritten.
+            return np.full(self.chunks, self.fill_value, dtype=self.dtype)
+        if self.compressor == 'none':
+            chunk = np.memmap(path, dtype=self.dtype, mode='r', shape=self.chunks)
+            BYTES_READ.inc(chunk.nbytes, 'memmap')
+            return chunk
+        start = time.perf_counter()
+        with open(path, 'rb') as f:
+            chunk = np.frombuffer(zlib.decompress(f.read()), dtype=self.dtype).reshape(self.chunks)
+        DECODE_SECONDS.observe(time.perf_counter() - start, 'chunk_store')
+        BYTES_READ.inc(chunk.nbytes, 'chunk_store')
+        if cache and self.page_cache is not None:
+            self.page_cache.put((self.cache_key, key), chunk)
+        return chunk
+
+    def _chunk(self, key, _chunks, cache):
+        # ``_chunks`` keeps the chunks of the current (T, Z, C) block for consecutive plane reads.
+        if _chunks is None:
+            return self.read_chunk(key, cache)
+        if key not in _chunks:
+            if any(held[:3] != key[:3] for held in _chunks):
+                _chunks.clear()
+            _chunks[key] = self.read_chunk(key, cache)
+        return _chunks[key]
+
+    def read_region(self, index, _chunks=None, cache=True):
+        """
+        Read ``stack[index]`` for a 5-tuple of ints and slices (positive
+        steps) in (T, Z, C, Y, X) order; integer positions drop their axis.
+        Only the chunks holding selected positions are decoded.
+        """
+        positions = [np.arange(n)[s] if isinstance(s, slice) else np.array([s]) for n, s in zip(self.shape, index)]
+        out = np.empty(tuple(len(p) for p in positions), dtype=self.dtype)
+        # Per axis: (chunk number, output slice, in-chunk slice) of every chunk touched.
+        spans = []
+        for selected, size in zip(positions, self.chunks):
+            numbers = selected // size
+            spans.append([(int(n), _as_slice(np.flatnonzero(numbers == n)), _as_slice(selected[numbers == n] - n * size))
+                          for n in np.unique(numbers)])
+        for t in spans[0]:
+            for z in spans[1]:
+                for c in spans[2]:
+                    for y in spans[3]:
+                        for x in spans[4]:
+                            parts = (t, z, c, y, x)
+                            chunk = self._chunk(tuple(p[0] for p in parts), _chunks, cache)
+                            out[tuple(p[1] for p in parts)] = chunk[tuple(p[2] for p in parts)]
+        fixed = tuple(axis for axis, s in enumerate(index) if not isinstance(s, slice))
+        return out.squeeze(axis=fixed) if fixed else out
+
+    def plane(self, time, z, channel, _pages=None, cache=True):
+        """Return one (Y, X) plane, decoding only the chunks that hold it."""
+        return self.read_region((time, z, channel, slice(None), slice(None)), _pages, cache)
+
+    def read(self, time=None, z=None, channel=None):
+        """Sub-stack selected by fixing any of time, z and channel; see TiffStack.read."""
+        index = tuple(slice(None) if value is None else value for value in (time, z, channel))
+        return self.read_region(index + (slice(None), slice(None)), {})
+
+    def asarray(self):
+        return self.read_region((slice(None),) * 5, {}, cache=False)
+
+    def iter_planes(self, channel=None, cache=False):
+        """Yield (time, z, channel, plane) for every plane."""
+        channels = range(self.shape[2]) if channel is None else [channel]
+        chunks = {}
+        for t in range(self.shape[0]):
+            for z in range(self.shape[1]):
+                for c in channels:
+                    yield t, z, c, self.plane(t, z, c, chunks, cache)
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
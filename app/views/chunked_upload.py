@@ -0,0 +1,180 @@
+# chunked_upload.py - Resumable, streamed uploads written straight to disk
+import hashlib
+import json
+import os
+import struct
+import threading
+from datetime import datetime
+import tifffile
+from .stack_cache import stack_cache
+
+UPLOAD_DIR = os.path.join("media", "uploads")
+BLOCK_SIZE = 1024 * 1024
+TIFF_MAGIC = (b'II*\x00', b'MM\x00*', b'II+\x00', b'MM\x00+')
+HEADER_BYTES = 16  # BigTIFF; a classic TIFF header is 8
+
+# Running SHA-256 per upload for chunks that arrive in order at this process.
+# Hash state cannot be shared between workers, so finalize re-reads the file
+# whenever the chunks were not all hashed here.
+_hashers = {}
+_hashers_lock = threading.Lock()
+
+
+class UploadError(Exception):
+    def __init__(self, message, status=400, offset=None):
+        super().__init__(message)
+        self.status = status
+        self.offset = offset
+
+
+def check_header(head, size=None):
+    """
+    Raise UploadError unless ``head``, the first bytes of an upload, can
+    start a TIFF or BigTIFF file. A shorter prefix is checked as far as it
+    goes, so a header split over several chunks is judged as it arrives.
+    The first IFD must follow the header and, with a declared ``size``, lie
+    inside the file.
+    """
+    if not any(magic.startswith(head[:4]) for magic in TIFF_MAGIC):
+        raise UploadError("Invalid file format")
+    if len(head) < 8:
+        return
+    order = '<' if head[:2] == b'II' else '>'
+    if head[2:4] in (b'*\x00', b'\x00*'):
+        header, (ifd,) = 8, struct.unpack(order + 'I', head[4:8])
+    else:
+        offset_size, reserved = struct.unpack(order + 'HH', head[4:8])
+        if offset_size != 8 or reserved != 0:
+            raise UploadError("Invalid BigTIFF header")
+        if len(head) < 16:
+            return
+        header, (ifd,) = 16, struct.unpack(order + 'Q', head[8:16])
+    if ifd < header or (size is not None and ifd >= size):
+        raise UploadError("Invalid file format: first IFD offset is outside the file")
+
+
+def _state_path(request_id):
+    return os.path.join(UPLOAD_DIR, f"{request_id}.json")
+
+
+def part_path(request_id):
+    return os.path.join(UPLOAD_DIR, f"{request_id}.part")
+
+
+def start_upload(request_id, filename, size=None):
+    os.makedirs(UPLOAD_DIR, exist_ok=True)
+    state = {
+        "request_id": request_id,
+        "filename": filename,
+        "size": size,
+        "created": datetime.now().isoformat()
+    }
+    with open(_state_path(request_id), 'w') as f:
+        json.dump(state, f)
+    open(part_path(request_id), 'wb').close()
+    with _hashers_lock:
+        _hashers[request_id] = (hashlib.sha256(), 0)
+    return state
+
+
+def upload_state(request_id):
+    """Return the stored state with the current ``offset``, or None for an unknown upload."""
+    try:
+        with open(_state_path(request_id)) as f:
+            state = json.load(f)
+    except FileNotFoundError:
+        return None
+    state["offset"] = os.path.getsize(part_path(request_id))
+    return state
+
+
+def write_chunk(request_id, offset, stream):
+    """
+    Append the body of ``stream`` at ``offset`` and return the new offset.
+
+    Chunks must continue where the stored data ends; a chunk starting earlier
+    (a retry whose acknowledgement was lost) replaces everything after its
+    offset. The header is checked by ``check_header`` as its bytes arrive,
+    however the chunks split it.
+    """
+    state = upload_state(request_id)
+    if state is None:
+        raise UploadError("Upload not found", status=404)
+    if offset > state["offset"]:
+        raise UploadError("Chunk offset is past the end of the received data", status=409,
+                          offset=state["offset"])
+
+    with _hashers_lock:
+        hasher, hashed = _hashers.pop(request_id, (None, None))
+    if hashed != offset:
+        hasher = hashlib.sha256() if offset == 0 else None
+
+    written = offset
+    try:
+        with open(part_path(request_id), 'r+b') as f:
+            head = f.read(min(offset, HEADER_BYTES))
+            f.seek(offset)
+            f.truncate()
+            for block in iter(lambda: stream.read(BLOCK_SIZE), b''):
+                if len(head) < HEADER_BYTES:
+                    head += block[:HEADER_BYTES - len(head)]
+                    try:
+                        check_header(head, state["size"])
+                    except UploadError:
+                        f.truncate(0)
+                        raise
+                f.write(block)
+                if hasher is not None:
+                    hasher.update(block)
+                written += len(block)
+    finally:
+        # Keep hashing across a dropped connection: the client resumes at ``written``.
+        if hasher is not None:
+            with _hashers_lock:
+                _hashers[request_id] = (hasher, written)
+
+    if state["size"] is not None and written > state["size"]:
+        raise UploadError("Upload is larger than its declared size", offset=written)
+    return written
+
+
+def save_upload(stream, file_path):
+    """Write a whole upload from ``stream`` to ``file_path``, returning the SHA-256 taken on the way."""
+    digest = hashlib.sha256()
+    with open(file_path, 'wb') as f:
+        for block in iter(lambda: stream.read(BLOCK_SIZE), b''):
+            f.write(block)
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def finish_upload(request_id, file_path):
+    """
+    Move a complete upload to ``file_path``, once tifffile can parse its
+    header and first IFD.
+
+    Returns its SHA-256, or None when the chunks were not all hashed by this
+    process and the file has to be read again.
+    """
+    state = upload_state(request_id)
+    if state is None:
+        raise UploadError("Upload not found", status=404)
+    if state["offset"] == 0 or (state["size"] is not None and state["offset"] != state["size"]):
+        raise UploadError("Upload is incomplete", status=409, offset=state["offset"])
+    try:
+        with tifffile.TiffFile(part_path(request_id)):
+            pass
+    except (tifffile.TiffFileError, ValueError, struct.error) as e:
+        raise UploadError(f"Invalid file format: {e}")
+
+    with _hashers_lock:
+        hasher, hashed = _hashers.pop(request_id, (None, None))
+    if hasher is not None and hashed == state["offset"]:
+        content_hash = hasher.hexdigest()
+    else:
+        content_hash = None
+
+    os.replace(part_path(request_id), file_path)
+    stack_cache.invalidate(file_path)
+    os.remove(_state_path(request_id))
+    return content_hash
@@ -0,0 +1,53 @@
+# dtypes.py - Dtype policy for chunked arithmetic and derived images
+import numpy as np
+
+# Output types of a PCA projection; 'source' rescales to the image's own integer type
+OUTPUT_DTYPES = ('float32', 'float64', 'source')
+
+
+def working_dtype(dtype):
+    """
+    Float type that chunks of ``dtype`` are converted to for arithmetic.
+
+    Integers of up to 16 bits and floats of up to 32 bits are represented
+    exactly in float32, so they never pay for a float64 copy; wider types
+    keep float64.
+    """
+    dtype = np.dtype(dtype)
+    if (dtype.kind in 'uib' and dtype.itemsize <= 2) or (dtype.kind == 'f' and dtype.itemsize <= 4):
+        return np.dtype(np.float32)
+    return np.dtype(np.float64)
+
+
+def sum_dtype(dtype):
+    """Accumulator for sums over a chunk: exact int64 for integers of up to 32 bits, float64 otherwise."""
+    dtype = np.dtype(dtype)
+    return np.dtype(np.int64) if dtype.kind in 'uib' and dtype.itemsize <= 4 else np.dtype(np.float64)
+
+
+def output_dtype(name, source_dtype):
+    """Resolve one of OUTPUT_DTYPES against the dtype of the source image."""
+    if name not in OUTPUT_DTYPES:
+        raise ValueError(f"Unknown output dtype {name!r}, expected one of {', '.join(OUTPUT_DTYPES)}")
+    return np.dtype(source_dtype if name == 'source' else name)
+
+
+def rescale(values, dtype, low, high):
+    """
+    Convert float ``values`` to ``dtype``. For an integer type, each column
+    is mapped linearly from [low, high] onto the type's full range, rounded
+    and clipped, so that ``value = low + (stored - dtype_min) * (high - low)
+    / (dtype_max - dtype_min)`` recovers it; float types are cast.
+    """
+    dtype = np.dtype(dtype)
+    if dtype.kind == 'f':
+        return values.astype(dtype, copy=False)
+    info = np.iinfo(dtype)
+    low = np.asarray(low, dtype=values.dtype)
+    span = np.asarray(high, dtype=values.dtype) - low
+    scale = (float(info.max) - float(info.min)) / np.where(span > 0, span, 1)
+    scaled = (values - low) * scale.astype(values.dtype)
+    scaled += values.dtype.type(info.min)
+    np.rint(scaled, out=scaled)
+    np.clip(scaled, info.min, info.max, out=scaled)
+    return scaled.astype(dtype)
@@ -0,0 +1,79 @@
+# encoding.py - In-memory TIFF, PNG and raw encodings of arrays for HTTP responses
+import io
+import numpy as np
+import tifffile
+from PIL import Image
+
+FORMATS = ('tiff', 'png', 'raw')
+MIMETYPES = {'tiff': 'image/tiff', 'png': 'image/png', 'raw': 'application/octet-stream'}
+AUTO_CONTRAST_PERCENTILES = (0.5, 99.5)
+
+
+def parse_window(value):
+    """``None``, ``'auto'`` or ``(low, high)`` from a ``window`` query parameter."""
+    if value is None or value == 'auto':
+        return value
+    try:
+        low, high = (float(v) for v in value.split(','))
+    except ValueError:
+        raise ValueError(f"Invalid window {value!r}, expected 'auto' or 'low,high'")
+    if not high > low:
+        raise ValueError(f"Invalid window {value!r}, high must be greater than low")
+    return low, high
+
+
+def apply_window(data, window):
+    """
+    Map ``window`` = (low, high) linearly onto 0-255 and return uint8 data.
+
+    ``'auto'`` stretches between the 0.5th and 99.5th percentiles, so a few
+    hot pixels do not flatten the contrast of 16-bit images.
+    """
+    if window == 'auto':
+        low, high = (float(v) for v in np.percentile(data, AUTO_CONTRAST_PERCENTILES))
+        if high <= low:
+            high = low + 1
+    else:
+        low, high = window
+    scaled = (np.asarray(data, dtype=np.float32) - low) * (255 / (high - low))
+    return np.clip(scaled, 0, 255, out=scaled).round().astype(np.uint8)
+
+
+def encode_array(data, fmt='tiff', window=None):
+    """
+    Encode ``data`` as 'tiff', 'png' or 'raw'. Returns (body, mimetype, headers).
+
+    PNG needs a 2-D plane; 8- and 16-bit data is written as is unless a
+    ``window`` is given, anything else is auto-contrasted to 8 bits. Raw is
+    little-endian C-order bytes, described by the ``X-Array-Shape`` and
+    ``X-Array-Dtype`` headers. A ``window`` also applies to TIFF and raw
+    output, which are then uint8.
+    """
+    if fmt not in FORMATS:
+        raise ValueError(f"Unsupported format {fmt!r}, expected one of {', '.join(FORMATS)}")
+    data = np.asarray(data)
+    if fmt == 'png':
+        if data.ndim != 2:
+            raise ValueError(f"PNG needs a single 2-D plane, got shape {data.shape}")
+        if window is None and data.dtype not in (np.uint8, np.uint16):
+            window = 'auto'
+    if window is not None:
+        data = apply_window(data, window)
+
+    headers = {}
+    if fmt == 'png':
+        buffer = io.BytesIO()
+        Image.fromarray(np.ascontiguousarray(data)).save(buffer, format='PNG')
+        body = buffer.getvalue()
+    elif fmt == 'tiff':
+        buffer = io.BytesIO()
+        tifffile.imwrite(buffer, data, compression='zlib', photometric='minisblack')
+        body = buffer.getvalue()
+    else:
+        data = np.ascontiguousarray(data, dtype=data.dtype.newbyteorder('<'))
+        body = data.tobytes()
+        headers = {
+            "X-Array-Shape": ",".join(str(n) for n in data.shape),
+            "X-Array-Dtype": data.dtype.str
+        }
+    return body, MIMETYPES[fmt], headers
@@ -0,0 +1,159 @@
+# hyperslab.py - Strided sub-volumes and projections of a (T, Z, C, Y, X) stack
+import numpy as np
+from .parallel import ComputeBackend
+from .chunk_store import ChunkStore, open_stack
+
+PROJECTIONS = ('max', 'mean')
+AXIS_NAMES = ('time', 'z', 'channel', 'y', 'x')
+
+
+def parse_index(value, size, name):
+    """
+    Parse ``'i'`` or ``'start:stop:step'`` (any part optional) for an axis of ``size``.
+
+    An integer selects one position and drops the axis, a range keeps it,
+    as in NumPy indexing. Raises ValueError for malformed input and
+    IndexError for positions outside the axis.
+    """
+    if value is None or value == '':
+        return slice(None)
+    try:
+        parts = [int(p) if p.strip() else None for p in value.split(':')]
+    except ValueError:
+        raise ValueError(f"Invalid {name} selection {value!r}, expected 'i' or 'start:stop:step'")
+    if len(parts) == 1:
+        if not 0 <= parts[0] < size:
+            raise IndexError(f"{name.capitalize()} index {parts[0]} is out of bounds with size {size}")
+        return parts[0]
+    if len(parts) > 3 or (len(parts) == 3 and parts[2] is not None and parts[2] <= 0):
+        raise ValueError(f"Invalid {name} selection {value!r}, expected 'start:stop:step' with a positive step")
+    selected = slice(*parts)
+    if not len(range(*selected.indices(size))):
+        raise IndexError(f"{name.capitalize()} selection {value!r} is empty for size {size}")
+    return selected
+
+
+def hyperslab_shape(stack, index, projection=None, axis=None):
+    """Output shape of ``read_hyperslab`` for the same arguments."""
+    return tuple(len(range(*selected.indices(size)))
+                 for i, (size, selected) in enumerate(zip(stack.shape, index))
+                 if isinstance(selected, slice) and not (projection and i == axis))
+
+
+def hyperslab_nbytes(stack, index, projection=None, axis=None):
+    """
+    Peak bytes ``read_hyperslab`` allocates for its output. Mean projections
+    are accumulated in float64 and then copied to float32, 12 bytes per
+    output element.
+    """
+    itemsize = 8 + 4 if projection == 'mean' else np.dtype(stack.dtype).itemsize
+    return int(np.prod(hyperslab_shape(stack, index, projection, axis))) * itemsize
+
+
+def _split_axis(index, projection, axis):
+    # T or Z positions kept in the output are independent; a projection along T or Z folds partial results.
+    for a in (0, 1):
+        if isinstance(index[a], slice) and not (projection and a == axis):
+            return a, False
+    if projection and axis in (0, 1):
+        return axis, True
+    return None, False
+
+
+def _cropped_plane(stack, t, z, c, crop, pages):
+    # Chunk stores decode only the chunks under the crop; TIFF pages are read whole.
+    if isinstance(stack, ChunkStore):
+        return stack.read_region((t, z, c) + crop, pages)
+    return stack.plane(t, z, c, pages)[crop]
+
+
+def _read_part(file_path, page_index, index, projection, axis):
+    # Runs in a worker: read one part of the hyperslab through a private handle.
+    with open_stack(file_path, page_index) as stack:
+        return read_hyperslab(stack, index, projection, axis)
+
+
+def _read_parallel(stack, index, projection, axis, backend):
+    split, folded = _split_axis(index, projection, axis)
+    positions = range(*index[split].indices(stack.shape[split])) if split is not None else []
+    if len(positions) < 2:
+        return None
+    parts = [positions[part[0]:part[-1] + 1]
+             for part in np.array_split(np.arange(len(positions)), min(backend.workers, len(positions)))]
+    results = backend.run(_read_part, [
+        (stack.file_path, stack.page_index,
+         index[:split] + (slice(part.start, part.stop, part.step),) + index[split + 1:], projection, axis)
+        for part in parts
+    ])
+    if not folded:
+        out_axis = sum(1 for i in range(split)
+                       if isinstance(index[i], slice) and not (projection and i == axis))
+        return np.concatenate(results, axis=out_axis)
+    if projection == 'max':
+        return np.maximum.reduce(results)
+    total = sum(np.asarray(result, dtype=np.float64) * len(part) for result, part in zip(results, parts))
+    return (total / len(positions)).astype(np.float32)
+
+
+def read_hyperslab(stack, index, projection=None, axis=None, workers=1, executor='thread'):
+    """
+    Read ``stack[index]`` for a 5-tuple of ints and slices in (T, Z, C, Y, X)
+    order, optionally reduced with a 'max' or 'mean' projection along
+    ``axis`` (0-4, which must be selected by a slice).
+
+    Planes are read one at a time and cropped to the Y/X selection before
+    being stored or folded into the projection, so memory use is bounded by
+    the output plus one plane. From a ChunkStore only the chunks overlapping
+    the selection are decoded. Mean projections are returned as float32.
+    With several ``workers`` the T or Z range is split across a thread or
+    process pool and the parts joined, or folded for projections along it.
+    """
+    if projection is not None:
+        if projection not in PROJECTIONS:
+            raise ValueError(f"Unknown projection {projection!r}, expected one of {', '.join(PROJECTIONS)}")
+        if axis is None or not isinstance(index[axis], slice):
+            raise ValueError("A projection needs an axis selected by a range")
+    index = tuple(index)
+    backend = ComputeBackend(executor, workers)
+    if backend.parallel:
+        out = _read_parallel(stack, index, projection, axis, backend)
+        if out is not None:
+            return out
+    if projection is None and isinstance(stack, ChunkStore):
+        return stack.read_region(index, {})
+
+    planes = [range(*s.indices(n)) if isinstance(s, slice) else [s] for n, s in zip(stack.shape[:3], index[:3])]
+    crop = tuple(index[3:])
+    # Leading output axes, indexed by plane position; Y/X projections reduce each cropped plane instead.
+    out_axes = [i for i in range(3) if isinstance(index[i], slice) and not (projection and i == axis)]
+    stacked = projection is not None and axis < 3
+    if projection is not None and axis >= 3:
+        plane_axis = sum(1 for n in range(3, axis) if isinstance(index[n], slice))
+    out = np.empty(hyperslab_shape(stack, index, projection, axis),
+                   dtype=np.float64 if projection == 'mean' else stack.dtype)
+    seen = set()
+
+    pages = {}
+    for i, t in enumerate(planes[0]):
+        for j, z in enumerate(planes[1]):
+            for k, c in enumerate(planes[2]):
+                sub = _cropped_plane(stack, t, z, c, crop, pages)
+                if projection == 'max' and not stacked:
+                    sub = sub.max(axis=plane_axis)
+                elif projection == 'mean' and not stacked:
+                    sub = sub.mean(axis=plane_axis, dtype=np.float64)
+                target = tuple((i, j, k)[a] for a in out_axes) + (Ellipsis,)
+                if not stacked:
+                    out[target] = sub
+                elif target not in seen:
+                    out[target] = sub
+                    seen.add(target)
+                elif projection == 'max':
+                    np.maximum(out[target], sub, out=out[target])
+                else:
+                    out[target] += sub
+    if projection == 'mean':
+        if stacked:
+            out /= len(planes[axis])
+        out = out.astype(np.float32)
+    return out
@@ -1,66 +1,185 @@
 # core.py - Image processing core
 import numpy as np
 import tifffile
-from sklearn.decomposition import PCA
-from sklearn.cluster import KMeans
-from skimage.filters import threshold_otsu
+from .chunk_store import is_chunk_store, open_stack
+from .dtypes import output_dtype
+from .hyperslab import read_hyperslab
+from .metrics import timed
+from .parallel import SERIAL
+from .segmentation import segmentation_threshold, write_mask
+from .stream_pca import StreamingPCA, write_pca_stack
+from .stream_stats import DEFAULT_CHUNK_BYTES, channel_statistics
+from .sub_stack import SubStack
+from .stack_cache import stack_cache
 
 class ImageProcessor:
-    def __init__(self, file_path):
+    def __init__(self, file_path, page_index=None, cache=True, backend=None):
+        """
+        With ``cache`` the stack comes from the process-wide ``stack_cache``,
+        so the file stays open (with its decoded pages) between processors.
+        ``backend`` is the ComputeBackend that whole-stack operations split
+        their (T, Z) chunks over; by default they run inline. ``file_path``
+        may also be a chunk store directory (see ``write_chunk_store``).
+        """
         self.file_path = file_path
-        self.image = tifffile.imread(file_path)
-        self.shape = self.image.shape
-        self.ndim = self.image.ndim
+        self.cached = cache
+        self.backend = backend or SERIAL
+        self.stack = stack_cache.acquire(file_path, page_index) if cache else open_stack(file_path, page_index)
+        self.shape = self.stack.shape
+        self.ndim = self.stack.ndim
+
+    @classmethod
+    def from_image(cls, image, **kwargs):
+        """Processor for an ``ImageMetadata`` row, reading its chunk store once one has been built."""
+        if image.chunk_store and is_chunk_store(image.chunk_store["path"]):
+            return cls(image.chunk_store["path"], **kwargs)
+        return cls(image.file_path, image.page_index, **kwargs)
+
+    @property
+    def image(self):
+        """The full (T, Z, C, Y, X) array, memory-mapped when the file allows it."""
+        return self.stack.asarray()
+
+    def close(self):
+        if self.cached:
+            stack_cache.release(self.stack)
+        else:
+            self.stack.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    @property
+    def _parallel(self):
+        return {"workers": self.backend.workers, "executor": self.backend.executor}
+
+    @property
+    def page_index(self):
+        return self.stack.page_index
         
+    @timed('slice.read')
     def get_slice(self, time=None, z=None, channel=None):
-        slice_idx = [slice(None)] * self.ndim
-        dims = {0: 'Time', 1: 'Z', 2: 'Channel', 3: 'Y', 4: 'X'}
-        
         if time is not None:
             if time < 0 or time >= self.shape[0]:
                 raise IndexError(f"Time index {time} is out of bounds for axis 0 with size {self.shape[0]}")
-            slice_idx[0] = time
         if z is not None:
             if z < 0 or z >= self.shape[1]:
                 raise IndexError(f"Z index {z} is out of bounds for axis 1 with size {self.shape[1]}")
-            slice_idx[1] = z
         if channel is not None:
             if channel < 0 or channel >= self.shape[2]:
                 raise IndexError(f"Channel index {channel} is out of bounds for axis 2 with size {self.shape[2]}")
-            slice_idx[2] = channel
             
-        return self.image[tuple(slice_idx)]
+        return self.stack.read(time, z, channel)
+
+    @timed('hyperslab.read')
+    def get_hyperslab(self, index, projection=None, axis=None):
+        """
+        Strided sub-volume ``image[index]`` for a (T, Z, C, Y, X) tuple of ints
+        and slices, optionally reduced by a 'max' or 'mean' projection along
+        ``axis``; see ``read_hyperslab``.
+        """
+        return read_hyperslab(self.stack, index, projection, axis, **self._parallel)
     
-    def calculate_statistics(self):
-        stats = []
-        for ch in range(self.shape[2]):
-            channel_data = self.image[:, :, ch, :, :].ravel()
-            stats.append({
-                "channel": ch,
-                "mean": float(np.mean(channel_data)),
-                "std": float(np.std(channel_data)),
-                "min": float(np.min(channel_data)),
-                "max": float(np.max(channel_data))
-            })
-        return stats
+    @timed('statistics')
+    def calculate_statistics(self, histogram=False, percentiles=None, progress=None):
+        """
+        Per-channel mean, std, min and max from a single streaming pass.
+
+        With ``histogram`` (implied by ``percentiles``) each channel also gets
+        its Otsu threshold and the requested percentiles from the same pass.
+        Data other than integers of up to 16 bits takes a min/max pass first,
+        to fix the histogram range. ``progress(done, total)`` is called as
+        planes are reduced.
+        """
+        histogram = histogram or bool(percentiles)
+        value_range = None
+        if histogram and not (self.stack.dtype.kind in 'ui' and self.stack.dtype.itemsize <= 2):
+            bounds = channel_statistics(self.stack, **self._parallel)
+            low, high = float(bounds.min.min()), float(bounds.max.max())
+            value_range = (low, high if high > low else low + 1)
+        stats = channel_statistics(self.stack, histogram=histogram, value_range=value_range,
+                                   progress=progress, **self._parallel)
+        return stats.to_list(percentiles=percentiles)
     
-    def perform_pca(self, n_components=3):
-        original_shape = self.image.shape
-        data = self.image.reshape(-1, original_shape[2])
-        pca = PCA(n_components=n_components)
-        reduced = pca.fit_transform(data)
-        return reduced.reshape(original_shape[0], original_shape[1], n_components, original_shape[3], original_shape[4])
+    def perform_pca(self, n_components=3, output_path=None, chunk_bytes=DEFAULT_CHUNK_BYTES, progress=None,
+                    pca=None, dtype='float32', region=None, sample=1.0):
+        """
+        Channel-wise PCA fitted and applied chunk by chunk.
+
+        Returns the (T, Z, n_components, Y, X) projection and the fitted
+        StreamingPCA. With ``output_path`` the projection is streamed into
+        that TIFF and returned as a read-only memory map of it. The projection
+        is float32 unless ``dtype`` is 'float64', or 'source' to rescale it to
+        the image's own type (see ``StreamingPCA.project``). A fitted
+        ``pca`` (e.g. a basis shared by several images, or stored with an
+        earlier result) skips the fit; otherwise it is fitted on a ``sample``
+        fraction of the pixels (see ``sample_planes``). ``region``, as
+        returned by ``region_bounds``, limits both the fit and the projection
+        to T and Z ranges and a Y/X region. ``progress(done, total)`` counts
+        planes over both the fit and the transform pass.
+        """
+        dtype = output_dtype(dtype, self.stack.dtype)
+        stack = SubStack(self.stack, region) if region else self.stack
+        if pca is not None and len(pca.mean_) != stack.shape[2]:
+            raise ValueError(f"PCA basis has {len(pca.mean_)} channels, the image has {stack.shape[2]}")
+        fit_progress = transform_progress = progress
+        if progress is not None and pca is None:
+            fit_progress = lambda done, total: progress(done, 2 * total)
+            transform_progress = lambda done, total: progress(total + done, 2 * total)
+        if pca is None:
+            with timed('pca.fit'):
+                pca = StreamingPCA(n_components).fit_stack(stack, chunk_bytes, fit_progress, sample=sample,
+                                                           **self._parallel)
+        if dtype.kind != 'f':
+            pca.projection_range()  # Raises before any output is written if the range is unknown
+        with timed('pca.transform'):
+            if output_path is not None:
+                write_pca_stack(stack, pca, output_path, dtype, chunk_bytes, transform_progress, **self._parallel)
+                return tifffile.memmap(output_path, mode='r'), pca
+            reduced = np.empty(stack.shape[:2] + (pca.n_components,) + stack.shape[3:], dtype=dtype)
+            return pca.transform_stack(stack, reduced, chunk_bytes, transform_progress), pca
+
+    @timed('pca.accumulate')
+    def accumulate_pca(self, chunk_bytes=DEFAULT_CHUNK_BYTES, progress=None):
+        """Unfinalized StreamingPCA over this stack, to be merged with other images' accumulations."""
+        return StreamingPCA().accumulate_stack(self.stack, chunk_bytes, progress, **self._parallel)
     
     def segment_channel(self, channel, method='otsu'):
-        channel_data = self.image[:, :, channel, :, :]
-        if method == 'otsu':
-            threshold = threshold_otsu(channel_data)
-            return (channel_data > threshold).astype(np.uint8)
-        elif method == 'kmeans':
-            kmeans = KMeans(n_clusters=2)
-            flattened = channel_data.reshape(-1, 1)
-            return kmeans.fit_predict(flattened).reshape(channel_data.shape)
-        return None
+        """
+        Binary mask of one channel, shaped (T, Z, Y, X).
+
+        The threshold comes from a streamed histogram: Otsu's, or the boundary
+        of 1-D 2-means for 'kmeans'. Returns None for an unknown method.
+        """
+        try:
+            threshold = segmentation_threshold(self.stack, channel, method, **self._parallel)
+        except ValueError:
+            return None
+        return (self.stack.read(channel=channel) > threshold).astype(np.uint8)
+
+    def save_segmentation(self, channel, output_path, method='otsu', progress=None):
+        """
+        Write the mask of one channel to a compressed TIFF without holding the
+        stack in memory, and return the threshold used.
+
+        ``progress(done, total)`` counts planes over both the histogram and
+        the mask pass.
+        """
+        if channel < 0 or channel >= self.shape[2]:
+            raise IndexError(f"Channel index {channel} is out of bounds for axis 2 with size {self.shape[2]}")
+        histogram_progress = mask_progress = None
+        if progress is not None:
+            histogram_progress = lambda done, total: progress(done, 2 * total)
+            mask_progress = lambda done, total: progress(total + done, 2 * total)
+        with timed('segmentation.threshold'):
+            threshold = segmentation_threshold(self.stack, channel, method, progress=histogram_progress,
+                                               **self._parallel)
+        with timed('segmentation.mask'):
+            write_mask(self.stack, channel, threshold, output_path, progress=mask_progress, **self._parallel)
+        return threshold
 
     def save_image(self, output_path, image_data):
         """
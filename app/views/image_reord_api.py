@@ -2,18 +2,60 @@ import uuid
 import os
 import tifffile
 import logging
-from flask import app, request, jsonify, send_file, abort
+from celery import chain, chord
+from celery.result import AsyncResult
+import io
+from flask import app, request, jsonify, send_file, abort, Response
 from datetime import datetime
+from .chunked_upload import UploadError, finish_upload, save_upload, start_upload, upload_state, write_chunk
+from .dtypes import OUTPUT_DTYPES
 from .image_processor import ImageProcessor
-from app.models import SessionLocal
-from app.models.image_process import ImageMetadata, ImageStatistics, PCAResults  # Import models to register them
+from .metrics import CONTENT_TYPE as METRICS_CONTENT_TYPE, record_written, snapshots, timed
+from .encoding import encode_array, parse_window
+from .hyperslab import AXIS_NAMES, hyperslab_nbytes, parse_index
+from .plane_index import plane_summary
+from .pyramid import read_tile, tile_grid
+from .segmentation import METHODS as SEGMENTATION_METHODS
+from .stream_pca import sample_fraction
+from .sub_stack import REGION_AXES, SubStack, region_bounds
+from .tiff_metadata import SUMMARY_FIELDS, ensure_tiff_metadata, page_tags
+from .tiff_stack import logical_shape
+from .result_cache import atomic_output_path, cache_key, content_key, result_cache
+from app.models import db_session
+from app.models.image_process import BatchJob, ImageMetadata, ImageStatistics, PCAResults  # Import models to register them
+from app.celery_app import celery
+from config import Config
 from app.tasks import (
-    upload_image_task,
+    upload_image_task, analyze_image_task, get_statistics_task, segment_image_task,
+    accumulate_pca_task, shared_pca_basis_task, apply_pca_basis_task, finalize_batch_task, fail_batch_task,
+    pca_params, pca_selection, stored_basis, stored_plane_page, stored_plane_statistics,
 )
 
+BATCH_OPERATIONS = ('statistics', 'pca')
+
 # Configure logging
 logger = logging.getLogger(__name__)
 
+def media_url(file_path):
+    """Public URL of a file stored under media/."""
+    return request.url_root + 'media/' + os.path.relpath(file_path, "media").replace(os.sep, '/')
+
+def _not_modified(etag):
+    """304 response when the client already holds ``etag``, else None."""
+    if request.if_none_match.contains(etag):
+        response = Response(status=304)
+        response.set_etag(etag)
+        return response
+    return None
+
+def _send_array(data, fmt, window, etag):
+    with timed('encode'):
+        body, mimetype, headers = encode_array(data, fmt, window)
+    # Encoded arrays never change for a given file, so clients may cache them and revalidate by ETag.
+    response = send_file(io.BytesIO(body), mimetype=mimetype, etag=etag, max_age=86400)
+    response.headers.update(headers)
+    return response
+
 def upload_image():
     logger.info("Received upload image request")
     if 'file' not in request.files:
@@ -26,9 +68,9 @@ def upload_image():
 
     request_id = str(uuid.uuid4())
     file_path = os.path.join("media", f"{request_id}_{file.filename}")
-    file.save(file_path)
+    content_hash = save_upload(file.stream, file_path)
 
-    task = upload_image_task.delay(file_path, request_id)
+    task = upload_image_task.delay(file_path, request_id, content_hash)
     logger.info(f"File uploaded successfully with request_id: {request_id}")
 
     return jsonify(
@@ -40,11 +82,104 @@ def upload_image():
             }
         ), 202
 
+def _upload_error(request_id, error):
+    logger.error(f"Chunked upload error for request_id: {request_id} - {str(error)}")
+    body = {
+        "status": str(error.status),
+        "messages": str(error),
+        "request_id": request_id,
+        "error": ""
+    }
+    if error.offset is not None:
+        body["data"] = {"offset": error.offset}
+    return jsonify(body), error.status
+
+def start_chunked_upload():
+    logger.info("Received chunked upload start request")
+    data = request.get_json(silent=True) or {}
+    filename = os.path.basename(data.get('filename') or '')
+    if not filename.endswith(('.tif', '.tiff')):
+        logger.error("Invalid file format")
+        return jsonify({"error": "Invalid file format"}), 400
+    size = data.get('size')
+    if size is not None and (not isinstance(size, int) or isinstance(size, bool) or size < 0):
+        logger.error("Invalid upload size")
+        return jsonify({
+            "status": "400",
+            "messages": "Expected size as a non-negative integer number of bytes",
+            "error": ""
+        }), 400
+
+    request_id = str(uuid.uuid4())
+    start_upload(request_id, filename, size)
+    logger.info(f"Chunked upload started with request_id: {request_id}")
+
+    return jsonify({
+        "status": "201",
+        "request_id": request_id,
+        "message": "Upload started",
+        "data": {"offset": 0, "upload_url": request.url_root + 'uploads/' + request_id}
+    }), 201
+
+def upload_chunk(request_id):
+    offset = request.args.get('offset', type=int)
+    if offset is None or offset < 0:
+        return jsonify({"error": "Missing or invalid offset"}), 400
+    try:
+        new_offset = write_chunk(request_id, offset, request.stream)
+    except UploadError as e:
+        return _upload_error(request_id, e)
+
+    return jsonify({
+        "status": "200",
+        "request_id": request_id,
+        "message": "Chunk received",
+        "data": {"offset": new_offset}
+    }), 200
+
+def get_upload(request_id):
+    state = upload_state(request_id)
+    if state is None:
+        return _upload_error(request_id, UploadError("Upload not found", status=404))
+
+    return jsonify({
+        "status": "200",
+        "request_id": request_id,
+        "message": "Upload status successfully retrieved",
+        "data": {"filename": state["filename"], "size": state["size"], "offset": state["offset"]}
+    }), 200
+
+def finalize_upload(request_id):
+    logger.info(f"Received upload finalize request for request_id: {request_id}")
+    state = upload_state(request_id)
+    if state is None:
+        return _upload_error(request_id, UploadError("Upload not found", status=404))
+    file_path = os.path.join("media", f"{request_id}_{state['filename']}")
+    try:
+        content_hash = finish_upload(request_id, file_path)
+    except UploadError as e:
+        return _upload_error(request_id, e)
+
+    task = upload_image_task.delay(file_path, request_id, content_hash)
+    logger.info(f"File uploaded successfully with request_id: {request_id}")
+
+    return jsonify(
+        {
+            "status": "201",
+            "task_id": task.id,
+            "request_id": request_id,
+            "message": "File upload request successfully processed"
+            }
+        ), 202
+
 def get_metadata(request_id):
     logger.info(f"Received get metadata request for request_id: {request_id}")
-    db = SessionLocal()
-    image = db.query(ImageMetadata).filter(ImageMetadata.file_path.contains(request_id)).first()
-    db.close()
+    fields = request.args.get('fields')
+    page = request.args.get('page', 1, type=int)
+    per_page = min(max(request.args.get('per_page', 100, type=int), 1), 1000)
+
+    db = db_session()
+    image = db.query(ImageMetadata).filter(ImageMetadata.request_id == request_id).first()
     
     if not image:
         logger.error(f"Image not found for request_id: {request_id}")
@@ -57,22 +192,34 @@ def get_metadata(request_id):
     }
     
     try:
-        with tifffile.TiffFile(image.file_path) as tif:
-            metadata_response["tiff_metadata"] = str(tif.pages[0].tags)
-            
-            if tif.ome_metadata:
-                metadata_response["ome_metadata"] = tif.ome_metadata
-            
-            extra_metadata = tif.imagej_metadata or tif.micromanager_metadata or tif.scn_metadata
-            if extra_metadata:
-                metadata_response["extra_metadata"] = extra_metadata
-            
-            metadata_response["pages_metadata"] = {
-                f"Page {i}": str(page.tags) for i, page in enumerate(tif.pages)
-            }
+        tiff_metadata = ensure_tiff_metadata(image)
     except Exception as e:
         logger.error(f"Error retrieving metadata for request_id: {request_id} - {str(e)}")
         metadata_response["error"] = str(e)
+        tiff_metadata = None
+
+    if tiff_metadata:
+        # Summary fields by default; "pages" gives page-level tags, one page of results at a time.
+        selected = fields.split(',') if fields else list(SUMMARY_FIELDS)
+        unknown = [f for f in selected if f != 'pages' and f not in SUMMARY_FIELDS]
+        if unknown:
+            return jsonify({
+                "status": "400",
+                "messages": f"Unknown metadata fields: {', '.join(unknown)}",
+                "request_id": request_id,
+                "error": ""
+            }), 400
+        for field in selected:
+            if field == 'pages':
+                start = (max(page, 1) - 1) * per_page
+                metadata_response["pages"] = {
+                    "page": max(page, 1),
+                    "per_page": per_page,
+                    "total": tiff_metadata["page_count"],
+                    "items": page_tags(tiff_metadata, start, start + per_page)
+                }
+            else:
+                metadata_response[field] = tiff_metadata[field]
     
     return jsonify({
         "status": "200",
@@ -86,10 +233,19 @@ def get_slice(request_id):
     time = request.args.get('time', type=int)
     z = request.args.get('z', type=int)
     channel = request.args.get('channel', type=int)
+    fmt = request.args.get('format')
+    try:
+        window = parse_window(request.args.get('window'))
+    except ValueError as e:
+        return jsonify({
+            "status": "400",
+            "messages": str(e),
+            "request_id": request_id,
+            "error": ""
+        }), 400
 
-    db = SessionLocal()
-    image = db.query(ImageMetadata).filter(ImageMetadata.file_path.contains(request_id)).first()
-    db.close()
+    db = db_session()
+    image = db.query(ImageMetadata).filter(ImageMetadata.request_id == request_id).first()
     
     if not image:
         logger.error(f"Image not found for request_id: {request_id}")
@@ -100,32 +256,250 @@ def get_slice(request_id):
             "error": ""
         }), 404
     
-    processor = ImageProcessor(image.file_path)
+    content_hash = content_key(image)
+    params = {"time": time, "z": z, "channel": channel}
+    if fmt is not None:
+        # Stream the encoded slice straight back instead of writing it under media/.
+        etag = cache_key(content_hash, "slice", dict(params, format=fmt, window=window))
+        not_modified = _not_modified(etag)
+        if not_modified:
+            return not_modified
+        try:
+            with ImageProcessor.from_image(image) as processor:
+                slice_data = processor.get_slice(time, z, channel)
+                return _send_array(slice_data, fmt, window, etag)
+        except (IndexError, ValueError) as e:
+            logger.error(f"Error retrieving slice for request_id: {request_id} - {str(e)}")
+            status = 404 if isinstance(e, IndexError) else 400
+            return jsonify({
+                "status": str(status),
+                "messages": str(e),
+                "request_id": request_id,
+                "error": ""
+            }), status
+
+    cached = result_cache.get(content_hash, "slice", params)
+    if cached:
+        output_path = cached["file_path"]
+    else:
+        try:
+            with ImageProcessor.from_image(image) as processor:
+                slice_data = processor.get_slice(time, z, channel)
+                output_path = result_cache.file_path(content_hash, "slice", params)
+                temp_path = atomic_output_path(output_path)
+                with timed('slice.write'):
+                    tifffile.imwrite(temp_path, slice_data)
+                os.replace(temp_path, output_path)
+                record_written('slice', output_path)
+        except IndexError as e:
+            logger.error(f"Error retrieving slice for request_id: {request_id} - {str(e)}")
+            return jsonify({
+                "status": "404",
+                "messages": str(e),
+                "request_id": request_id,
+                "error": ""
+            }), 404
+        result_cache.put(content_hash, "slice", params, file_path=output_path)
+    
+    file_url = media_url(output_path)
     
-    try:
-        slice_data = processor.get_slice(time, z, channel)
-    except IndexError as e:
-        logger.error(f"Error retrieving slice for request_id: {request_id} - {str(e)}")
+    return jsonify({
+        "status": "200",
+        "messages": "Slice successfully retrieved",
+        "request_id": request_id,
+        "data": {"url": file_url}
+    }), 200
+
+def get_hyperslab(request_id):
+    logger.info(f"Received get hyperslab request for request_id: {request_id}")
+    fmt = request.args.get('format', 'raw')
+    projection = request.args.get('projection')
+    axis_name = request.args.get('axis')
+
+    db = db_session()
+    image = db.query(ImageMetadata).filter(ImageMetadata.request_id == request_id).first()
+    
+    if not image:
+        logger.error(f"Image not found for request_id: {request_id}")
         return jsonify({
             "status": "404",
-            "messages": str(e),
+            "messages": "Image not found",
             "request_id": request_id,
             "error": ""
         }), 404
     
-    output_filename = f"slice_{request_id}.tif"
-    output_path = os.path.join("media", output_filename)
-    tifffile.imwrite(output_path, slice_data)
-    
-    file_url = request.url_root + 'media/' + output_filename
-    
+    try:
+        window = parse_window(request.args.get('window'))
+        if axis_name is not None and axis_name not in AXIS_NAMES:
+            raise ValueError(f"Unknown axis {axis_name!r}, expected one of {', '.join(AXIS_NAMES)}")
+        axis = AXIS_NAMES.index(axis_name) if axis_name is not None else None
+        with ImageProcessor.from_image(image) as processor:
+            index = tuple(parse_index(request.args.get(name), size, name)
+                          for name, size in zip(AXIS_NAMES, processor.shape))
+            etag = cache_key(content_key(image), "hyperslab", {
+                "index": [str(i) for i in index], "projection": projection, "axis": axis,
+                "format": fmt, "window": window
+            })
+            not_modified = _not_modified(etag)
+            if not_modified:
+                return not_modified
+            size = hyperslab_nbytes(processor.stack, index, projection, axis)
+            if size > Config.HYPERSLAB_MAX_BYTES:
+                return jsonify({
+                    "status": "413",
+                    "messages": f"Hyperslab of {size} bytes exceeds the limit of {Config.HYPERSLAB_MAX_BYTES} bytes",
+                    "request_id": request_id,
+                    "error": ""
+                }), 413
+            data = processor.get_hyperslab(index, projection, axis)
+        return _send_array(data, fmt, window, etag)
+    except (IndexError, ValueError) as e:
+        logger.error(f"Error retrieving hyperslab for request_id: {request_id} - {str(e)}")
+        status = 404 if isinstance(e, IndexError) else 400
+        return jsonify({
+            "status": str(status),
+            "messages": str(e),
+            "request_id": request_id,
+            "error": ""
+        }), status
+
+def _pyramid_or_error(request_id):
+    db = db_session()
+    image = db.query(ImageMetadata).filter(ImageMetadata.request_id == request_id).first()
+
+    if not image:
+        logger.error(f"Image not found for request_id: {request_id}")
+        return None, (jsonify({
+            "status": "404",
+            "messages": "Image not found",
+            "request_id": request_id,
+            "error": ""
+        }), 404)
+    if not image.pyramid:
+        return None, (jsonify({
+            "status": "409",
+            "messages": "Pyramid is not built yet",
+            "request_id": request_id,
+            "error": ""
+        }), 409)
+    return image, None
+
+def get_pyramid(request_id):
+    logger.info(f"Received get pyramid request for request_id: {request_id}")
+    image, error = _pyramid_or_error(request_id)
+    if error:
+        return error
+
+    pyramid = image.pyramid
+    levels = []
+    for level, info in enumerate(pyramid["levels"]):
+        rows, columns = tile_grid(pyramid, level)
+        levels.append({"level": level, "shape": info["shape"], "tiles": [rows, columns]})
+
     return jsonify({
         "status": "200",
-        "messages": "Slice successfully retrieved",
+        "messages": "Pyramid successfully retrieved",
         "request_id": request_id,
-        "data": {"url": file_url}
+        "data": {
+            "tile_size": pyramid["tile_size"],
+            "shape": pyramid["shape"],
+            "dtype": pyramid["dtype"],
+            "levels": levels,
+            "file_url": media_url(pyramid["file_path"])
+        }
     }), 200
 
+def get_tile(request_id, level, y, x):
+    time = request.args.get('time', 0, type=int)
+    z = request.args.get('z', 0, type=int)
+    channel = request.args.get('channel', 0, type=int)
+
+    image, error = _pyramid_or_error(request_id)
+    if error:
+        return error
+
+    try:
+        window = parse_window(request.args.get('window'))
+        fmt = request.args.get('format') or \
+            ('png' if window or image.pyramid["dtype"] in ('uint8', 'uint16') else 'tiff')
+        etag = cache_key(content_key(image), "tile",
+                         {"level": level, "time": time, "z": z, "channel": channel, "y": y, "x": x,
+                          "format": fmt, "window": window})
+        not_modified = _not_modified(etag)
+        if not_modified:
+            return not_modified
+        tile = read_tile(image.pyramid, level, time, z, channel, y, x)
+        return _send_array(tile, fmt, window, etag)
+    except (IndexError, ValueError) as e:
+        logger.error(f"Error retrieving tile for request_id: {request_id} - {str(e)}")
+        status = 404 if isinstance(e, IndexError) else 400
+        return jsonify({
+            "status": str(status),
+            "messages": str(e),
+            "request_id": request_id,
+            "error": ""
+        }), status
+
+def _as_range(selected):
+    # A single position keeps its axis, as a range of one.
+    return slice(selected, selected + 1) if isinstance(selected, int) else selected
+
+def _plane_selection(args, shape):
+    """'time' and 'z' of a query as ranges over a plane index of ``shape``."""
+    return tuple(_as_range(parse_index(args.get(name), size, name))
+                 for name, size in zip(('time', 'z'), shape))
+
+def _parse_percentiles(value):
+    """Comma-separated percentiles between 0 and 100, e.g. '1,50,99'."""
+    if not value:
+        return None
+    try:
+        percentiles = [float(q) for q in value.split(',')]
+    except ValueError:
+        raise ValueError(f"Invalid percentiles {value!r}, expected numbers separated by commas")
+    if not all(0 <= q <= 100 for q in percentiles):
+        raise ValueError(f"Percentiles {value!r} must be between 0 and 100")
+    return percentiles
+
+def _analysis_selection(data, processor):
+    """
+    Region (see ``region_bounds``) and sample fraction of an /analyze
+    request: 'time', 'z', 'y' and 'x' as 'i' or 'start:stop:step', and
+    'sample_fraction' or 'sample_count' of the selected pixels.
+    """
+    sizes = processor.shape[:2] + processor.shape[3:]
+    index = []
+    for name, size in zip(REGION_AXES, sizes):
+        value = data.get(name)
+        # A single position keeps its axis, so every projection stays (T, Z, C, Y, X).
+        index.append(_as_range(parse_index(None if value is None else str(value), size, name)))
+    region = region_bounds(processor.shape, index)
+    shape = SubStack(processor.stack, region).shape if region else processor.shape
+    sample = sample_fraction(shape, data.get('sample_fraction'), data.get('sample_count'))
+    return region, sample
+
+def _channel_count(image):
+    """Channels of an ImageMetadata row, from its stored metadata or page index rather than the file."""
+    if image.tiff_metadata:
+        return image.tiff_metadata["shape"][2]
+    return logical_shape(image.page_index)[2]
+
+def _components_error(components, images=()):
+    """
+    Why ``components`` is not a PCA component count that fits every one of
+    ``images``, or None when it is.
+    """
+    if not isinstance(components, int) or isinstance(components, bool) or components < 1:
+        return "Expected a positive integer number of components"
+    short = []
+    for image in images:
+        channels = _channel_count(image)
+        if components > channels:
+            short.append(f"{image.request_id} ({channels} channels)")
+    if short:
+        return f"Cannot fit {components} components to images with fewer channels: {', '.join(short)}"
+    return None
+
 def analyze_image(request_id):
     logger.info(f"Received analyze image request for request_id: {request_id}")
     if request.content_type != 'application/json':
@@ -134,74 +508,492 @@ def analyze_image(request_id):
 
     data = request.get_json()
     components = data.get('components', 3)
+    dtype = data.get('dtype', 'float32')
+    basis_id = data.get('basis_id')
+    if dtype not in OUTPUT_DTYPES:
+        logger.error(f"Invalid output dtype for request_id: {request_id}")
+        return jsonify({
+            "status": "400",
+            "messages": f"Expected a dtype in {', '.join(OUTPUT_DTYPES)}",
+            "request_id": request_id,
+            "error": ""
+        }), 400
+    components_error = _components_error(components)
+    if components_error:
+        logger.error(f"Invalid number of components for request_id: {request_id}")
+        return jsonify({
+            "status": "400",
+            "messages": components_error,
+            "request_id": request_id,
+            "error": ""
+        }), 400
 
-    db = SessionLocal()
-    image = db.query(ImageMetadata).filter(ImageMetadata.file_path.contains(request_id)).first()
-    db.close()
+    db = db_session()
+    image = db.query(ImageMetadata).filter(ImageMetadata.request_id == request_id).first()
     
     if not image:
         logger.error(f"Image not found for request_id: {request_id}")
-        return {"error": "Image not found"}
-    
-    processor = ImageProcessor(image.file_path)
-    pca_result = processor.perform_pca(components)
-    
-    output_path = os.path.join("media", f"pca_{request_id}.tif")
-    tifffile.imwrite(output_path, pca_result)
-    
-    db = SessionLocal()
-    pca_record = PCAResults(
-        image_id=image.id,
-        components=components,
-        file_path=output_path,
-        explained_variance=[]
-    )
-    db.add(pca_record)
-    db.commit()
-    db.refresh(pca_record)
-    db.close()
+        return jsonify({
+            "status": "404",
+            "messages": "Image not found",
+            "request_id": request_id,
+            "error": ""
+        }), 404
+    
+    basis = None
+    if basis_id is not None:
+        basis = stored_basis(basis_id)
+        if not basis:
+            logger.error(f"Stored PCA basis {basis_id} not found for request_id: {request_id}")
+            return jsonify({
+                "status": "404",
+                "messages": f"Stored PCA basis {basis_id} not found",
+                "request_id": request_id,
+                "error": ""
+            }), 404
+        components = basis["n_components"]
     
-    file_url = request.url_root + 'media/' + os.path.basename(output_path)
+    try:
+        with ImageProcessor.from_image(image) as processor:
+            region, sample = _analysis_selection(data, processor)
+            if basis is not None and len(basis["mean"]) != processor.shape[2]:
+                raise ValueError(f"PCA basis has {len(basis['mean'])} channels, the image has {processor.shape[2]}")
+        components_error = None if basis is not None else _components_error(components, [image])
+        if components_error:
+            raise ValueError(components_error)
+        if basis is not None and sample < 1:
+            raise ValueError("A stored basis is applied without a fit, so it takes no sample")
+    except (IndexError, ValueError) as e:
+        logger.error(f"Invalid analysis parameters for request_id: {request_id} - {str(e)}")
+        status = 404 if isinstance(e, IndexError) else 400
+        return jsonify({
+            "status": str(status),
+            "messages": str(e),
+            "request_id": request_id,
+            "error": ""
+        }), status
+    
+    if image.content_hash:
+        cached = result_cache.get(image.content_hash, "pca", pca_params(components, dtype, region, sample, basis))
+        if cached:
+            recorded = db.query(PCAResults.id).filter(
+                PCAResults.image_id == image.id, PCAResults.file_path == cached["file_path"]
+            ).first()
+            result = dict(cached["result"], file_url=media_url(cached["file_path"]))
+            if recorded:
+                result["pca_result_id"] = recorded.id
+            return jsonify({
+                "status": "200",
+                "request_id": request_id,
+                "message": "Analysis result retrieved from cache",
+                "data": result
+            }), 200
+
+    task = analyze_image_task.delay(request_id, components, dtype=dtype, region=region, sample=sample,
+                                    basis_id=basis_id)
+    logger.info(f"Queued PCA task {task.id} for request_id: {request_id}")
 
+    queued = {
+        "image_id": image.id,
+        "components": components,
+        "dtype": dtype,
+        "job_url": request.url_root + 'jobs/' + task.id
+    }
+    selection = pca_selection(region, sample, basis_id)
+    if selection:
+        queued["selection"] = selection
     return jsonify(
     {
-        "status": "201",
+        "status": "202",
+        "task_id": task.id,
         "request_id": request_id,
-        "message": "File upload request successfully processed",
-        "data": {
-            "image_id": image.id,
-            "pca_result": list(pca_result.shape),
-            "components": pca_record.components,
-            "explained_variance": pca_record.explained_variance,
-            "file_url": file_url
-        }
+        "message": "Analysis request successfully queued",
+        "data": queued
     }
-    ), 200
+    ), 202
+
+def segment_image(request_id):
+    logger.info(f"Received segment image request for request_id: {request_id}")
+    if request.content_type != 'application/json':
+        logger.error("Unsupported Media Type")
+        return jsonify({"error": "Unsupported Media Type"}), 415
+
+    data = request.get_json()
+    channel = data.get('channel', 0)
+    method = data.get('method', 'otsu')
+    if method not in SEGMENTATION_METHODS or not isinstance(channel, int) or isinstance(channel, bool):
+        logger.error(f"Invalid segmentation parameters for request_id: {request_id}")
+        return jsonify({
+            "status": "400",
+            "messages": f"Expected an integer channel and a method in {', '.join(SEGMENTATION_METHODS)}",
+            "request_id": request_id,
+            "error": ""
+        }), 400
+
+    db = db_session()
+    image = db.query(ImageMetadata).filter(ImageMetadata.request_id == request_id).first()
+    
+    if not image:
+        logger.error(f"Image not found for request_id: {request_id}")
+        return jsonify({
+            "status": "404",
+            "messages": "Image not found",
+            "request_id": request_id,
+            "error": ""
+        }), 404
+    
+    with ImageProcessor.from_image(image) as processor:
+        channels = processor.shape[2]
+    if not 0 <= channel < channels:
+        logger.error(f"Channel {channel} out of range for request_id: {request_id}")
+        return jsonify({
+            "status": "404",
+            "messages": f"Channel index {channel} is out of bounds with size {channels}",
+            "request_id": request_id,
+            "error": ""
+        }), 404
+    
+    params = {"channel": channel, "method": method}
+    if image.content_hash:
+        cached = result_cache.get(image.content_hash, "segmentation", params)
+        if cached:
+            return jsonify({
+                "status": "200",
+                "request_id": request_id,
+                "message": "Segmentation result retrieved from cache",
+                "data": dict(cached["result"], file_url=media_url(cached["file_path"]))
+            }), 200
+
+    task = segment_image_task.delay(request_id, channel, method)
+    logger.info(f"Queued segmentation task {task.id} for request_id: {request_id}")
+
+    return jsonify(
+    {
+        "status": "202",
+        "task_id": task.id,
+        "request_id": request_id,
+        "message": "Segmentation request successfully queued",
+        "data": dict(params, image_id=image.id, job_url=request.url_root + 'jobs/' + task.id)
+    }
+    ), 202
 
 def get_statistics(request_id):
     logger.info(f"Received get statistics request for request_id: {request_id}")
-    db = SessionLocal()
-    image = db.query(ImageMetadata).filter(ImageMetadata.file_path.contains(request_id)).first()
-    db.close()
+    db = db_session()
+    image = db.query(ImageMetadata).filter(ImageMetadata.request_id == request_id).first()
     
     if not image:
         logger.error(f"Image not found for request_id: {request_id}")
-        return {"error": "Image not found"}
-    
-    processor = ImageProcessor(image.file_path)
-    stats = processor.calculate_statistics()
-    
-    db = SessionLocal()
-    for stat in stats:
-        db.add(ImageStatistics(
-            image_id=image.id,
-            channel=stat['channel'],
-            mean=stat['mean'],
-            std=stat['std'],
-            min=stat['min'],
-            max=stat['max']
-        ))
-    db.commit()
-    db.close()
+        return jsonify({
+            "status": "404",
+            "messages": "Image not found",
+            "request_id": request_id,
+            "error": ""
+        }), 404
     
-    return stats
+    if image.plane_index:
+        try:
+            times, zs = _plane_selection(request.args, image.plane_index["shape"])
+            percentiles = _parse_percentiles(request.args.get('percentiles'))
+            stats = stored_plane_statistics(image, times, zs).to_list(percentiles=percentiles)
+        except (IndexError, ValueError) as e:
+            logger.error(f"Error deriving statistics for request_id: {request_id} - {str(e)}")
+            status = 404 if isinstance(e, IndexError) else 400
+            return jsonify({
+                "status": str(status),
+                "messages": str(e),
+                "request_id": request_id,
+                "error": ""
+            }), status
+        return jsonify({
+            "status": "200",
+            "request_id": request_id,
+            "message": "Statistics derived from the plane index",
+            "data": {"image_id": image.id, "statistics": stats}
+        }), 200
+    
+    if image.content_hash:
+        cached = result_cache.get(image.content_hash, "statistics", {})
+        if cached:
+            return jsonify({
+                "status": "200",
+                "request_id": request_id,
+                "message": "Statistics retrieved from cache",
+                "data": {"image_id": image.id, "statistics": cached["result"]}
+            }), 200
+
+    task = get_statistics_task.delay(request_id)
+    logger.info(f"Queued statistics task {task.id} for request_id: {request_id}")
+
+    return jsonify(
+    {
+        "status": "202",
+        "task_id": task.id,
+        "request_id": request_id,
+        "message": "Statistics request successfully queued",
+        "data": {
+            "image_id": image.id,
+            "job_url": request.url_root + 'jobs/' + task.id
+        }
+    }
+    ), 202
+
+def get_planes(request_id):
+    logger.info(f"Received get planes request for request_id: {request_id}")
+    page = request.args.get('page', 1, type=int)
+    per_page = min(max(request.args.get('per_page', 100, type=int), 1), 1000)
+
+    db = db_session()
+    image = db.query(ImageMetadata).filter(ImageMetadata.request_id == request_id).first()
+
+    if not image:
+        logger.error(f"Image not found for request_id: {request_id}")
+        return jsonify({
+            "status": "404",
+            "messages": "Image not found",
+            "request_id": request_id,
+            "error": ""
+        }), 404
+    if not image.plane_index:
+        return jsonify({
+            "status": "409",
+            "messages": "Plane index is not built yet",
+            "request_id": request_id,
+            "error": ""
+        }), 409
+
+    shape = image.plane_index["shape"]
+    try:
+        times, zs = _plane_selection(request.args, shape)
+        saturation = request.args.get('saturation', Config.AUTO_CONTRAST_SATURATION, type=float)
+        if not 0 <= saturation < 50:
+            raise ValueError(f"Saturation {saturation} must be at least 0 and below 50 percent")
+        stats = stored_plane_statistics(image, times, zs)
+    except (IndexError, ValueError) as e:
+        logger.error(f"Error retrieving planes for request_id: {request_id} - {str(e)}")
+        status = 404 if isinstance(e, IndexError) else 400
+        return jsonify({
+            "status": str(status),
+            "messages": str(e),
+            "request_id": request_id,
+            "error": ""
+        }), status
+
+    # Foreground is above the given threshold, or above each channel's Otsu threshold over the selection.
+    threshold = request.args.get('threshold', type=float)
+    thresholds = [threshold if threshold is not None else stats.otsu_threshold(c) for c in range(shape[2])]
+    # Display limits clip ``saturation`` percent of the selected pixels at each end, as ImageJ's auto-contrast.
+    channels = [{
+        "channel": c,
+        "threshold": thresholds[c],
+        "contrast_limits": stats.percentile(c, [saturation, 100 - saturation]).tolist()
+    } for c in range(shape[2])]
+    # Only the rows of the page are loaded.
+    total = len(range(*times.indices(shape[0]))) * len(range(*zs.indices(shape[1]))) * shape[2]
+    start = (max(page, 1) - 1) * per_page
+    items = [plane_summary(row, stats.centers, thresholds[row.channel])
+             for row in stored_plane_page(image, times, zs, start, per_page)]
+
+    return jsonify({
+        "status": "200",
+        "messages": "Plane summaries successfully retrieved",
+        "request_id": request_id,
+        "data": {
+            "image_id": image.id,
+            "shape": shape,
+            "channels": channels,
+            "planes": {"page": max(page, 1), "per_page": per_page, "total": total, "items": items}
+        }
+    }), 200
+
+def get_job(task_id):
+    logger.info(f"Received job status request for task_id: {task_id}")
+    result = AsyncResult(task_id, app=celery)
+    state = result.state
+    data = {"state": state, "progress": 0, "result": None, "result_url": None}
+
+    if state == "PROGRESS":
+        data["progress"] = result.info.get("progress", 0)
+    elif state == "SUCCESS":
+        data["progress"] = 100
+        data["result"] = result.result
+        if isinstance(result.result, dict) and result.result.get("file_path"):
+            data["result_url"] = media_url(result.result["file_path"])
+    elif state == "FAILURE":
+        data["error"] = str(result.info)
+
+    return jsonify({
+        "status": "200",
+        "messages": "Job status successfully retrieved",
+        "task_id": task_id,
+        "data": data
+    }), 200
+
+def _batch_error(message, status):
+    logger.error(f"Invalid batch request: {message}")
+    return jsonify({
+        "status": str(status),
+        "messages": message,
+        "error": ""
+    }), status
+
+def start_batch():
+    logger.info("Received batch request")
+    if request.content_type != 'application/json':
+        logger.error("Unsupported Media Type")
+        return jsonify({"error": "Unsupported Media Type"}), 415
+
+    data = request.get_json()
+    request_ids = data.get('request_ids')
+    operations = data.get('operations', list(BATCH_OPERATIONS))
+    components = data.get('components', 3)
+    shared_basis = bool(data.get('shared_basis', False))
+    if not isinstance(request_ids, list) or not request_ids or \
+            not all(isinstance(request_id, str) for request_id in request_ids):
+        return _batch_error("Expected a non-empty list of request_ids", 400)
+    request_ids = list(dict.fromkeys(request_ids))
+    if len(request_ids) > Config.BATCH_MAX_ITEMS:
+        return _batch_error(f"A batch takes at most {Config.BATCH_MAX_ITEMS} request_ids", 400)
+    if not isinstance(operations, list) or not operations or \
+            any(operation not in BATCH_OPERATIONS for operation in operations):
+        return _batch_error(f"Expected operations from {', '.join(BATCH_OPERATIONS)}", 400)
+    operations = list(dict.fromkeys(operations))
+    components_error = _components_error(components)
+    if components_error:
+        return _batch_error(components_error, 400)
+
+    db = db_session()
+    found = db.query(ImageMetadata.request_id, ImageMetadata.page_index, ImageMetadata.tiff_metadata).filter(
+        ImageMetadata.request_id.in_(request_ids)).all()
+    found_ids = {image.request_id for image in found}
+    missing = [request_id for request_id in request_ids if request_id not in found_ids]
+    if missing:
+        return _batch_error(f"Images not found: {', '.join(missing)}", 404)
+    if 'pca' in operations:
+        components_error = _components_error(components, found)
+        if components_error:
+            return _batch_error(components_error, 400)
+
+    batch_id = str(uuid.uuid4())
+    signatures, items = [], []
+    for operation in operations:
+        for request_id in request_ids:
+            if operation == 'statistics':
+                signature = get_statistics_task.si(request_id, record=False)
+            elif shared_basis:
+                signature = apply_pca_basis_task.si(request_id, batch_id)
+            else:
+                signature = analyze_image_task.si(request_id, components, record=False)
+            items.append({"request_id": request_id, "operation": operation, "task_id": signature.freeze().id})
+            signatures.append(signature)
+
+    db.add(BatchJob(
+        batch_id=batch_id,
+        operations=operations,
+        components=components if 'pca' in operations else None,
+        items=items,
+        status="running",
+        created_time=datetime.now().isoformat()
+    ))
+    db.commit()
+
+    # Items fan out over every worker; the chord body stores all results in bulk once they are in.
+    workflow = chord(signatures, finalize_batch_task.s(batch_id).on_error(fail_batch_task.s(batch_id)))
+    if shared_basis and 'pca' in operations:
+        workflow = chain(
+            chord([accumulate_pca_task.si(request_id) for request_id in request_ids],
+                  shared_pca_basis_task.s(batch_id, components)),
+            workflow
+        )
+    workflow.apply_async()
+    logger.info(f"Queued batch {batch_id} with {len(items)} items")
+
+    return jsonify(
+    {
+        "status": "202",
+        "batch_id": batch_id,
+        "message": "Batch request successfully queued",
+        "data": {
+            "items": len(items),
+            "operations": operations,
+            "shared_basis": shared_basis and 'pca' in operations,
+            "job_url": request.url_root + 'batch/' + batch_id
+        }
+    }
+    ), 202
+
+def _task_states(task_ids):
+    """
+    ``{task_id: (state, info)}`` from the result backend. Key-value backends
+    (Redis, memcached) answer for every task in one MGET; others are asked
+    task by task.
+    """
+    backend = celery.backend
+    if not task_ids:
+        return {}
+    if not hasattr(backend, 'mget'):
+        results = {task_id: AsyncResult(task_id, app=celery) for task_id in task_ids}
+        return {task_id: (result.state, result.info) for task_id, result in results.items()}
+    keys = [backend.get_key_for_task(task_id) for task_id in task_ids]
+    values = backend.mget(keys)
+    if hasattr(values, 'get'):
+        values = [values.get(key) for key in keys]
+    states = {}
+    for task_id, value in zip(task_ids, values):
+        meta = backend.decode_result(value) if value is not None else {"status": "PENDING", "result": None}
+        states[task_id] = (meta["status"], meta["result"])
+    return states
+
+def get_batch(batch_id):
+    logger.info(f"Received batch status request for batch_id: {batch_id}")
+    db = db_session()
+    batch = db.query(BatchJob).filter(BatchJob.batch_id == batch_id).first()
+
+    if not batch:
+        logger.error(f"Batch not found for batch_id: {batch_id}")
+        return jsonify({
+            "status": "404",
+            "messages": "Batch not found",
+            "batch_id": batch_id,
+            "error": ""
+        }), 404
+
+    running = _task_states([item["task_id"] for item in batch.items if "state" not in item])
+    items = []
+    for item in batch.items:
+        if "state" not in item:
+            state, info = running[item["task_id"]]
+            item = dict(item, state=state)
+            if state == "PROGRESS":
+                item["progress"] = info.get("progress", 0)
+            elif state == "FAILURE":
+                item["error"] = str(info)
+        elif item.get("result", {}).get("file_path"):
+            item = dict(item, result_url=media_url(item["result"]["file_path"]))
+        items.append(item)
+
+    counts = {}
+    for item in items:
+        counts[item["state"]] = counts.get(item["state"], 0) + 1
+    data = {
+        "state": batch.status,
+        "operations": batch.operations,
+        "components": batch.components,
+        "counts": counts,
+        "items": items,
+        "created_time": batch.created_time,
+        "finished_time": batch.finished_time
+    }
+    if batch.shared_basis:
+        data["shared_basis"] = batch.shared_basis
+
+    return jsonify({
+        "status": "200",
+        "messages": "Batch status successfully retrieved",
+        "batch_id": batch_id,
+        "data": data
+    }), 200
+
+def get_metrics():
+    """Counters and histograms of this and every other web and worker process, for Prometheus to scrape."""
+    return Response(snapshots.render(), content_type=METRICS_CONTENT_TYPE)
@@ -0,0 +1,329 @@
+# metrics.py - Stage timings, I/O and cache counters and peak memory in the Prometheus text format
+import glob
+import json
+import os
+import resource
+import socket
+import sys
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from config import Config
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+SECONDS_BUCKETS = (0.0005, 0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300, 1800)
+BYTES_BUCKETS = tuple(2 ** n * 1024 ** 2 for n in range(4, 16))
+
+
+class Metric:
+    """
+    A counter or histogram with a fixed tuple of label names, one series per
+    combination of label values. Histogram series hold per-bucket counts (the
+    last bucket is +Inf) followed by the sum of observations.
+    """
+
+    def __init__(self, registry, name, documentation, kind, labels=(), buckets=None):
+        self.registry = registry
+        self.name = name
+        self.documentation = documentation
+        self.kind = kind
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets) if buckets is not None else None
+        self.values = {}
+
+    def inc(self, amount=1, *labels):
+        with self.registry.lock:
+            self.values[labels] = self.values.get(labels, 0) + amount
+
+    def set(self, value, *labels):
+        """Mirror a count kept elsewhere (e.g. by ``StackCache``) into a counter."""
+        with self.registry.lock:
+            self.values[labels] = value
+
+    def observe(self, value, *labels):
+        slot = bisect_left(self.buckets, value)
+        with self.registry.lock:
+            series = self.values.get(labels)
+            if series is None:
+                series = self.values[labels] = [0] * (len(self.buckets) + 2)
+            series[slot] += 1
+            series[-1] += value
+
+
+class Registry:
+    """
+    The metrics of one process. ``collect`` callbacks run before every
+    snapshot, to copy in counts that other objects keep for themselves.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.metrics = {}
+        self.collectors = []
+
+    def _add(self, name, documentation, kind, labels, buckets=None):
+        metric = self.metrics[name] = Metric(self, name, documentation, kind, labels, buckets)
+        return metric
+
+    def counter(self, name, documentation, labels=()):
+        return self._add(name, documentation, 'counter', labels)
+
+    def histogram(self, name, documentation, labels=(), buckets=SECONDS_BUCKETS):
+        return self._add(name, documentation, 'histogram', labels, buckets)
+
+    def collect(self, callback):
+        self.collectors.append(callback)
+        return callback
+
+    def snapshot(self):
+        """``{name: [[label values, value or series], ...]}``, JSON-serializable."""
+        for callback in self.collectors:
+            callback()
+        with self.lock:
+            return {name: [[list(labels), list(value) if isinstance(value, list) else value]
+                           for labels, value in metric.values.items()]
+                    for name, metric in self.metrics.items()}
+
+    def merge(self, snapshots):
+        """Sum the snapshots of several processes, series by series."""
+        merged = {name: {} for name in self.metrics}
+        for snapshot in snapshots:
+            for name, samples in snapshot.items():
+                if name not in merged:
+                    continue
+                for labels, value in samples:
+                    labels = tuple(labels)
+                    if isinstance(value, list):
+                        total = merged[name].setdefault(labels, [0] * len(value))
+                        merged[name][labels] = [a + b for a, b in zip(total, value)]
+                    else:
+                        merged[name][labels] = merged[name].get(labels, 0) + value
+        return merged
+
+    def render(self, snapshots):
+        """The merged ``snapshots`` in the Prometheus text exposition format."""
+        lines = []
+        for name, series in self.merge(snapshots).items():
+            metric = self.metrics[name]
+            lines.append(f"# HELP {name} {metric.documentation}")
+            lines.append(f"# TYPE {name} {metric.kind}")
+            for labels, value in sorted(series.items()):
+                pairs = list(zip(metric.labels, labels))
+                if metric.kind == 'counter':
+                    lines.append(f"{name}{_labels(pairs)} {_number(value)}")
+                    continue
+                cumulative = 0
+                for bound, count in zip(metric.buckets + ('+Inf',), value[:-1]):
+                    cumulative += count
+                    le = bound if bound == '+Inf' else _number(bound)
+                    lines.append(f"{name}_bucket{_labels(pairs + [('le', le)])} {_number(cumulative)}")
+                lines.append(f"{name}_sum{_labels(pairs)} {_number(value[-1])}")
+                lines.append(f"{name}_count{_labels(pairs)} {_number(cumulative)}")
+        return '\n'.join(lines) + '\n'
+
+
+def _number(value):
+    return repr(float(value)) if isinstance(value, float) and not value.is_integer() else str(int(value))
+
+
+def _labels(pairs):
+    if not pairs:
+        return ''
+    escaped = (str(value).replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n') for _, value in pairs)
+    return '{' + ','.join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + '}'
+
+
+metrics = Registry()
+
+HTTP_REQUESTS = metrics.counter('hdip_http_requests_total', "HTTP requests by view", ('endpoint', 'method', 'status'))
+HTTP_SECONDS = metrics.histogram('hdip_http_request_seconds', "HTTP request latency by view", ('endpoint', 'method'))
+TASKS = metrics.counter('hdip_tasks_total', "Celery tasks run, by final state", ('task', 'state'))
+TASK_SECONDS = metrics.histogram('hdip_task_seconds', "Celery task run time", ('task',))
+TASK_PEAK_RSS = metrics.histogram('hdip_task_peak_rss_bytes', "Peak resident memory of the process while a task ran",
+                                  ('task',), BYTES_BUCKETS)
+STAGE_SECONDS = metrics.histogram('hdip_stage_seconds', "Time spent in each processing stage", ('stage',))
+DB_SECONDS = metrics.histogram('hdip_db_statement_seconds', "Database statement time", ('statement',))
+DECODE_SECONDS = metrics.histogram('hdip_decode_seconds', "Time decoding one TIFF page or store chunk", ('format',))
+BYTES_READ = metrics.counter('hdip_bytes_read_total', "Pixel bytes read from stacks", ('format',))
+BYTES_WRITTEN = metrics.counter('hdip_bytes_written_total', "Bytes of output files written", ('kind',))
+CACHE_LOOKUPS = metrics.counter('hdip_cache_lookups_total', "Cache lookups, by cache and result",
+                                ('cache', 'result'))
+
+
+@contextmanager
+def timed(stage):
+    """Time the block (or, as a decorator, every call) under ``hdip_stage_seconds{stage=...}``."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        STAGE_SECONDS.observe(time.perf_counter() - start, stage)
+
+
+def record_written(kind, path):
+    """Count the size of a file, or of every file in a directory, as written output."""
+    if os.path.isdir(path):
+        size = sum(entry.stat().st_size for entry in os.scandir(path) if entry.is_file())
+    else:
+        size = os.path.getsize(path)
+    BYTES_WRITTEN.inc(size, kind)
+
+
+def reset_peak_rss():
+    """Restart the process's peak RSS, so ``peak_rss_bytes`` covers what follows (Linux only)."""
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+    except OSError:
+        pass
+
+
+def peak_rss_bytes():
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    # Peak since the process started; ru_maxrss is in kilobytes on Linux and bytes on macOS.
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+def _start_statement(conn, cursor, statement, parameters, context, executemany):
+    # Kept on the statement's own context, not the pooled connection, so a
+    # statement that raises (and never reaches _finish_statement) leaves nothing behind.
+    if context is not None:
+        context._metrics_start = time.perf_counter()
+
+
+def _finish_statement(conn, cursor, statement, parameters, context, executemany):
+    start = getattr(context, '_metrics_start', None)
+    if start is not None:
+        DB_SECONDS.observe(time.perf_counter() - start, statement.lstrip().split(None, 1)[0].upper())
+
+
+def instrument_engine(engine):
+    """Time every statement executed on ``engine`` under ``hdip_db_statement_seconds``."""
+    from sqlalchemy import event
+    if not event.contains(engine, 'before_cursor_execute', _start_statement):
+        event.listen(engine, 'before_cursor_execute', _start_statement)
+        event.listen(engine, 'after_cursor_execute', _finish_statement)
+
+
+def instrument_app(app):
+    """
+    Time every request under ``hdip_http_request_seconds`` by view. With
+    ``PROFILE_REQUESTS`` set, a request carrying an ``X-Profile`` header is
+    run under cProfile; the stats go to ``PROFILE_DIR`` and the file name is
+    returned in the ``X-Profile-File`` response header.
+    """
+    import cProfile
+    import uuid
+    from flask import g, request
+
+    @app.before_request
+    def start_request():
+        g.metrics_start = time.perf_counter()
+        if app.config.get('PROFILE_REQUESTS') and 'X-Profile' in request.headers:
+            g.profiler = cProfile.Profile()
+            g.profiler.enable()
+
+    @app.after_request
+    def finish_request(response):
+        profiler = g.pop('profiler', None)
+        if profiler is not None:
+            profiler.disable()
+            os.makedirs(app.config['PROFILE_DIR'], exist_ok=True)
+            path = os.path.join(app.config['PROFILE_DIR'],
+                                f"{time.strftime('%Y%m%dT%H%M%S')}-{request.endpoint}-{uuid.uuid4().hex[:8]}.prof")
+            profiler.dump_stats(path)
+            response.headers['X-Profile-File'] = os.path.basename(path)
+        start = g.pop('metrics_start', None)
+        if start is not None:
+            endpoint = request.endpoint or 'unmatched'
+            HTTP_SECONDS.observe(time.perf_counter() - start, endpoint, request.method)
+            HTTP_REQUESTS.inc(1, endpoint, request.method, str(response.status_code))
+            snapshots.flush(force=False)
+        return response
+
+
+class Snapshots:
+    """
+    Metrics shared between processes through ``METRICS_DIR``: every Celery
+    worker and web worker process writes its snapshot there, and ``/metrics``
+    adds up all of them. Files are keyed by host and pid. A process rewrites
+    its file at least once per ``interval`` from a background thread and
+    removes it when it exits cleanly; files not rewritten for
+    ``STALE_INTERVALS`` intervals, left by processes that died, are deleted
+    by ``render``. The counters of a restarted process therefore start again
+    from zero, which Prometheus treats as a counter reset.
+    """
+
+    STALE_INTERVALS = 3
+
+    def __init__(self, directory, interval):
+        self.directory = directory
+        self.interval = interval
+        self._flushed = 0.0
+        self._keepalive_pid = None
+
+    @property
+    def path(self):
+        return os.path.join(self.directory, f"{socket.gethostname()}-{os.getpid()}.json")
+
+    def flush(self, force=True):
+        """Write this process's snapshot; unless ``force``, at most once per ``interval`` seconds."""
+        now = time.monotonic()
+        if not force and now - self._flushed < self.interval:
+            return
+        self._flushed = now
+        os.makedirs(self.directory, exist_ok=True)
+        temp_path = f"{self.path}.{threading.get_ident()}.tmp"
+        with open(temp_path, 'w') as f:
+            json.dump(metrics.snapshot(), f)
+        os.replace(temp_path, self.path)
+        if self._keepalive_pid != os.getpid():
+            # Threads do not survive a fork, so every process that flushes starts its own.
+            self._keepalive_pid = os.getpid()
+            threading.Thread(target=self._keep_alive, name='metrics-snapshots', daemon=True).start()
+
+    def _keep_alive(self):
+        # An idle process still rewrites its file, so render never takes it for a dead one.
+        pid = os.getpid()
+        while self._keepalive_pid == pid:
+            time.sleep(self.interval)
+            try:
+                self.flush(force=False)
+            except OSError:
+                pass
+
+    def remove(self):
+        """Delete this process's snapshot file, when the process exits."""
+        self._keepalive_pid = None
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
+
+    def render(self):
+        """This process's live metrics plus the last snapshot of every other live process."""
+        snapshots = [metrics.snapshot()]
+        stale = time.time() - self.STALE_INTERVALS * self.interval
+        for path in glob.glob(os.path.join(self.directory, '*.json')):
+            if path == self.path:
+                continue
+            try:
+                if os.path.getmtime(path) < stale:
+                    os.remove(path)
+                    continue
+                with open(path) as f:
+                    snapshots.append(json.load(f))
+            except (OSError, ValueError):
+                continue
+        return metrics.render(snapshots)
+
+
+snapshots = Snapshots(Config.METRICS_DIR, Config.METRICS_FLUSH_SECONDS)
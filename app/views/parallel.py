@@ -0,0 +1,120 @@
+# parallel.py - Thread and process pools over independent (T, Z) chunks, with BLAS threads kept in check
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from contextlib import nullcontext
+import numpy as np
+from threadpoolctl import threadpool_limits
+from config import Config, available_cpus
+
+EXECUTORS = ('thread', 'process')
+
+_worker_limits = None
+
+
+def default_workers():
+    """Pool size for one task: its share of the cores given the Celery worker's concurrency."""
+    return Config.COMPUTE_WORKERS or max(1, available_cpus() // Config.CELERY_WORKER_CONCURRENCY)
+
+
+def blas_threads(workers=1):
+    """BLAS/OpenMP threads for each of ``workers`` so that tasks x workers x threads fits the cores."""
+    return max(1, available_cpus() // (Config.CELERY_WORKER_CONCURRENCY * max(1, workers)))
+
+
+def limit_blas_threads(threads):
+    """Cap the BLAS/OpenMP pools of this process; used as a pool initializer and at worker start."""
+    global _worker_limits
+    _worker_limits = threadpool_limits(limits=threads)
+
+
+def split_planes(shape, parts, planes=None):
+    """
+    Split the (T, Z) planes of a (T, Z, ...) shape, or the (t, z) pairs in
+    ``planes``, into at most ``parts`` contiguous groups.
+    """
+    if planes is None:
+        planes = [(t, z) for t in range(shape[0]) for z in range(shape[1])]
+    groups = np.array_split(np.arange(len(planes)), max(1, min(parts, len(planes))))
+    return [[planes[i] for i in group] for group in groups]
+
+
+class ComputeBackend:
+    """
+    Where the independent chunks of an operation run: inline, or on a pool
+    of ``workers`` threads or processes (``executor`` 'thread' or 'process').
+    Daemonic processes, such as Celery's prefork children, may not start
+    processes of their own, so there 'process' falls back to threads.
+
+    While chunks run, the BLAS and OpenMP pools behind NumPy and
+    scikit-learn are capped so that parallel chunks, times the Celery
+    worker's concurrency, do not oversubscribe the host. Process workers
+    open their own file handles, so chunk functions take paths rather than
+    open stacks and must be picklable.
+    """
+
+    def __init__(self, executor='thread', workers=1):
+        if executor not in EXECUTORS:
+            raise ValueError(f"Unknown executor {executor!r}, expected one of {', '.join(EXECUTORS)}")
+        if executor == 'process' and multiprocessing.current_process().daemon:
+            executor = 'thread'
+        self.executor = executor
+        self.workers = max(1, int(workers))
+
+    @classmethod
+    def from_config(cls):
+        return cls(Config.COMPUTE_EXECUTOR, default_workers())
+
+    @property
+    def parallel(self):
+        return self.workers > 1
+
+    def limits(self, workers=1):
+        """Context capping BLAS threads in this process while ``workers`` chunks run in it."""
+        return threadpool_limits(limits=blas_threads(workers))
+
+    def pool(self, workers=None):
+        """A new executor of up to ``workers`` (default ``self.workers``); shut it down when done."""
+        workers = max(1, min(workers or self.workers, self.workers))
+        if self.executor == 'process':
+            return ProcessPoolExecutor(max_workers=workers, initializer=limit_blas_threads,
+                                       initargs=(blas_threads(workers),))
+        return ThreadPoolExecutor(max_workers=workers)
+
+    def run(self, fn, tasks, sizes=None, progress=None):
+        """
+        Call ``fn(*args)`` for each tuple in ``tasks`` and return the results
+        in task order. ``progress(done, total)`` is called as tasks finish,
+        counting ``sizes`` (one per task by default).
+        """
+        tasks = list(tasks)
+        sizes = list(sizes) if sizes is not None else [1] * len(tasks)
+        total = sum(sizes)
+        workers = min(self.workers, len(tasks))
+        results = [None] * len(tasks)
+        done = 0
+        if workers <= 1:
+            with self.limits():
+                for i, args in enumerate(tasks):
+                    results[i] = fn(*args)
+                    done += sizes[i]
+                    if progress is not None:
+                        progress(done, total)
+            return results
+
+        # Threads share this process's BLAS pools; process workers cap their own in the initializer.
+        pool = self.pool(workers)
+        try:
+            with self.limits(workers) if self.executor == 'thread' else nullcontext():
+                futures = {pool.submit(fn, *args): i for i, args in enumerate(tasks)}
+                for future in as_completed(futures):
+                    i = futures[future]
+                    results[i] = future.result()
+                    done += sizes[i]
+                    if progress is not None:
+                        progress(done, total)
+        finally:
+            pool.shutdown(cancel_futures=True)
+        return results
+
+
+SERIAL = ComputeBackend('thread', 1)
@@ -0,0 +1,252 @@
+# plane_index.py - Per-(T, Z, C) plane summaries, built once at ingest and merged without reading pixels
+import numpy as np
+from .parallel import ComputeBackend, split_planes
+from .stream_stats import RunningStats, channel_statistics
+from .chunk_store import open_stack
+
+SUMMARY_BINS = 256
+
+
+def _exact(dtype):
+    return dtype.kind in 'ui' and dtype.itemsize <= 2
+
+
+def _shift(low, high, bins):
+    # Smallest k at which the values low .. high span at most ``bins`` bins of 2**k values aligned to multiples of 2**k.
+    shift = 0
+    while (high >> shift) - (low >> shift) >= bins:
+        shift += 1
+    return shift
+
+
+def _summarize(stack, planes, edges=None, bins=SUMMARY_BINS, progress=None):
+    """
+    (t, z, c, count, sum, sum of squares, min, max, shift, first bin, counts)
+    per plane of ``planes``, with at most ``bins`` counts each.
+
+    Integer data of up to 16 bits is counted per value, and every sum comes
+    from those counts; the counts are then merged into bins of 2**shift
+    values aligned to multiples of 2**shift, so that the planes' bins nest
+    and merge exactly once the range of the whole stack is known. Other data
+    is binned over ``edges`` (shift None).
+    """
+    exact = _exact(stack.dtype)
+    offset = int(np.iinfo(stack.dtype).min) if exact else 0
+    pages = {}
+    rows = []
+    for i, (t, z) in enumerate(planes):
+        for c in range(stack.shape[2]):
+            values = stack.plane(t, z, c, pages, cache=False).ravel()
+            if exact:
+                if offset:
+                    # Flipping the sign bit maps signed values onto 0 .. 2**bits - 1 at the same width.
+                    values = values.view(f'u{values.itemsize}') ^ (1 << (8 * values.itemsize - 1))
+                counts = np.bincount(values)
+                low = int(np.flatnonzero(counts)[0])
+                high = len(counts) - 1
+                counts = counts[low:]
+                levels = np.arange(low + offset, high + offset + 1, dtype=np.int64)
+                shift = _shift(low, high, bins)
+                first = low >> shift
+                coarse = np.bincount((np.arange(low, high + 1) >> shift) - first, weights=counts).astype(np.int64)
+                rows.append((t, z, c, values.size, int(counts @ levels), int(counts @ (levels * levels)),
+                             low + offset, high + offset, shift, first, coarse))
+            else:
+                work = values.astype(np.float64)
+                rows.append((t, z, c, values.size, float(work.sum()), float(work @ work),
+                             float(work.min()), float(work.max()), None, 0, np.histogram(work, bins=edges)[0]))
+        if progress is not None:
+            progress(i + 1, len(planes))
+    return rows
+
+
+def _summarize_file(file_path, page_index, planes, edges, bins):
+    # Runs in a worker: summarize a group of planes through a private handle.
+    with open_stack(file_path, page_index) as stack:
+        return _summarize(stack, planes, edges, bins)
+
+
+class PlaneIndex:
+    """
+    Count, sum, sum of squares, min, max and a histogram of every (T, Z, C)
+    plane of a stack.
+
+    All planes share ``edges``, so the rows of any T/Z range merge by
+    addition (see ``merge_rows`` and ``merge_totals``) into the statistics,
+    percentiles and thresholds of ``RunningStats``, at the resolution of the
+    bins. ``hist`` holds the counts of each plane, shape (T, Z, C, bins).
+    """
+
+    def __init__(self, dtype, count, total, total_sq, minimum, maximum, hist, edges):
+        self.dtype = np.dtype(dtype)
+        self.count = count
+        self.total = total
+        self.total_sq = total_sq
+        self.min = minimum
+        self.max = maximum
+        self.hist = hist
+        self.edges = edges
+
+    @property
+    def shape(self):
+        return self.count.shape
+
+    def rows(self, image_id):
+        """PlaneSummary rows, each histogram cut to its first to last non-empty bin."""
+        rows = []
+        for (t, z, c), n in np.ndenumerate(self.count):
+            counts = self.hist[t, z, c]
+            nonzero = np.flatnonzero(counts)
+            start, stop = (nonzero[0], nonzero[-1] + 1) if len(nonzero) else (0, 0)
+            rows.append({
+                "image_id": image_id,
+                "time": t,
+                "z": z,
+                "channel": c,
+                "count": int(n),
+                "sum": float(self.total[t, z, c]),
+                "sum_sq": float(self.total_sq[t, z, c]),
+                "min": float(self.min[t, z, c]),
+                "max": float(self.max[t, z, c]),
+                "hist_offset": int(start),
+                "histogram": counts[start:stop].tolist()
+            })
+        return rows
+
+    def info(self):
+        """
+        What ImageMetadata.plane_index records alongside the rows, including
+        the per-channel totals over every plane, so statistics of the whole
+        stack need no rows at all (see ``merge_totals``).
+        """
+        return {
+            "shape": list(self.shape),
+            "dtype": self.dtype.name,
+            "bins": len(self.edges) - 1,
+            "range": [float(self.edges[0]), float(self.edges[-1])],
+            "totals": {
+                "count": self.count.sum(axis=(0, 1)).tolist(),
+                "sum": self.total.sum(axis=(0, 1)).tolist(),
+                "sum_sq": self.total_sq.sum(axis=(0, 1)).tolist(),
+                "min": self.min.min(axis=(0, 1)).tolist(),
+                "max": self.max.max(axis=(0, 1)).tolist(),
+                "histogram": self.hist.sum(axis=(0, 1)).tolist()
+            }
+        }
+
+
+def _summary(t, z, c, count, total, total_sq, minimum, maximum):
+    mean = total / count
+    return {
+        "time": t,
+        "z": z,
+        "channel": c,
+        "mean": float(mean),
+        "std": float(np.sqrt(max(total_sq / count - mean * mean, 0.0))),
+        "min": float(minimum),
+        "max": float(maximum)
+    }
+
+
+def index_edges(info):
+    """Bin edges shared by every plane of an ImageMetadata.plane_index."""
+    return np.linspace(info["range"][0], info["range"][1], info["bins"] + 1)
+
+
+def merge_totals(info, histogram=True):
+    """RunningStats of every channel over the whole stack, from the totals of ``PlaneIndex.info``."""
+    totals = info["totals"]
+    return RunningStats.from_sums(info["dtype"], totals["count"], totals["sum"], totals["sum_sq"], totals["min"],
+                                  totals["max"], totals["histogram"] if histogram else None, index_edges(info))
+
+
+def merge_rows(info, rows, histogram=True):
+    """
+    RunningStats of every channel over PlaneSummary ``rows``, e.g. those of
+    a T/Z range; only the (C, bins) merged counts are held, never one
+    histogram per plane.
+    """
+    channels = info["shape"][2]
+    count = np.zeros(channels, dtype=np.int64)
+    total, total_sq = np.zeros(channels), np.zeros(channels)
+    minimum, maximum = np.full(channels, np.inf), np.full(channels, -np.inf)
+    hist = np.zeros((channels, info["bins"]), dtype=np.int64) if histogram else None
+    for row in rows:
+        c = row.channel
+        count[c] += row.count
+        total[c] += row.sum
+        total_sq[c] += row.sum_sq
+        minimum[c] = min(minimum[c], row.min)
+        maximum[c] = max(maximum[c], row.max)
+        if hist is not None:
+            hist[c, row.hist_offset:row.hist_offset + len(row.histogram)] += row.histogram
+    if not count.all():
+        raise IndexError("Selection holds no planes of the index")
+    return RunningStats.from_sums(info["dtype"], count, total, total_sq, minimum, maximum, hist, index_edges(info))
+
+
+def plane_summary(row, centers, threshold):
+    """
+    Mean, standard deviation, min and max of one PlaneSummary row, with the
+    share of its pixels in bins whose ``centers`` lie above ``threshold``.
+    """
+    above = centers[row.hist_offset:row.hist_offset + len(row.histogram)] > threshold
+    return dict(_summary(row.time, row.z, row.channel, row.count, row.sum, row.sum_sq, row.min, row.max),
+                foreground=float(np.asarray(row.histogram, dtype=np.int64)[above].sum() / row.count))
+
+
+def _rebin(rows, bins, offset):
+    # The aligned counts of every plane onto the widest of their power-of-two grids that covers the whole stack in
+    # at most ``bins`` bins; every plane bin falls inside exactly one of those.
+    low = min(row[6] for row in rows) - offset
+    high = max(row[7] for row in rows) - offset
+    shift = max(max(row[8] for row in rows), _shift(low, high, bins))
+    first = low >> shift
+    n_bins = (high >> shift) - first + 1
+    edges = ((first + np.arange(n_bins + 1, dtype=np.float64)) * (1 << shift)) + offset - 0.5
+    hists = [np.bincount(((row[9] + np.arange(len(row[10]))) >> (shift - row[8])) - first, weights=row[10],
+                         minlength=n_bins).astype(np.int64) for row in rows]
+    return hists, edges
+
+
+def build_plane_index(stack, bins=SUMMARY_BINS, workers=1, executor='thread', progress=None):
+    """
+    Summarize every (T, Z, C) plane of ``stack`` into a PlaneIndex with at
+    most ``bins`` histogram bins.
+
+    Integer data of up to 16 bits takes one pass: each plane is counted per
+    value and reduced at once to at most ``bins`` counts on a power-of-two
+    grid, and the planes' counts are merged onto one grid over the range of
+    the whole stack at the end, so bins hold a whole number of values each.
+    Other data takes a min/max pass first, to fix the bins. Groups of planes
+    are summarized in parallel as by ``channel_statistics``; workers return
+    only the reduced counts. ``progress(done, total)`` counts planes.
+    """
+    planes = [(t, z) for t in range(stack.shape[0]) for z in range(stack.shape[1])]
+    edges = None
+    if not _exact(stack.dtype):
+        bounds = channel_statistics(stack, workers=workers, executor=executor)
+        low, high = float(bounds.min.min()), float(bounds.max.max())
+        edges = np.linspace(low, high if high > low else low + 1, bins + 1)
+
+    backend = ComputeBackend(executor, max(1, min(workers, len(planes))))
+    if backend.parallel:
+        groups = split_planes(stack.shape, backend.workers)
+        rows = [row for part in backend.run(_summarize_file, [
+            (stack.file_path, stack.page_index, group, edges, bins) for group in groups
+        ], sizes=[len(group) for group in groups], progress=progress) for row in part]
+    else:
+        rows = _summarize(stack, planes, edges, bins, progress)
+
+    if edges is None:
+        hists, edges = _rebin(rows, bins, int(np.iinfo(stack.dtype).min))
+    else:
+        hists = [row[10] for row in rows]
+    shape = stack.shape[:3]
+    index = PlaneIndex(stack.dtype, np.zeros(shape, dtype=np.int64), np.zeros(shape), np.zeros(shape),
+                       np.zeros(shape), np.zeros(shape), np.zeros(shape + (len(edges) - 1,), dtype=np.int64), edges)
+    for row, hist in zip(rows, hists):
+        at = row[:3]
+        index.count[at], index.total[at], index.total_sq[at], index.min[at], index.max[at] = row[3:8]
+        index.hist[at] = hist
+    return index
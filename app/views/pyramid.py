@@ -0,0 +1,144 @@
+# pyramid.py - Tiled multi-resolution pyramids for viewport and thumbnail serving
+import math
+import os
+import shutil
+import tempfile
+import numpy as np
+import tifffile
+
+PYRAMID_DIR = os.path.join("media", "pyramids")
+
+
+def level_shapes(height, width, tile_size):
+    """(Y, X) of every level, halving until a plane fits in one tile."""
+    shapes = [(height, width)]
+    while height > tile_size or width > tile_size:
+        height, width = math.ceil(height / 2), math.ceil(width / 2)
+        shapes.append((height, width))
+    return shapes
+
+
+def downsample(plane, factor):
+    """Mean of ``factor`` x ``factor`` blocks; edge blocks are padded by repeating the border."""
+    if factor == 1:
+        return plane
+    height, width = plane.shape
+    pad = (-height % factor, -width % factor)
+    if any(pad):
+        plane = np.pad(plane, ((0, pad[0]), (0, pad[1])), mode='edge')
+    blocks = plane.reshape(plane.shape[0] // factor, factor, plane.shape[1] // factor, factor)
+    reduced = blocks.mean(axis=(1, 3), dtype=np.float64)
+    if plane.dtype.kind in 'ui':
+        reduced = np.rint(reduced)
+    return reduced.astype(plane.dtype)
+
+
+def _iter_tiles(planes, tile_size, progress=None, reduced=None):
+    # tifffile expects full-size tiles for every page, in row-major order.
+    for i, plane in enumerate(planes):
+        plane = np.asarray(plane)
+        if reduced is not None:
+            # The next level is built from this one, so the source is read only once.
+            reduced[i] = downsample(plane, 2)
+        if progress is not None:
+            # tifffile stops pulling once it has every tile, so report before yielding.
+            progress(i + 1)
+        for y in range(0, plane.shape[0], tile_size):
+            for x in range(0, plane.shape[1], tile_size):
+                tile = plane[y:y + tile_size, x:x + tile_size]
+                if tile.shape != (tile_size, tile_size):
+                    tile = np.pad(tile, ((0, tile_size - tile.shape[0]), (0, tile_size - tile.shape[1])))
+                yield tile
+
+
+def build_pyramid(stack, output_path, tile_size=256, compression='zlib', progress=None):
+    """
+    Write a tiled, compressed pyramidal OME-TIFF of a TiffStack.
+
+    Level 0 holds every (T, Z, C) plane at full resolution; each further
+    level halves Y and X of the one above (block mean) and is stored as its
+    SubIFDs, so the file opens in any OME-aware viewer. Levels are written one
+    after the other; while a level is written, its halved planes go to a
+    scratch array on disk next to ``output_path``, which the next level is
+    written from. The source is read once and only one plane is held in
+    memory at a time. ``progress(done, total)`` counts planes over all levels.
+
+    Returns the pyramid description stored with ``ImageMetadata``: the tile
+    size, the (T, Z, C) shape and, per level, the (Y, X) shape and the IFD
+    offset of every page, so a tile can be read without parsing the file.
+    """
+    shapes = level_shapes(stack.shape[3], stack.shape[4], tile_size)
+    planes = int(np.prod(stack.shape[:3]))
+    report = None
+    previous = None
+    scratch = tempfile.mkdtemp(dir=os.path.dirname(os.path.abspath(output_path)))
+    try:
+        with tifffile.TiffWriter(output_path, bigtiff=True, ome=True) as tif:
+            for level, shape in enumerate(shapes):
+                if progress is not None:
+                    report = lambda done, level=level: progress(level * planes + done, len(shapes) * planes)
+                options = {"subifds": len(shapes) - 1, "metadata": {"axes": "TZCYX"}} if level == 0 else \
+                    {"subfiletype": 1, "metadata": None}
+                reduced = None
+                if level + 1 < len(shapes):
+                    reduced = np.lib.format.open_memmap(os.path.join(scratch, f"level{level + 1}.npy"), mode='w+',
+                                                        dtype=stack.dtype, shape=(planes,) + shapes[level + 1])
+                source = (plane for *_, plane in stack.iter_planes()) if level == 0 else previous
+                tif.write(_iter_tiles(source, tile_size, report, reduced),
+                          shape=stack.shape[:3] + shape, dtype=stack.dtype, tile=(tile_size, tile_size),
+                          compression=compression, photometric='minisblack', **options)
+                previous = reduced
+    finally:
+        # Drop the memmaps before removing the files behind them.
+        previous = reduced = None
+        shutil.rmtree(scratch, ignore_errors=True)
+
+    with tifffile.TiffFile(output_path) as tif:
+        levels = tif.series[0].levels
+        return {
+            "file_path": output_path,
+            "tile_size": tile_size,
+            "shape": list(stack.shape[:3]),
+            "dtype": str(stack.dtype),
+            "levels": [
+                {"shape": list(shape), "page_offsets": [page.offset for page in series.pages]}
+                for shape, series in zip(shapes, levels)
+            ]
+        }
+
+
+def tile_grid(pyramid, level):
+    """Number of (rows, columns) of tiles in a level."""
+    height, width = pyramid["levels"][level]["shape"]
+    tile_size = pyramid["tile_size"]
+    return math.ceil(height / tile_size), math.ceil(width / tile_size)
+
+
+def read_tile(pyramid, level, time, z, channel, y, x):
+    """
+    Decode tile (y, x) of plane (time, z, channel) at ``level``.
+
+    Only the page's IFD and the one compressed tile are read. Edge tiles are
+    cropped to the plane, so they may be smaller than the tile size.
+    """
+    if not 0 <= level < len(pyramid["levels"]):
+        raise IndexError(f"Level {level} is out of bounds for a pyramid of {len(pyramid['levels'])} levels")
+    for name, value, size in zip(("Time", "Z", "Channel"), (time, z, channel), pyramid["shape"]):
+        if not 0 <= value < size:
+            raise IndexError(f"{name} index {value} is out of bounds with size {size}")
+    rows, columns = tile_grid(pyramid, level)
+    if not (0 <= y < rows and 0 <= x < columns):
+        raise IndexError(f"Tile ({y}, {x}) is out of bounds for a {rows} x {columns} tile grid at level {level}")
+
+    tile_size = pyramid["tile_size"]
+    height, width = pyramid["levels"][level]["shape"]
+    number = (time * pyramid["shape"][1] + z) * pyramid["shape"][2] + channel
+    with tifffile.TiffFile(pyramid["file_path"]) as tif:
+        tif.filehandle.seek(pyramid["levels"][level]["page_offsets"][number])
+        page = tifffile.TiffPage(tif, index=number)
+        index = y * columns + x
+        tif.filehandle.seek(page.dataoffsets[index])
+        data = tif.filehandle.read(page.databytecounts[index])
+        tile = page.decode(data, index)[0].reshape(tile_size, tile_size)
+    return tile[:min(tile_size, height - y * tile_size), :min(tile_size, width - x * tile_size)]
+
@@ -0,0 +1,179 @@
+# result_cache.py - Content-addressed cache for slice, statistics and PCA results
+import hashlib
+import json
+import logging
+import os
+import threading
+from collections import OrderedDict
+from datetime import datetime
+from sqlalchemy import func, select, union
+from sqlalchemy.exc import IntegrityError
+from app.models import db_session
+from app.models.image_process import CachedResult, ImageMetadata, PCAResults, SegmentationResults
+from config import Config
+from .metrics import CACHE_LOOKUPS
+from .stack_cache import stack_cache
+
+logger = logging.getLogger(__name__)
+
+CACHE_DIR = os.path.join("media", "cache")
+HASH_BLOCK_SIZE = 1024 * 1024
+
+
+def file_content_hash(file_path):
+    """SHA-256 of a file, read in fixed-size blocks."""
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for block in iter(lambda: f.read(HASH_BLOCK_SIZE), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def ensure_content_hash(image):
+    """Return the image's content hash, computing and storing it for rows that predate it."""
+    if image.content_hash:
+        return image.content_hash
+    content_hash = file_content_hash(image.file_path)
+    db = db_session()
+    db.query(ImageMetadata).filter(ImageMetadata.id == image.id).update({"content_hash": content_hash})
+    db.commit()
+    image.content_hash = content_hash
+    return content_hash
+
+
+def content_key(image):
+    """
+    The image's content hash, or for rows that predate it, a key built from the
+    row id and the file's size and modification time. Views use this so they
+    never hash a whole file on the request thread; the heavy metadata task
+    stores the real hash later.
+    """
+    if image.content_hash:
+        return image.content_hash
+    stat = os.stat(image.file_path)
+    return f"file:{image.id}:{stat.st_size}:{stat.st_mtime_ns}"
+
+
+def cache_key(content_hash, operation, params):
+    payload = json.dumps([content_hash, operation, params], sort_keys=True)
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+class ResultCache:
+    """
+    Results keyed by (file content hash, operation, parameters).
+
+    Entries live in the ``result_cache`` table, with larger outputs stored as
+    files under ``media/cache``. Cached files are evicted least recently used
+    first once they exceed ``max_bytes``; files that a PCAResults or
+    SegmentationResults row points to are pinned, neither evicted nor counted
+    against ``max_bytes``, so listed results keep their outputs. Each process
+    keeps its ``memory_items`` most recently used entries in memory so hot
+    lookups skip the database entirely.
+    """
+
+    def __init__(self, max_bytes, memory_items):
+        self.max_bytes = max_bytes
+        self.memory_items = memory_items
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _remember(self, key, entry):
+        with self._lock:
+            self._memory[key] = entry
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.memory_items:
+                self._memory.popitem(last=False)
+
+    def _forget(self, key):
+        with self._lock:
+            self._memory.pop(key, None)
+
+    def file_path(self, content_hash, operation, params, suffix='.tif'):
+        """Deterministic location for a cached output file."""
+        return os.path.join(CACHE_DIR, cache_key(content_hash, operation, params) + suffix)
+
+    def get(self, content_hash, operation, params):
+        """Return ``{"result": ..., "file_path": ...}`` for a cached entry, or None."""
+        entry = self._lookup(content_hash, operation, params)
+        CACHE_LOOKUPS.inc(1, 'result', 'miss' if entry is None else 'hit')
+        return entry
+
+    def _lookup(self, content_hash, operation, params):
+        key = cache_key(content_hash, operation, params)
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                self._memory.move_to_end(key)
+        if entry is not None and entry["file_path"] is None:
+            return entry
+
+        db = db_session()
+        row = db.query(CachedResult).filter(CachedResult.key == key).first()
+        if row is None:
+            self._forget(key)
+            return None
+        if row.file_path and not os.path.exists(row.file_path):
+            # Evicted by another process; drop the stale row.
+            db.delete(row)
+            db.commit()
+            self._forget(key)
+            return None
+        row.last_access = datetime.now()
+        entry = {"result": row.result, "file_path": row.file_path}
+        db.commit()
+        self._remember(key, entry)
+        return entry
+
+    def put(self, content_hash, operation, params, result=None, file_path=None):
+        key = cache_key(content_hash, operation, params)
+        db = db_session()
+        db.add(CachedResult(
+            key=key,
+            content_hash=content_hash,
+            operation=operation,
+            params=params,
+            result=result,
+            file_path=file_path,
+            size_bytes=os.path.getsize(file_path) if file_path else 0,
+            last_access=datetime.now()
+        ))
+        try:
+            db.commit()
+        except IntegrityError:
+            # Another worker cached the same result first.
+            db.rollback()
+        self._remember(key, {"result": result, "file_path": file_path})
+        if file_path:
+            self.evict()
+
+    def evict(self):
+        """Delete least recently used unpinned cached files until they fit in ``max_bytes``."""
+        db = db_session()
+        pinned = union(select(PCAResults.file_path), select(SegmentationResults.file_path))
+        evictable = CachedResult.file_path.isnot(None) & CachedResult.file_path.notin_(pinned)
+        total = db.query(func.coalesce(func.sum(CachedResult.size_bytes), 0)).filter(evictable).scalar()
+        if total > self.max_bytes:
+            rows = db.query(CachedResult).filter(evictable).order_by(CachedResult.last_access)
+            for row in rows:
+                if total <= self.max_bytes:
+                    break
+                try:
+                    os.remove(row.file_path)
+                except FileNotFoundError:
+                    pass
+                stack_cache.invalidate(row.file_path)
+                total -= row.size_bytes
+                logger.info(f"Evicted cached {row.operation} result {row.key}")
+                self._forget(row.key)
+                db.delete(row)
+            db.commit()
+
+
+def atomic_output_path(path):
+    """Temporary sibling of ``path`` to write to before ``os.replace``-ing it into place."""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    return f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+
+
+result_cache = ResultCache(Config.RESULT_CACHE_MAX_BYTES, Config.RESULT_CACHE_MEMORY_ITEMS)
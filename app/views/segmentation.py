@@ -0,0 +1,112 @@
+# segmentation.py - Histogram thresholds and chunked, compressed mask output
+import zlib
+import numpy as np
+import tifffile
+from .parallel import ComputeBackend
+from .stream_stats import channel_statistics
+from .chunk_store import open_stack
+
+METHODS = ('otsu', 'kmeans')
+MASK_TILE_SIZE = 256
+
+
+def channel_histogram(stack, channel, bins=256, workers=1, executor='thread', progress=None):
+    """
+    RunningStats holding the histogram of one channel.
+
+    Integer data of up to 16 bits gets an exact per-value histogram; other
+    data takes a min/max pass first and is binned into ``bins`` over that
+    range, as skimage does.
+    """
+    value_range = None
+    if not (stack.dtype.kind in 'ui' and stack.dtype.itemsize <= 2):
+        bounds = channel_statistics(stack, channels=[channel], workers=workers, executor=executor)
+        low, high = float(bounds.min[channel]), float(bounds.max[channel])
+        value_range = (low, high if high > low else low + 1)
+    return channel_statistics(stack, channels=[channel], histogram=True, bins=bins, value_range=value_range,
+                              workers=workers, executor=executor, progress=progress)
+
+
+def segmentation_threshold(stack, channel, method='otsu', workers=1, executor='thread', progress=None):
+    """Threshold separating foreground (values above it) from background."""
+    if method not in METHODS:
+        raise ValueError(f"Unknown segmentation method {method!r}, expected one of {', '.join(METHODS)}")
+    stats = channel_histogram(stack, channel, workers=workers, executor=executor, progress=progress)
+    if method == 'otsu':
+        return stats.otsu_threshold(channel)
+    return stats.kmeans_threshold(channel)
+
+
+def _mask_tiles(plane, threshold, tile_size):
+    # One zlib-compressed, zero-padded uint8 tile at a time, in row-major order.
+    tile = np.empty((tile_size, tile_size), dtype=np.uint8)
+    for y in range(0, plane.shape[0], tile_size):
+        for x in range(0, plane.shape[1], tile_size):
+            chunk = plane[y:y + tile_size, x:x + tile_size]
+            tile[:] = 0
+            np.greater(chunk, threshold, out=tile[:chunk.shape[0], :chunk.shape[1]], casting='unsafe')
+            yield zlib.compress(tile.tobytes())
+
+
+def _encode_planes(file_path, page_index, planes, channel, threshold, tile_size):
+    # Runs in a worker: each opens its own handle and returns the encoded tiles per plane.
+    pages = {}
+    with open_stack(file_path, page_index) as stack:
+        return [list(_mask_tiles(stack.plane(t, z, channel, pages, cache=False), threshold, tile_size))
+                for t, z in planes]
+
+
+def _iter_encoded(stack, planes, channel, threshold, tile_size, pool, workers, progress):
+    if pool is None:
+        pages = {}
+        for i, (t, z) in enumerate(planes):
+            tiles = list(_mask_tiles(stack.plane(t, z, channel, pages, cache=False), threshold, tile_size))
+            if progress is not None:
+                progress(i + 1, len(planes))
+            yield from tiles
+        return
+
+    # Several small groups per worker keep the pool busy while the results
+    # are written in order; masks compress well, so queued groups stay small.
+    groups = [[planes[i] for i in group]
+              for group in np.array_split(np.arange(len(planes)), min(len(planes), 4 * workers))]
+    results = pool.map(_encode_planes, *zip(*[
+        (stack.file_path, stack.page_index, group, channel, threshold, tile_size) for group in groups
+    ]))
+    done = 0
+    for group, encoded in zip(groups, results):
+        done += len(group)
+        if progress is not None:
+            # tifffile stops pulling once it has every tile, so report before yielding.
+            progress(done, len(planes))
+        for tiles in encoded:
+            yield from tiles
+
+
+def write_mask(stack, channel, threshold, output_path, tile_size=MASK_TILE_SIZE, workers=1,
+               executor='thread', progress=None):
+    """
+    Write the (T, Z, Y, X) mask ``plane > threshold`` of one channel as a
+    tiled, zlib-compressed uint8 TIFF.
+
+    Planes are thresholded and compressed tile by tile in a pool of
+    ``workers`` (``executor`` is 'thread' or 'process'; NumPy and zlib
+    release the GIL, so threads suffice); the encoded tiles are written in
+    order by this process, so no worker ever holds more than one plane.
+    ``progress(done, total)`` counts planes.
+    """
+    planes = [(t, z) for t in range(stack.shape[0]) for z in range(stack.shape[1])]
+    backend = ComputeBackend(executor, min(workers, len(planes)))
+    workers = backend.workers
+    pool = backend.pool() if backend.parallel else None
+    try:
+        tifffile.imwrite(
+            output_path,
+            _iter_encoded(stack, planes, channel, threshold, tile_size, pool, workers, progress),
+            shape=stack.shape[:2] + stack.shape[3:], dtype=np.uint8, tile=(tile_size, tile_size),
+            compression='zlib', photometric='minisblack', metadata={"axes": "TZYX"}
+        )
+    finally:
+        if pool is not None:
+            pool.shutdown(cancel_futures=True)
+    return stack.shape[:2] + stack.shape[3:]
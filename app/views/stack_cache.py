@@ -0,0 +1,180 @@
+# stack_cache.py - Per-process cache of open TIFF stacks and decoded pages
+import logging
+import os
+import threading
+from collections import OrderedDict
+from config import Config
+from .chunk_store import open_stack
+from .metrics import CACHE_LOOKUPS, metrics
+
+logger = logging.getLogger(__name__)
+
+
+def file_signature(file_path):
+    """(inode, size, mtime) of a file; changes whenever it is replaced or rewritten."""
+    stat = os.stat(file_path)
+    return stat.st_ino, stat.st_size, stat.st_mtime_ns
+
+
+class PageCache:
+    """Least recently used decoded pages, bounded by their total size in bytes."""
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._pages = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            page = self._pages.get(key)
+            if page is None:
+                self.misses += 1
+                return None
+            self._pages.move_to_end(key)
+            self.hits += 1
+            return page
+
+    def put(self, key, page):
+        if page.nbytes > self.max_bytes:
+            return
+        with self._lock:
+            previous = self._pages.pop(key, None)
+            if previous is not None:
+                self.nbytes -= previous.nbytes
+            self._pages[key] = page
+            self.nbytes += page.nbytes
+            while self.nbytes > self.max_bytes:
+                _, evicted = self._pages.popitem(last=False)
+                self.nbytes -= evicted.nbytes
+
+    def discard(self, stack_key):
+        """Drop every page cached for one ``TiffStack.cache_key``."""
+        with self._lock:
+            for key in [key for key in self._pages if key[0] == stack_key]:
+                self.nbytes -= self._pages.pop(key).nbytes
+
+    def clear(self):
+        with self._lock:
+            self._pages.clear()
+            self.nbytes = 0
+
+
+class _Entry:
+    def __init__(self, stack, signature):
+        self.stack = stack
+        self.signature = signature
+        self.users = 0
+        self.retired = False
+
+
+class StackCache:
+    """
+    Open ``TiffStack`` handles shared by every request and task of a process.
+
+    ``acquire`` returns the cached stack for a path, so repeated access skips
+    opening the file and parsing its header and page index, and attaches a
+    shared ``PageCache`` so popular planes skip decoding too. A stack is
+    reopened, and its pages dropped, when the file's inode, size or mtime
+    change; a deleted file raises FileNotFoundError and leaves the cache.
+    At most ``max_handles`` stacks stay open; a stack evicted or invalidated
+    while in use is closed once its last user calls ``release``.
+    """
+
+    def __init__(self, max_handles, page_bytes):
+        self.max_handles = max_handles
+        self.pages = PageCache(page_bytes)
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._in_use = {}
+        self._lock = threading.Lock()
+        self._pid = os.getpid()
+
+    def _check_fork(self):
+        # A forked worker must not share file offsets with its parent's handles.
+        if self._pid != os.getpid():
+            self._entries = OrderedDict()
+            self._in_use = {}
+            self.pages.clear()
+            self._pid = os.getpid()
+
+    def _retire(self, entry, stale=True):
+        # Pages of a handle evicted only for space stay valid: the key includes the file signature.
+        entry.retired = True
+        if stale:
+            self.pages.discard(entry.stack.cache_key)
+        if entry.users == 0:
+            entry.stack.close()
+
+    def acquire(self, file_path, page_index=None):
+        """Return an open TiffStack (or ChunkStore) for ``file_path``; pair every call with ``release``."""
+        key = os.path.abspath(file_path)
+        with self._lock:
+            self._check_fork()
+            entry = self._entries.get(key)
+            try:
+                signature = file_signature(key)
+            except FileNotFoundError:
+                if entry is not None:
+                    self._retire(self._entries.pop(key))
+                raise
+            if entry is not None and entry.signature != signature:
+                logger.info(f"Reopening changed file {file_path}")
+                self._retire(self._entries.pop(key))
+                entry = None
+            if entry is None:
+                self.misses += 1
+                entry = _Entry(open_stack(file_path, page_index), signature)
+                entry.stack.cache_key = (key,) + signature
+                entry.stack.page_cache = self.pages
+                self._entries[key] = entry
+                while len(self._entries) > self.max_handles:
+                    self._retire(self._entries.popitem(last=False)[1], stale=False)
+            else:
+                self.hits += 1
+                self._entries.move_to_end(key)
+            entry.users += 1
+            self._in_use[id(entry.stack)] = entry
+            return entry.stack
+
+    def release(self, stack):
+        with self._lock:
+            entry = self._in_use.get(id(stack))
+            if entry is None:
+                return
+            entry.users -= 1
+            if entry.users == 0:
+                del self._in_use[id(stack)]
+                if entry.retired:
+                    entry.stack.close()
+
+    def invalidate(self, file_path):
+        """Forget a file that was deleted or replaced in place."""
+        with self._lock:
+            entry = self._entries.pop(os.path.abspath(file_path), None)
+            if entry is not None:
+                self._retire(entry)
+
+    def stats(self):
+        return {
+            "handle_hits": self.hits,
+            "handle_misses": self.misses,
+            "open_handles": len(self._entries),
+            "page_hits": self.pages.hits,
+            "page_misses": self.pages.misses,
+            "page_bytes": self.pages.nbytes
+        }
+
+
+stack_cache = StackCache(Config.STACK_CACHE_MAX_HANDLES, Config.PAGE_CACHE_MAX_BYTES)
+
+
+@metrics.collect
+def collect_stack_cache():
+    stats = stack_cache.stats()
+    for cache in ('handle', 'page'):
+        CACHE_LOOKUPS.set(stats[f"{cache}_hits"], f"stack_{cache}", 'hit')
+        CACHE_LOOKUPS.set(stats[f"{cache}_misses"], f"stack_{cache}", 'miss')
@@ -0,0 +1,348 @@
+# stream_pca.py - Out-of-core PCA over the channel axis of a (T, Z, C, Y, X) stack
+import numpy as np
+import tifffile
+from .dtypes import rescale, sum_dtype, working_dtype
+from .parallel import ComputeBackend, split_planes
+from .stream_stats import DEFAULT_CHUNK_BYTES
+from .chunk_store import open_stack
+
+# Rows of a pixel chunk centred in float64 at a time while accumulating the co-moment
+COMOMENT_BLOCK_ROWS = 1 << 16
+# Seed of the pixel subsample a sampled fit takes from each chunk
+SAMPLE_SEED = 0
+
+
+def sample_fraction(shape, fraction=None, count=None):
+    """
+    Share of the pixels of a (T, Z, C, Y, X) ``shape`` to fit PCA on, given
+    as a ``fraction`` in (0, 1] or a pixel ``count``; 1.0 when neither is.
+    """
+    if fraction is not None and count is not None:
+        raise ValueError("Give either a sample fraction or a sample count, not both")
+    try:
+        fraction = None if fraction is None else float(fraction)
+        count = None if count is None else int(count)
+    except (TypeError, ValueError):
+        raise ValueError(f"Invalid sample {fraction if count is None else count!r}, expected a number")
+    if fraction is not None:
+        if not 0 < fraction <= 1:
+            raise ValueError(f"Sample fraction {fraction} must be in (0, 1]")
+        return float(fraction)
+    if count is not None:
+        if count < 1:
+            raise ValueError(f"Sample count {count} must be at least 1")
+        pixels = shape[0] * shape[1] * shape[3] * shape[4]
+        return min(1.0, count / pixels)
+    return 1.0
+
+
+def sample_planes(shape, sample=1.0):
+    """
+    The (T, Z) planes to read for a fit on ``sample`` of the pixels, and the
+    share of each plane's pixels to keep. As few planes as possible are
+    decoded, spread evenly over T and Z; only the remainder is thinned,
+    image row by image row.
+    """
+    planes = [(t, z) for t in range(shape[0]) for z in range(shape[1])]
+    if sample >= 1:
+        return planes, 1.0
+    count = max(1, int(np.ceil(sample * len(planes))))
+    chosen = np.unique(np.round(np.linspace(0, len(planes) - 1, count)).astype(int))
+    return [planes[i] for i in chosen], min(1.0, sample * len(planes) / len(chosen))
+
+
+def _thin(pixels, share, t, z, tile):
+    # Seeded by position, so a sampled fit is reproducible however planes are split between workers.
+    if share >= 1:
+        return pixels
+    # Whole image rows are kept or dropped: drawing and gathering per pixel costs more than fitting the
+    # pixels, and the copy keeps the tile channel-major, the layout partial_fit is fastest on.
+    rows = tile.stop - tile.start
+    keep = np.random.default_rng((SAMPLE_SEED, t, z, tile.start)).random(rows) < share
+    return pixels.T.reshape(pixels.shape[1], rows, -1)[:, keep].reshape(pixels.shape[1], -1).T
+
+
+def iter_pixel_chunks(stack, chunk_bytes=DEFAULT_CHUNK_BYTES, planes=None):
+    """
+    Yield (time, z, rows, pixels) for row tiles of every (T, Z) plane, or of
+    the (t, z) pairs in ``planes``.
+
+    ``pixels`` is a (rows * X, C) matrix in the stack's own dtype, holding
+    every channel of the tile, i.e. the samples PCA sees; each tile stays
+    within ``chunk_bytes`` per channel once converted to the working dtype.
+    """
+    height, width = stack.shape[3:]
+    rows = max(1, chunk_bytes // max(1, width * working_dtype(stack.dtype).itemsize))
+    if planes is None:
+        planes = [(t, z) for t in range(stack.shape[0]) for z in range(stack.shape[1])]
+    pages = {}
+    for t, z in planes:
+        channels = [stack.plane(t, z, c, pages, cache=False) for c in range(stack.shape[2])]
+        for y in range(0, height, rows):
+            tile = slice(y, min(y + rows, height))
+            pixels = np.stack([plane[tile] for plane in channels]).reshape(len(channels), -1).T
+            yield t, z, tile, pixels
+
+
+class StreamingPCA:
+    """
+    PCA fitted from a chunked accumulation of the C x C channel covariance.
+
+    Channels are few and pixels are many, so the fit only keeps the running
+    mean and co-moment matrix (merged with Chan's update) and never holds more
+    than one chunk of pixels. Attribute names follow sklearn's PCA; the
+    per-channel ``data_min_`` and ``data_max_`` bound the projection when it
+    is rescaled to an integer type.
+
+    Chunks are taken in their own dtype: channel sums are exact integer
+    sums, and only blocks of ``COMOMENT_BLOCK_ROWS`` rows are centred in
+    float64, since float32 products lose precision summed over millions of
+    pixels.
+    """
+
+    def __init__(self, n_components=3):
+        self.n_components = n_components
+        self.n_samples_seen_ = 0
+        self.mean_ = None
+        self.data_min_ = None
+        self.data_max_ = None
+        self._comoment = None
+
+    def partial_fit(self, pixels):
+        pixels = np.asarray(pixels)
+        n = pixels.shape[0]
+        if n == 0:
+            return self
+        mean = pixels.sum(axis=0, dtype=sum_dtype(pixels.dtype)) / n
+        comoment = np.zeros((pixels.shape[1],) * 2)
+        for start in range(0, n, COMOMENT_BLOCK_ROWS):
+            centered = pixels[start:start + COMOMENT_BLOCK_ROWS] - mean
+            comoment += centered.T @ centered
+        self._update_range(pixels.min(axis=0), pixels.max(axis=0))
+        if self.mean_ is None:
+            self.mean_, self._comoment, self.n_samples_seen_ = mean, comoment, n
+            return self
+        count = self.n_samples_seen_
+        total = count + n
+        delta = mean - self.mean_
+        self.mean_ = self.mean_ + delta * n / total
+        self._comoment = self._comoment + comoment + np.outer(delta, delta) * count * n / total
+        self.n_samples_seen_ = total
+        return self
+
+    def _update_range(self, low, high):
+        if low is None:
+            return
+        low, high = np.asarray(low, dtype=np.float64), np.asarray(high, dtype=np.float64)
+        if self.data_min_ is None:
+            self.data_min_, self.data_max_ = low, high
+        else:
+            self.data_min_, self.data_max_ = np.minimum(self.data_min_, low), np.maximum(self.data_max_, high)
+
+    def merge(self, other):
+        """Fold in the accumulation of another StreamingPCA fitted on different pixels."""
+        if other.mean_ is None:
+            return self
+        self._update_range(other.data_min_, other.data_max_)
+        if self.mean_ is None:
+            self.mean_, self._comoment, self.n_samples_seen_ = other.mean_, other._comoment, other.n_samples_seen_
+            return self
+        count, n = self.n_samples_seen_, other.n_samples_seen_
+        total = count + n
+        delta = other.mean_ - self.mean_
+        self.mean_ = self.mean_ + delta * n / total
+        self._comoment = self._comoment + other._comoment + np.outer(delta, delta) * count * n / total
+        self.n_samples_seen_ = total
+        return self
+
+    def finalize(self):
+        n_features = self._comoment.shape[0]
+        if not 0 < self.n_components <= min(self.n_samples_seen_, n_features):
+            raise ValueError(f"n_components={self.n_components} must be between 1 and "
+                             f"min(n_samples, n_features)={min(self.n_samples_seen_, n_features)}")
+        covariance = self._comoment / max(1, self.n_samples_seen_ - 1)
+        variances, vectors = np.linalg.eigh(covariance)
+        order = np.argsort(variances)[::-1][:self.n_components]
+        components = vectors[:, order].T
+        # Deterministic signs: the largest loading of each component is positive.
+        signs = np.sign(components[np.arange(len(components)), np.argmax(np.abs(components), axis=1)])
+        self.components_ = components * signs[:, None]
+        self.explained_variance_ = np.clip(variances[order], 0, None)
+        total_variance = np.clip(variances, 0, None).sum()
+        self.explained_variance_ratio_ = self.explained_variance_ / total_variance if total_variance else \
+            np.zeros_like(self.explained_variance_)
+        return self
+
+    def accumulate_stack(self, stack, chunk_bytes=DEFAULT_CHUNK_BYTES, progress=None, workers=1, executor='thread',
+                         sample=1.0):
+        """
+        Accumulate the pixels of ``stack`` without finalizing: all of them,
+        or a reproducible ``sample`` fraction (see ``sample_planes``). With
+        several ``workers`` the (T, Z) planes are accumulated in groups on a
+        thread or process pool and the partial accumulations merged.
+        """
+        planes, share = sample_planes(stack.shape, sample)
+        backend = ComputeBackend(executor, workers)
+        if not backend.parallel:
+            done = 0
+            with backend.limits():
+                for t, z, tile, pixels in iter_pixel_chunks(stack, chunk_bytes, planes):
+                    self.partial_fit(_thin(pixels, share, t, z, tile))
+                    if tile.stop == stack.shape[3]:
+                        done += 1
+                        if progress is not None:
+                            progress(done, len(planes))
+            return self
+
+        groups = split_planes(stack.shape, 4 * backend.workers, planes)
+        for part in backend.run(_fit_planes, [
+            (stack.file_path, stack.page_index, group, self.n_components, chunk_bytes, share) for group in groups
+        ], sizes=[len(group) for group in groups], progress=progress):
+            self.merge(part)
+        return self
+
+    def fit_stack(self, stack, chunk_bytes=DEFAULT_CHUNK_BYTES, progress=None, workers=1, executor='thread',
+                  sample=1.0):
+        """Fit on the pixels of ``stack``, or a ``sample`` fraction of them; see ``accumulate_stack``."""
+        return self.accumulate_stack(stack, chunk_bytes, progress, workers, executor, sample).finalize()
+
+    def _range(self):
+        if self.data_min_ is None:
+            return {}
+        return {"data_min": self.data_min_.tolist(), "data_max": self.data_max_.tolist()}
+
+    def accumulator(self):
+        """Running count, mean, co-moment and channel ranges as plain lists, to merge fits made in other tasks."""
+        return dict({"n_samples": int(self.n_samples_seen_), "mean": self.mean_.tolist(),
+                     "comoment": self._comoment.tolist()}, **self._range())
+
+    @classmethod
+    def from_accumulator(cls, n_components, accumulator):
+        pca = cls(n_components)
+        pca.n_samples_seen_ = accumulator["n_samples"]
+        pca.mean_ = np.asarray(accumulator["mean"], dtype=np.float64)
+        pca._comoment = np.asarray(accumulator["comoment"], dtype=np.float64)
+        pca._update_range(accumulator.get("data_min"), accumulator.get("data_max"))
+        return pca
+
+    def basis(self):
+        """The fitted mean, components, explained variance and channel ranges as plain lists."""
+        return dict({
+            "n_components": self.n_components,
+            "mean": self.mean_.tolist(),
+            "components": self.components_.tolist(),
+            "explained_variance": self.explained_variance_.tolist(),
+            "explained_variance_ratio": self.explained_variance_ratio_.tolist()
+        }, **self._range())
+
+    @classmethod
+    def from_basis(cls, basis):
+        pca = cls(basis["n_components"])
+        pca.mean_ = np.asarray(basis["mean"], dtype=np.float64)
+        pca.components_ = np.asarray(basis["components"], dtype=np.float64)
+        pca.explained_variance_ = np.asarray(basis["explained_variance"], dtype=np.float64)
+        pca.explained_variance_ratio_ = np.asarray(basis["explained_variance_ratio"], dtype=np.float64)
+        pca._update_range(basis.get("data_min"), basis.get("data_max"))
+        return pca
+
+    def projection_range(self):
+        """
+        Per-component (low, high) bounds of the projection of any pixel within
+        the channel ranges seen while fitting; an integer output maps them
+        onto its full range.
+        """
+        if self.data_min_ is None:
+            raise ValueError("PCA was fitted without channel ranges; it can only be written as floats")
+        ends = np.stack([(self.data_min_ - self.mean_) * self.components_,
+                         (self.data_max_ - self.mean_) * self.components_])
+        return ends.min(axis=0).sum(axis=1), ends.max(axis=0).sum(axis=1)
+
+    def transform(self, pixels, dtype=np.float64):
+        """
+        Project ``pixels``, computing in ``dtype``. The (channels, pixels)
+        matrix is converted and centred in one pass, then projected with a
+        single matrix product; for the chunks of ``iter_pixel_chunks`` both
+        operands and the (components, pixels) product are contiguous, and
+        the result is returned as its transposed view.
+        """
+        channels = np.asarray(pixels).T
+        centered = np.subtract(channels, self.mean_.astype(dtype)[:, None], dtype=dtype)
+        return (self.components_.astype(dtype) @ centered).T
+
+    def project(self, pixels, dtype):
+        """
+        Project ``pixels`` into an array of ``dtype``. Float outputs below
+        float64 are computed in the pixels' working dtype; integer outputs
+        are rescaled from ``projection_range`` onto the type's full range.
+        """
+        dtype = np.dtype(dtype)
+        compute = np.float64 if dtype == np.float64 else working_dtype(np.asarray(pixels).dtype)
+        reduced = self.transform(pixels, compute)
+        if dtype.kind == 'f':
+            return reduced.astype(dtype, copy=False)
+        return rescale(reduced, dtype, *self.projection_range())
+
+    def transform_stack(self, stack, out, chunk_bytes=DEFAULT_CHUNK_BYTES, progress=None):
+        """Project every pixel of ``stack`` into ``out``, shaped (T, Z, n_components, Y, X), in ``out``'s dtype."""
+        width = stack.shape[4]
+        for t, z, tile, pixels in iter_pixel_chunks(stack, chunk_bytes):
+            reduced = self.project(pixels, out.dtype)
+            out[t, z, :, tile] = reduced.T.reshape(self.n_components, -1, width)
+            _report_plane(stack, t, z, tile, progress)
+        return out
+
+
+def _fit_planes(file_path, page_index, planes, n_components, chunk_bytes, share=1.0):
+    # Runs in a worker: accumulate a group of planes through a private handle.
+    pca = StreamingPCA(n_components)
+    with open_stack(file_path, page_index) as stack:
+        for t, z, tile, pixels in iter_pixel_chunks(stack, chunk_bytes, planes):
+            pca.partial_fit(_thin(pixels, share, t, z, tile))
+    return pca
+
+
+def _transform_planes(file_path, page_index, planes, pca, output_path, chunk_bytes):
+    # Runs in a worker: project a group of planes into the shared output file.
+    out = tifffile.memmap(output_path, mode='r+')
+    try:
+        with open_stack(file_path, page_index) as stack:
+            width = stack.shape[4]
+            for t, z, tile, pixels in iter_pixel_chunks(stack, chunk_bytes, planes):
+                out[t, z, :, tile] = pca.project(pixels, out.dtype).T.reshape(pca.n_components, -1, width)
+        out.flush()
+    finally:
+        del out
+
+
+def _report_plane(stack, t, z, tile, progress):
+    # Report once per (T, Z) plane, after its last row tile.
+    if progress is not None and tile.stop == stack.shape[3]:
+        progress(t * stack.shape[1] + z + 1, stack.shape[0] * stack.shape[1])
+
+
+def write_pca_stack(stack, pca, output_path, dtype=np.float32, chunk_bytes=DEFAULT_CHUNK_BYTES, progress=None,
+                    workers=1, executor='thread'):
+    """
+    Stream the PCA projection of ``stack`` into a new TIFF of ``dtype``,
+    tile by tile; see ``StreamingPCA.project``.
+
+    With several ``workers``, groups of (T, Z) planes are projected on a
+    thread or process pool, each writing its planes through its own memory
+    map of the output.
+    """
+    shape = stack.shape[:2] + (pca.n_components,) + stack.shape[3:]
+    out = tifffile.memmap(output_path, shape=shape, dtype=dtype, photometric='minisblack')
+    backend = ComputeBackend(executor, workers)
+    try:
+        if not backend.parallel:
+            with backend.limits():
+                pca.transform_stack(stack, out, chunk_bytes, progress)
+        out.flush()
+    finally:
+        del out
+    if backend.parallel:
+        groups = split_planes(stack.shape, 4 * backend.workers)
+        backend.run(_transform_planes, [
+            (stack.file_path, stack.page_index, group, pca, output_path, chunk_bytes) for group in groups
+        ], sizes=[len(group) for group in groups], progress=progress)
+    return shape
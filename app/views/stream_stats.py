@@ -0,0 +1,226 @@
+# stream_stats.py - Single-pass, chunked per-channel statistics
+import numpy as np
+from skimage.filters import threshold_otsu
+from .dtypes import sum_dtype, working_dtype
+from .parallel import ComputeBackend, split_planes
+from .chunk_store import open_stack
+
+DEFAULT_CHUNK_BYTES = 16 * 1024 * 1024
+
+
+class RunningStats:
+    """
+    Mergeable per-channel count, mean, M2, min and max, plus an optional histogram.
+
+    Chunks are folded in with Welford/Chan updates, so partial results built
+    over disjoint parts of a stack (in threads or other processes) can be
+    merged without loss of precision. Integer data of up to 16 bits gets an
+    exact per-value histogram; anything else uses ``bins`` equal bins over
+    ``value_range``.
+
+    Chunk sums are exact in the integer domain and squared deviations are
+    taken in the float32 working type where it holds the data exactly, so a
+    chunk is never copied to float64; ``itemsize`` is the size per value of
+    the largest temporary an update makes.
+    """
+
+    def __init__(self, n_channels, dtype, histogram=False, bins=256, value_range=None):
+        self.dtype = np.dtype(dtype)
+        self.count = np.zeros(n_channels, dtype=np.int64)
+        self.mean = np.zeros(n_channels)
+        self.m2 = np.zeros(n_channels)
+        self.min = np.full(n_channels, np.inf)
+        self.max = np.full(n_channels, -np.inf)
+        self.hist = None
+        self.exact = self.dtype.kind in 'ui' and self.dtype.itemsize <= 2
+        self.sum_dtype = sum_dtype(self.dtype)
+        self.work_dtype = working_dtype(self.dtype)
+        self.itemsize = self.work_dtype.itemsize
+        if histogram:
+            if self.exact:
+                self.offset = int(np.iinfo(self.dtype).min)
+                bins = 1 << (8 * self.dtype.itemsize)
+                value_range = (self.offset - 0.5, self.offset + bins - 0.5)
+            elif value_range is None:
+                raise ValueError(f"value_range is required for a histogram of {self.dtype} data")
+            self.edges = np.linspace(value_range[0], value_range[1], bins + 1)
+            self.hist = np.zeros((n_channels, bins), dtype=np.int64)
+            if self.exact:
+                # np.bincount converts its input to intp.
+                self.itemsize = np.dtype(np.intp).itemsize
+
+    @classmethod
+    def from_sums(cls, dtype, count, total, total_sq, minimum, maximum, hist=None, edges=None):
+        """
+        RunningStats of per-channel counts, sums, sums of squares, minima and
+        maxima (e.g. merged from a PlaneIndex), with histogram counts over
+        ``edges`` when ``hist`` is given.
+        """
+        stats = cls(len(count), dtype)
+        stats.count = np.asarray(count, dtype=np.int64)
+        total = np.asarray(total, dtype=np.float64)
+        stats.mean = total / np.maximum(stats.count, 1)
+        stats.m2 = np.maximum(np.asarray(total_sq, dtype=np.float64) - stats.mean * total, 0.0)
+        stats.min = np.asarray(minimum, dtype=np.float64)
+        stats.max = np.asarray(maximum, dtype=np.float64)
+        if hist is not None:
+            stats.hist = np.asarray(hist, dtype=np.int64)
+            stats.edges = np.asarray(edges, dtype=np.float64)
+        return stats
+
+    def _combine(self, channel, n, mean, m2):
+        count = self.count[channel]
+        total = count + n
+        delta = mean - self.mean[channel]
+        self.mean[channel] += delta * n / total
+        self.m2[channel] += m2 + delta * delta * count * n / total
+        self.count[channel] = total
+
+    def update(self, channel, chunk):
+        n = chunk.size
+        if n == 0:
+            return
+        mean = float(np.sum(chunk, dtype=self.sum_dtype)) / n
+        # Deviations from the mean rounded to the working type, corrected by
+        # sum((x - s)**2) = m2 + n * (s - mean)**2 and summed in float64.
+        deviations = chunk.astype(self.work_dtype)
+        shift = self.work_dtype.type(mean)
+        deviations -= shift
+        np.square(deviations, out=deviations)
+        m2 = float(np.sum(deviations, dtype=np.float64)) - n * (float(shift) - mean) ** 2
+        self._combine(channel, n, mean, max(m2, 0.0))
+        self.min[channel] = min(self.min[channel], chunk.min())
+        self.max[channel] = max(self.max[channel], chunk.max())
+        if self.hist is not None:
+            if self.exact:
+                values = chunk.ravel()
+                if self.offset:
+                    # Flipping the sign bit maps signed values onto 0 .. 2**bits - 1 at the same width.
+                    values = values.view(f'u{values.itemsize}') ^ (1 << (8 * values.itemsize - 1))
+                self.hist[channel] += np.bincount(values, minlength=self.hist.shape[1])
+            else:
+                self.hist[channel] += np.histogram(chunk, bins=self.edges)[0]
+
+    def merge(self, other):
+        for channel in np.flatnonzero(other.count):
+            self._combine(channel, other.count[channel], other.mean[channel], other.m2[channel])
+        self.min = np.minimum(self.min, other.min)
+        self.max = np.maximum(self.max, other.max)
+        if self.hist is not None:
+            self.hist += other.hist
+        return self
+
+    @property
+    def centers(self):
+        return (self.edges[:-1] + self.edges[1:]) / 2
+
+    def percentile(self, channel, q):
+        """Nearest-rank percentile ``q`` (0-100) of a channel, at histogram resolution."""
+        cumulative = np.cumsum(self.hist[channel])
+        rank = np.clip(np.asarray(q) / 100 * self.count[channel], 1, self.count[channel])
+        return self.centers[np.searchsorted(cumulative, rank)]
+
+    def otsu_threshold(self, channel):
+        counts = self.hist[channel]
+        nonzero = np.flatnonzero(counts)
+        if len(nonzero) < 2:
+            return float(self.min[channel])
+        window = slice(nonzero[0], nonzero[-1] + 1)
+        return float(threshold_otsu(hist=(counts[window], self.centers[window])))
+
+    def kmeans_threshold(self, channel, max_iter=100):
+        """
+        Boundary between the two clusters of 1-D 2-means, run on the histogram.
+
+        Lloyd's iterations on bin counts give the same split as k-means on
+        every value (exactly so for per-value histograms); values above the
+        threshold belong to the brighter cluster.
+        """
+        counts, centers = self.hist[channel], self.centers
+        nonzero = np.flatnonzero(counts)
+        if len(nonzero) < 2:
+            return float(self.min[channel])
+        threshold = (centers[nonzero[0]] + centers[nonzero[-1]]) / 2
+        for _ in range(max_iter):
+            low = centers <= threshold
+            means = [np.average(centers[side], weights=counts[side]) for side in (low, ~low)]
+            updated = (means[0] + means[1]) / 2
+            if np.searchsorted(centers, updated, side='right') == np.searchsorted(centers, threshold, side='right'):
+                break
+            threshold = updated
+        return float(threshold)
+
+    def to_list(self, channels=None, percentiles=None):
+        channels = range(len(self.count)) if channels is None else channels
+        stats = []
+        for ch in channels:
+            stat = {
+                "channel": ch,
+                "mean": float(self.mean[ch]),
+                "std": float(np.sqrt(self.m2[ch] / self.count[ch])),
+                "min": float(self.min[ch]),
+                "max": float(self.max[ch])
+            }
+            if self.hist is not None:
+                stat["otsu_threshold"] = self.otsu_threshold(ch)
+                if percentiles:
+                    values = self.percentile(ch, percentiles)
+                    stat["percentiles"] = {str(q): float(v) for q, v in zip(percentiles, values)}
+            stats.append(stat)
+        return stats
+
+
+def iter_chunks(plane, chunk_bytes=DEFAULT_CHUNK_BYTES, itemsize=None):
+    """
+    Split a (Y, X) plane into row tiles of at most ``chunk_bytes``, counted
+    at ``itemsize`` bytes per value (by default the plane's own).
+    """
+    rows = max(1, chunk_bytes // max(1, plane.shape[1] * (itemsize or plane.itemsize)))
+    for y in range(0, plane.shape[0], rows):
+        yield plane[y:y + rows]
+
+
+def _reduce(stack, planes, channels, stats, chunk_bytes, progress=None):
+    pages = {}
+    for i, (t, z) in enumerate(planes):
+        for c in channels:
+            for chunk in iter_chunks(stack.plane(t, z, c, pages, cache=False), chunk_bytes, stats.itemsize):
+                stats.update(c, chunk)
+        if progress is not None:
+            progress(i + 1, len(planes))
+    return stats
+
+
+def _reduce_file(file_path, page_index, planes, channels, stats, chunk_bytes):
+    # Each worker opens its own handle; TiffFile reads are not thread-safe.
+    with open_stack(file_path, page_index) as stack:
+        return _reduce(stack, planes, channels, stats, chunk_bytes)
+
+
+def channel_statistics(stack, channels=None, histogram=False, bins=256, value_range=None,
+                       chunk_bytes=DEFAULT_CHUNK_BYTES, workers=1, executor='thread', progress=None):
+    """
+    Compute RunningStats for the given channels of a TiffStack in one pass.
+
+    The (T, Z) planes are split into ``workers`` contiguous groups reduced in
+    parallel (``executor`` is 'thread' or 'process') and merged at the end;
+    each worker only ever holds one page plus one chunk, whose temporaries
+    stay within ``chunk_bytes``. ``progress`` is
+    called as ``progress(planes_done, planes_total)``.
+    """
+    channels = list(range(stack.shape[2])) if channels is None else list(channels)
+    stats = RunningStats(stack.shape[2], stack.dtype, histogram, bins, value_range)
+    planes = [(t, z) for t in range(stack.shape[0]) for z in range(stack.shape[1])]
+    workers = max(1, min(workers, len(planes)))
+    if workers == 1:
+        return _reduce(stack, planes, channels, stats, chunk_bytes, progress)
+
+    groups = split_planes(stack.shape, workers)
+    parts = ComputeBackend(executor, workers).run(_reduce_file, [
+        (stack.file_path, stack.page_index, group, channels,
+         RunningStats(stack.shape[2], stack.dtype, histogram, bins, value_range), chunk_bytes)
+        for group in groups
+    ], sizes=[len(group) for group in groups], progress=progress)
+    for part in parts:
+        stats.merge(part)
+    return stats
@@ -0,0 +1,92 @@
+# sub_stack.py - T/Z ranges and Y/X regions of interest of a (T, Z, C, Y, X) stack, read as a stack
+import numpy as np
+
+REGION_AXES = ('time', 'z', 'y', 'x')
+
+
+def region_bounds(shape, region):
+    """
+    Normalize ``region``, four slices with positive steps over the T, Z, Y
+    and X axes of ``shape``, to JSON-serializable [start, stop, step]
+    triples; None when it selects the whole stack.
+    """
+    sizes = shape[:2] + shape[3:]
+    bounds = [list(selected.indices(size)) for selected, size in zip(region, sizes)]
+    if all(bound == [0, size, 1] for bound, size in zip(bounds, sizes)):
+        return None
+    return bounds
+
+
+class SubStack:
+    """
+    Read-only (T, Z, C, Y, X) view of T and Z ranges and a Y/X region of
+    another stack, with every channel.
+
+    ``region`` is four [start, stop, step] triples (see ``region_bounds``)
+    for the T, Z, Y and X axes. Planes are cropped as they are read; stores
+    with ``read_region`` (chunk stores) decode only the chunks under the
+    region. ``page_index`` describes the source and the region together, so
+    ``open_stack`` reopens the same view in worker processes.
+    """
+
+    def __init__(self, stack, region, owned=False):
+        self.source = stack
+        self.region = [list(bound) for bound in region]
+        self._owned = owned
+        times, zs, ys, xs = (range(*bound) for bound in self.region)
+        self._times, self._zs = times, zs
+        self._crop = (slice(*self.region[2]), slice(*self.region[3]))
+        self.shape = (len(times), len(zs), stack.shape[2], len(ys), len(xs))
+        self.ndim = len(self.shape)
+        self.dtype = stack.dtype
+        self.file_path = stack.file_path
+        self.page_index = {"source": stack.page_index, "region": self.region}
+        if not all(self.shape):
+            raise IndexError(f"Region {self.region} is empty for a stack of shape {stack.shape}")
+
+    @property
+    def is_memmapped(self):
+        return self.source.is_memmapped
+
+    def plane(self, time, z, channel, _pages=None, cache=True):
+        """Return the region of one (Y, X) plane."""
+        time, z = self._times[time], self._zs[z]
+        read_region = getattr(self.source, 'read_region', None)
+        if read_region is not None:
+            return read_region((time, z, channel) + self._crop, _pages, cache)
+        return self.source.plane(time, z, channel, _pages, cache)[self._crop]
+
+    def read(self, time=None, z=None, channel=None):
+        """Sub-stack selected by fixing any of time, z and channel; see TiffStack.read."""
+        selected = [range(n) if value is None else [value] for n, value in zip(self.shape[:3], (time, z, channel))]
+        out = np.empty(tuple(len(s) for s in selected) + self.shape[3:], dtype=self.dtype)
+        pages = {}
+        for i, t in enumerate(selected[0]):
+            for j, zz in enumerate(selected[1]):
+                for k, c in enumerate(selected[2]):
+                    out[i, j, k] = self.plane(t, zz, c, pages)
+        fixed = tuple(axis for axis, value in enumerate((time, z, channel)) if value is not None)
+        return out.squeeze(axis=fixed) if fixed else out
+
+    def asarray(self):
+        return self.read()
+
+    def iter_planes(self, channel=None, cache=False):
+        """Yield (time, z, channel, plane) for every plane of the region."""
+        channels = range(self.shape[2]) if channel is None else [channel]
+        pages = {}
+        for t in range(self.shape[0]):
+            for z in range(self.shape[1]):
+                for c in channels:
+                    yield t, z, c, self.plane(t, z, c, pages, cache)
+
+    def close(self):
+        # A view over a caller's stack leaves it open; one reopened by open_stack owns its source.
+        if self._owned:
+            self.source.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
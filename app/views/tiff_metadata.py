@@ -0,0 +1,175 @@
+# tiff_metadata.py - Compact, structured TIFF/OME/ImageJ metadata extracted once at upload
+import enum
+import xml.etree.ElementTree as ElementTree
+import numpy as np
+import tifffile
+from app.models import db_session
+from app.models.image_process import ImageMetadata
+from .tiff_stack import AXES, TiffStack
+
+# Tags describing where the pixel data lives rather than what it is.
+LAYOUT_TAGS = {
+    'StripOffsets', 'StripByteCounts', 'TileOffsets', 'TileByteCounts',
+    'FreeOffsets', 'FreeByteCounts', 'SubIFDs', 'JPEGTables'
+}
+MAX_TAG_ITEMS = 256
+RESOLUTION_UNITS = {2: 'inch', 3: 'cm'}
+SUMMARY_FIELDS = (
+    'axes', 'shape', 'dtype', 'series_axes', 'series_shape', 'page_count',
+    'physical_size', 'channel_names', 'format', 'imagej_metadata'
+)
+
+
+def _json_value(value):
+    """Turn a tag or metadata value into something JSON can store, summarizing long arrays."""
+    if isinstance(value, enum.Enum):
+        return value.name
+    if isinstance(value, bytes):
+        try:
+            return value.decode('ascii')
+        except UnicodeDecodeError:
+            return {"bytes": len(value)}
+    if isinstance(value, np.ndarray):
+        if value.size > MAX_TAG_ITEMS:
+            return {"count": int(value.size), "dtype": str(value.dtype)}
+        return value.tolist()
+    if isinstance(value, (list, tuple)):
+        if len(value) > MAX_TAG_ITEMS:
+            return {"count": len(value)}
+        return [_json_value(v) for v in value]
+    if isinstance(value, dict):
+        return {str(k): _json_value(v) for k, v in value.items()}
+    if isinstance(value, np.generic):
+        return value.item()
+    if value is None or isinstance(value, (str, int, float, bool)):
+        return value
+    return str(value)
+
+
+def _page_tags(page, skip_description):
+    tags = {}
+    for tag in page.tags.values():
+        if tag.name in LAYOUT_TAGS or (skip_description and tag.name == 'ImageDescription'):
+            continue
+        tags[tag.name] = _json_value(tag.value)
+    return tags
+
+
+def _ome_physical_metadata(ome_xml):
+    root = ElementTree.fromstring(ome_xml)
+    pixels = next((e for e in root.iter() if e.tag.endswith('}Pixels') or e.tag == 'Pixels'), None)
+    if pixels is None:
+        return {}, None
+    sizes = {}
+    for axis in 'XYZ':
+        value = pixels.get(f'PhysicalSize{axis}')
+        if value is not None:
+            sizes[axis.lower()] = {"value": float(value), "unit": pixels.get(f'PhysicalSize{axis}Unit', 'µm')}
+    if pixels.get('TimeIncrement') is not None:
+        sizes["t"] = {"value": float(pixels.get('TimeIncrement')), "unit": pixels.get('TimeIncrementUnit', 's')}
+    channels = [e.get('Name') for e in pixels if e.tag.endswith('Channel')]
+    return sizes, channels if any(channels) else None
+
+
+def _resolution_sizes(page, unit=None):
+    sizes = {}
+    resolution_unit = page.tags.valueof('ResolutionUnit')
+    unit = unit or RESOLUTION_UNITS.get(int(resolution_unit) if resolution_unit is not None else 2)
+    for axis, name in (('x', 'XResolution'), ('y', 'YResolution')):
+        value = page.tags.valueof(name)
+        if value and value[0]:
+            sizes[axis] = {"value": value[1] / value[0], "unit": unit}
+    return sizes
+
+
+def extract_metadata(file_path):
+    """
+    Parse the header and every IFD of a TIFF once into a compact dict.
+
+    Besides the logical (T, Z, C, Y, X) layout, dtype, physical pixel sizes
+    and channel names, per-page tags are deduplicated: ``tag_groups`` holds
+    each distinct set of tags once (layout tags such as strip offsets left
+    out) and ``page_groups`` run-length encodes which group every page uses,
+    as [group, number of pages] pairs.
+    """
+    with TiffStack(file_path) as stack:
+        metadata = {
+            "axes": AXES,
+            "shape": list(stack.shape),
+            "dtype": str(stack.dtype),
+            "series_axes": stack.axes,
+            "series_shape": list(stack.series_shape)
+        }
+
+    with tifffile.TiffFile(file_path) as tif:
+        first = tif.pages.first
+        physical_size, channel_names = {}, None
+        imagej_metadata = tif.imagej_metadata
+        if tif.is_ome and tif.ome_metadata:
+            physical_size, channel_names = _ome_physical_metadata(tif.ome_metadata)
+        elif imagej_metadata:
+            physical_size = _resolution_sizes(first, imagej_metadata.get('unit'))
+            if imagej_metadata.get('spacing'):
+                physical_size["z"] = {"value": float(imagej_metadata['spacing']), "unit": imagej_metadata.get('unit')}
+            if imagej_metadata.get('finterval'):
+                physical_size["t"] = {"value": float(imagej_metadata['finterval']), "unit": 's'}
+        else:
+            physical_size = _resolution_sizes(first)
+
+        # OME-XML and ImageJ descriptions are parsed above; keep them out of the page tags.
+        skip_description = bool(tif.is_ome or tif.is_imagej)
+        groups, group_ids, runs = [], {}, []
+        tif.pages.useframes = False
+        for page in tif.pages:
+            tags = _page_tags(page, skip_description)
+            key = repr(sorted(tags.items()))
+            group = group_ids.get(key)
+            if group is None:
+                group = group_ids[key] = len(groups)
+                groups.append(tags)
+            if runs and runs[-1][0] == group:
+                runs[-1][1] += 1
+            else:
+                runs.append([group, 1])
+
+        metadata.update({
+            "page_count": sum(count for _, count in runs),
+            "physical_size": physical_size,
+            "channel_names": channel_names,
+            "format": {
+                "ome": tif.is_ome,
+                "imagej": tif.is_imagej,
+                "bigtiff": tif.is_bigtiff,
+                "byteorder": tif.byteorder
+            },
+            "imagej_metadata": _json_value(imagej_metadata) if imagej_metadata else None,
+            "tag_groups": groups,
+            "page_groups": runs
+        })
+    return metadata
+
+
+def page_tags(metadata, start, stop):
+    """Tags of pages ``start`` to ``stop - 1``, resolved from the run-length encoding."""
+    pages = []
+    first = 0
+    for group, count in metadata["page_groups"]:
+        last = first + count
+        for index in range(max(first, start), min(last, stop)):
+            pages.append({"index": index, "tags": metadata["tag_groups"][group]})
+        if last >= stop:
+            break
+        first = last
+    return pages
+
+
+def ensure_tiff_metadata(image):
+    """Return the image's structured metadata, extracting and storing it for rows that predate it."""
+    if image.tiff_metadata:
+        return image.tiff_metadata
+    tiff_metadata = extract_metadata(image.file_path)
+    db = db_session()
+    db.query(ImageMetadata).filter(ImageMetadata.id == image.id).update({"tiff_metadata": tiff_metadata})
+    db.commit()
+    image.tiff_metadata = tiff_metadata
+    return tiff_metadata
@@ -0,0 +1,263 @@
+# tiff_stack.py - Lazy (T, Z, C, Y, X) access to TIFF/OME-TIFF/ImageJ stacks
+import threading
+import time
+import numpy as np
+import tifffile
+from .metrics import BYTES_READ, DECODE_SECONDS
+
+AXES = 'TZCYX'
+
+
+def axis_roles(axes, shape):
+    """
+    Position in the file's series axes of each of T, Z, C, Y and X that the
+    series has. Axes beyond the standard letters fill the roles still free;
+    extra ones must have size 1.
+    """
+    y, x = axes.rindex('Y'), axes.rindex('X')
+    roles = {}
+    others = []
+    for i, ax in enumerate(axes):
+        if i in (y, x):
+            continue
+        if ax in 'TZC' and ax not in roles:
+            roles[ax] = i
+        else:
+            others.append(i)
+    if 'C' not in roles:
+        samples = [i for i in others if axes[i] == 'S' and shape[i] > 1]
+        if samples:
+            roles['C'] = samples[0]
+            others.remove(samples[0])
+    unused = [role for role in 'TZC' if role not in roles]
+    while len(others) > len(unused):
+        ones = [i for i in others if shape[i] == 1]
+        if not ones:
+            raise ValueError(f"Cannot map TIFF axes {axes!r} with shape {shape} to {AXES}")
+        others.remove(ones[0])
+    for role, i in zip(unused, others):
+        roles[role] = i
+    roles['Y'], roles['X'] = y, x
+    return roles
+
+
+def logical_shape(page_index):
+    """(T, Z, C, Y, X) shape of a stored ``page_index``, without opening the file."""
+    shape = page_index["shape"]
+    roles = axis_roles(page_index["axes"], shape)
+    return tuple(shape[roles[role]] if role in roles else 1 for role in AXES)
+
+
+class TiffStack:
+    """
+    Read-only, lazily decoded view of the first series of a TIFF file.
+
+    Shape and dtype come from the TIFF/OME/ImageJ header only. Pixel data is
+    memory-mapped when the series is stored uncompressed and contiguous,
+    otherwise only the pages covering the requested planes are decoded.
+    Whatever the axis order in the file, data is always presented in
+    (T, Z, C, Y, X) order; axes missing from the file have size 1.
+
+    ``page_index`` is a JSON-serializable description of the series layout
+    (axes, shape, dtype, data offset and the IFD offset of every page). It is
+    built from the header on first open and stored with ``ImageMetadata``;
+    passing it back in skips series parsing, so locating and decoding a
+    plane costs the same whatever the number of pages in the file.
+
+    Page reads are serialized by a lock, so one stack can be shared between
+    threads. When ``page_cache`` is set (see ``StackCache``) decoded pages
+    are looked up there under ``(cache_key, page number)`` first.
+    """
+
+    def __init__(self, file_path, page_index=None):
+        self.file_path = file_path
+        self.page_cache = None
+        self.cache_key = None
+        self._lock = threading.RLock()
+        self._tif = tifffile.TiffFile(file_path)
+        try:
+            if page_index is None:
+                page_index = self._build_page_index()
+            self._load_page_index(page_index)
+        except Exception:
+            self._tif.close()
+            raise
+
+    def _build_page_index(self):
+        series = self._tif.series[0]
+        offsets = [page.offset if page is not None else None for page in series.pages]
+        axes = series.get_axes(False)
+        shape = tuple(series.get_shape(False))
+        # Samples stored in a page may carry any axis letter, so split by element count:
+        # axes before page_start enumerate pages, the rest live inside a page.
+        page_size = int(np.prod(series.keyframe.shaped))
+        start = axes.rindex('Y')
+        while start > 0 and int(np.prod(shape[start:])) < page_size:
+            start -= 1
+        if int(np.prod(shape[start:])) != page_size:
+            raise ValueError(f"Cannot split TIFF axes {axes!r} into pages of {page_size} samples")
+        return {
+            "axes": axes,
+            "shape": list(shape),
+            "dtype": str(np.dtype(series.dtype)),
+            "page_start": start,
+            "data_offset": series.dataoffset,
+            "page_offsets": None if None in offsets else offsets,
+        }
+
+    def _load_page_index(self, page_index):
+        self.page_index = page_index
+        self.axes = page_index["axes"]
+        self.series_shape = tuple(page_index["shape"])
+        self.dtype = np.dtype(page_index["dtype"])
+        self._page_start = page_index["page_start"]
+        self._lead_shape = self.series_shape[:self._page_start]
+        self._page_shape = self.series_shape[self._page_start:]
+        self._map_axes()
+        self._keyframe = None
+        self._memmap = None
+        if page_index["data_offset"] is not None:
+            self._memmap = np.memmap(self.file_path, dtype=self.dtype.newbyteorder(self._tif.byteorder),
+                                     mode='r', offset=page_index["data_offset"], shape=self.series_shape)
+
+    def _map_axes(self):
+        self._roles = axis_roles(self.axes, self.series_shape)
+        self.shape = tuple(self.series_shape[self._roles[role]] if role in self._roles else 1 for role in AXES)
+        self.ndim = len(self.shape)
+
+    def _series_index(self, time, z, channel):
+        index = [0] * len(self.axes)
+        for role, value in (('T', time), ('Z', z), ('C', channel)):
+            if role in self._roles:
+                index[self._roles[role]] = value
+        index[self._roles['Y']] = slice(None)
+        index[self._roles['X']] = slice(None)
+        return index
+
+    def _logical(self, data):
+        """Reorder an array with the file's (unsqueezed) series shape to TZCYX without copying."""
+        kept = sorted(self._roles.values())
+        index = tuple(slice(None) if i in kept else 0 for i in range(len(self.axes)))
+        data = data[index]
+        present = [role for role in AXES if role in self._roles]
+        data = data.transpose([kept.index(self._roles[role]) for role in present])
+        missing = [i for i, role in enumerate(AXES) if role not in self._roles]
+        return np.expand_dims(data, missing) if missing else data
+
+    @property
+    def is_memmapped(self):
+        return self._memmap is not None
+
+    @property
+    def page_count(self):
+        return int(np.prod(self._lead_shape, dtype=np.int64))
+
+    def page_number(self, time, z, channel):
+        """Index into the series pages of the page holding plane (time, z, channel)."""
+        index = self._series_index(time, z, channel)[:self._page_start]
+        if not index:
+            return 0
+        return int(np.ravel_multi_index(index, self._lead_shape))
+
+    def read_page(self, number, cache=True):
+        """
+        Decode a single page, shaped like the in-page part of the series.
+
+        With a ``page_cache``, cached pages are returned read-only and, unless
+        ``cache`` is False (for full scans that would only flush the cache),
+        newly decoded pages are added to it.
+        """
+        if self.page_cache is not None:
+            page = self.page_cache.get((self.cache_key, number))
+            if page is not None:
+                return page
+        offsets = self.page_index["page_offsets"]
+        start = time.perf_counter()
+        with self._lock:
+            if offsets is None:
+                page = self._tif.series[0].pages[number]
+            else:
+                # Jump straight to the page's IFD instead of walking the IFD chain.
+                if self._keyframe is None:
+                    first = self._tif.pages.first
+                    if first.offset != offsets[0]:
+                        self._tif.filehandle.seek(offsets[0])
+                        first = tifffile.TiffPage(self._tif, index=0)
+                    self._keyframe = first
+                page = tifffile.TiffFrame(self._tif, number, offset=offsets[number], keyframe=self._keyframe)
+            data = page.asarray().reshape(self._page_shape)
+        DECODE_SECONDS.observe(time.perf_counter() - start, 'tiff')
+        BYTES_READ.inc(data.nbytes, 'tiff')
+        if cache and self.page_cache is not None:
+            data.flags.writeable = False
+            self.page_cache.put((self.cache_key, number), data)
+        return data
+
+    def asarray(self):
+        """Return the whole stack, memory-mapped when possible."""
+        if self._memmap is not None:
+            return self._logical(self._memmap)
+        data = np.empty(self.series_shape, dtype=self.dtype)
+        pages = data.reshape((self.page_count,) + self._page_shape)
+        for number in range(self.page_count):
+            pages[number] = self.read_page(number, cache=False)
+        return self._logical(data)
+
+    def plane(self, time, z, channel, _pages=None, cache=True):
+        """Return one (Y, X) plane, touching only the page that holds it."""
+        index = self._series_index(time, z, channel)
+        if self._memmap is not None:
+            plane = self._memmap[tuple(index)]
+            BYTES_READ.inc(plane.nbytes, 'memmap')
+            return plane
+        number = self.page_number(time, z, channel)
+        if _pages is None:
+            page = self.read_page(number, cache)
+        elif number in _pages:
+            page = _pages[number]
+        else:
+            # Channels stored as samples share a page; keep the last one decoded.
+            _pages.clear()
+            page = _pages[number] = self.read_page(number, cache)
+        return page[tuple(index[self._page_start:])]
+
+    def read(self, time=None, z=None, channel=None):
+        """
+        Read the sub-stack selected by fixing any of time, z and channel.
+
+        Fixed axes are dropped from the result, like integer indexing of the
+        full (T, Z, C, Y, X) array. Indices are expected to be in range.
+        """
+        if self._memmap is not None:
+            index = tuple(slice(None) if value is None else value for value in (time, z, channel))
+            return self._logical(self._memmap)[index]
+
+        selected = [range(n) if value is None else [value]
+                    for n, value in zip(self.shape[:3], (time, z, channel))]
+        out = np.empty(tuple(len(s) for s in selected) + self.shape[3:], dtype=self.dtype)
+        pages = {}
+        for i, t in enumerate(selected[0]):
+            for j, zz in enumerate(selected[1]):
+                for k, c in enumerate(selected[2]):
+                    out[i, j, k] = self.plane(t, zz, c, pages)
+        fixed = tuple(axis for axis, value in enumerate((time, z, channel)) if value is not None)
+        return out.squeeze(axis=fixed) if fixed else out
+
+    def iter_planes(self, channel=None, cache=False):
+        """Yield (time, z, channel, plane) for every plane, page by page."""
+        channels = range(self.shape[2]) if channel is None else [channel]
+        pages = {}
+        for t in range(self.shape[0]):
+            for z in range(self.shape[1]):
+                for c in channels:
+                    yield t, z, c, self.plane(t, z, c, pages, cache)
+
+    def close(self):
+        self._memmap = None
+        self._tif.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
@@ -0,0 +1,135 @@
+"""
+Benchmark database round trips and latency per API endpoint.
+
+Uploads a synthetic (T, Z, C, Y, X) stack into a throwaway SQLite database,
+runs Celery tasks eagerly, and calls each read endpoint through the Flask
+test client, counting the SQL statements, commits and pool checkouts each
+request makes on the shared engine.
+
+    python benchmarks/bench_db.py --repeat 200 --output bench_db.json
+"""
+import argparse
+import json
+import os
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+WORKDIR = tempfile.mkdtemp()
+os.environ.setdefault('DATABASE_URI', 'sqlite:///' + os.path.join(WORKDIR, 'bench.db'))
+
+import numpy as np
+import tifffile
+from sqlalchemy import event
+from app import create_app
+from app.celery_app import celery
+from app.models import engine, init_db
+from app.tasks import upload_image_task
+
+REQUEST_ID = "bench-db"
+
+
+class RoundTrips:
+    """Counts what the shared engine sends to the database."""
+
+    def __init__(self, engine):
+        self.statements = self.commits = self.checkouts = 0
+        event.listen(engine, "before_cursor_execute", self._statement)
+        event.listen(engine, "commit", self._commit)
+        event.listen(engine.pool, "checkout", self._checkout)
+
+    def _statement(self, *args):
+        self.statements += 1
+
+    def _commit(self, *args):
+        self.commits += 1
+
+    def _checkout(self, *args):
+        self.checkouts += 1
+
+    def snapshot(self):
+        return self.statements, self.commits, self.checkouts
+
+
+def endpoints(request_id):
+    return [
+        ("metadata", "GET", f"/metadata/{request_id}?fields=shape,dtype", None),
+        ("metadata_pages", "GET", f"/metadata/{request_id}?page=1&per_page=10", None),
+        ("slice_raw", "GET", f"/slice/{request_id}?time=0&z=0&channel=0&format=raw", None),
+        ("hyperslab", "GET", f"/hyperslab/{request_id}?time=0&channel=0&y=0:64&x=0:64", None),
+        ("pyramid", "GET", f"/tiles/{request_id}", None),
+        ("tile", "GET", f"/tiles/{request_id}/0/0/0", None),
+        ("statistics_cached", "GET", f"/statistics/{request_id}", None),
+    ]
+
+
+def measure(client, counter, method, url, body, repeat):
+    latencies, counts = [], []
+    for _ in range(repeat):
+        before = counter.snapshot()
+        start = time.perf_counter()
+        response = client.open(url, method=method, json=body)
+        latencies.append((time.perf_counter() - start) * 1e3)
+        assert response.status_code < 400, (url, response.status_code, response.data[:200])
+        counts.append([after - b for after, b in zip(counter.snapshot(), before)])
+    statements, commits, checkouts = (statistics.mean(column) for column in zip(*counts))
+    return {
+        "statements": round(statements, 2),
+        "commits": round(commits, 2),
+        "checkouts": round(checkouts, 2),
+        "median_ms": round(statistics.median(latencies), 3),
+        "p95_ms": round(float(np.percentile(latencies, 95)), 3)
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--shape', type=int, nargs=5, default=[2, 4, 3, 256, 256], metavar=('T', 'Z', 'C', 'Y', 'X'))
+    parser.add_argument('--repeat', type=int, default=100)
+    parser.add_argument('--output', help="write results as JSON to this file")
+    args = parser.parse_args()
+
+    cwd = os.getcwd()
+    os.chdir(WORKDIR)
+    os.makedirs('logs', exist_ok=True)
+    try:
+        app, _ = create_app()
+        with app.app_context():
+            init_db()
+        app.config.update({"TESTING": True})
+        celery.conf.update(task_always_eager=True)
+        client = app.test_client()
+
+        path = os.path.join(WORKDIR, 'stack.tif')
+        data = np.random.default_rng(0).integers(0, 4000, size=args.shape, dtype=np.uint16)
+        tifffile.imwrite(path, data, imagej=True, metadata={"axes": "TZCYX"})
+        upload_image_task.delay(path, REQUEST_ID)
+
+        counter = RoundTrips(engine)
+        # Computes and caches the statistics, so the timed calls below measure the cached path.
+        cold = measure(client, counter, "GET", f"/statistics/{REQUEST_ID}", None, 1)
+        results = [dict(cold, endpoint="statistics_cold", requests=1)]
+        print(f"{'statistics_cold':>18}  {cold['statements']:6.1f} statements  {cold['commits']:4.1f} commits"
+              f"  {cold['median_ms']:9.3f} ms")
+        for name, method, url, body in endpoints(REQUEST_ID):
+            result = measure(client, counter, method, url, body, args.repeat)
+            results.append(dict(result, endpoint=name, requests=args.repeat))
+            print(f"{name:>18}  {result['statements']:6.1f} statements  {result['commits']:4.1f} commits"
+                  f"  {result['median_ms']:9.3f} ms  (p95 {result['p95_ms']:.3f} ms)")
+    finally:
+        celery.conf.update(task_always_eager=False)
+        os.chdir(cwd)
+        engine.dispose()
+        shutil.rmtree(WORKDIR, ignore_errors=True)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({"benchmark": "db_round_trips", "shape": args.shape, "results": results}, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,114 @@
+"""
+Benchmark peak memory and time of statistics and PCA under the dtype policy.
+
+Writes a synthetic zlib-compressed (T, Z, C, Y, X) stack, then compares the
+whole-array float64 approach (numpy statistics and sklearn PCA on the full
+pixel matrix) with the streaming path, whose projection is written as
+float64, float32 or rescaled to the source type. Peak memory is the largest
+amount of Python/numpy memory traced while the operation ran.
+
+    python benchmarks/bench_dtype.py --shape 2 16 4 1024 1024 --dtype uint16
+"""
+import argparse
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import numpy as np
+import tifffile
+from sklearn.decomposition import PCA
+from app.views.image_processor import ImageProcessor
+
+
+def numpy_statistics(path):
+    image = tifffile.imread(path)
+    return [{"mean": np.mean(image[:, :, c]), "std": np.std(image[:, :, c]),
+             "min": np.min(image[:, :, c]), "max": np.max(image[:, :, c])} for c in range(image.shape[2])]
+
+
+def sklearn_pca(path, output_path):
+    image = tifffile.imread(path)
+    pixels = image.transpose(0, 1, 3, 4, 2).reshape(-1, image.shape[2])
+    reduced = PCA(n_components=3).fit_transform(pixels)
+    shape = image.shape[:2] + image.shape[3:] + (3,)
+    tifffile.imwrite(output_path, reduced.reshape(shape).transpose(0, 1, 4, 2, 3))
+
+
+def streaming(operation):
+    def run(path, output_path):
+        with ImageProcessor(path, cache=False) as processor:
+            return operation(processor, output_path)
+    return run
+
+
+OPERATIONS = {
+    "statistics/numpy_float64": lambda path, output_path: numpy_statistics(path),
+    "statistics/streaming": streaming(lambda p, output_path: p.calculate_statistics()),
+    "pca/sklearn_float64": sklearn_pca,
+    "pca/streaming_float64": streaming(lambda p, output_path: p.perform_pca(3, output_path, dtype='float64')),
+    "pca/streaming_float32": streaming(lambda p, output_path: p.perform_pca(3, output_path, dtype='float32')),
+    "pca/streaming_source": streaming(lambda p, output_path: p.perform_pca(3, output_path, dtype='source')),
+}
+
+
+def measure(operation, path, output_path):
+    tracemalloc.start()
+    start = time.perf_counter()
+    result = operation(path, output_path)
+    elapsed = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1]
+    del result
+    tracemalloc.stop()
+    return elapsed, peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--shape', type=int, nargs=5, default=[2, 8, 4, 512, 512], metavar=('T', 'Z', 'C', 'Y', 'X'))
+    parser.add_argument('--dtype', choices=['uint8', 'uint16'], default='uint16')
+    parser.add_argument('--operations', nargs='+', choices=list(OPERATIONS), default=list(OPERATIONS))
+    parser.add_argument('--output', help="write results as JSON to this file")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp()
+    path = os.path.join(workdir, 'stack.tif')
+    high = np.iinfo(args.dtype).max
+    data = np.random.default_rng(0).integers(0, high, size=args.shape, dtype=args.dtype)
+    tifffile.imwrite(path, data, compression='zlib', imagej=True, metadata={"axes": "TZCYX"})
+    raw_bytes = data.nbytes
+    del data
+
+    results = []
+    try:
+        for name in args.operations:
+            output_path = os.path.join(workdir, 'output.tif')
+            elapsed, peak = measure(OPERATIONS[name], path, output_path)
+            output_bytes = os.path.getsize(output_path) if os.path.exists(output_path) else 0
+            if output_bytes:
+                os.remove(output_path)
+            results.append({
+                "operation": name,
+                "seconds": round(elapsed, 4),
+                "peak_mb": round(peak / 1024 ** 2, 1),
+                "peak_x_raw": round(peak / raw_bytes, 2),
+                "output_mb": round(output_bytes / 1024 ** 2, 1)
+            })
+            print(f"{name:>24}  {elapsed:8.3f} s  peak {peak / 1024 ** 2:9.1f} MB ({peak / raw_bytes:5.2f}x raw)"
+                  f"  output {output_bytes / 1024 ** 2:8.1f} MB")
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({"benchmark": "dtype_policy", "shape": args.shape, "dtype": args.dtype,
+                       "raw_mb": round(raw_bytes / 1024 ** 2, 1), "results": results}, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,81 @@
+"""
+Benchmark ImageMetadata lookups as the table grows.
+
+Compares the indexed ``request_id`` equality lookup with the old
+``file_path LIKE '%<request_id>%'`` scan on a throwaway SQLite database.
+
+    python benchmarks/bench_lookup.py --sizes 1000 10000 100000 1000000
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+import uuid
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from sqlalchemy import create_engine, func, insert
+from sqlalchemy.orm import sessionmaker
+from app.models.base import Base
+from app.models.image_process import ImageMetadata
+
+
+def grow(session, target, batch=50000):
+    current = session.query(ImageMetadata).count()
+    while current < target:
+        rows = []
+        for _ in range(min(batch, target - current)):
+            request_id = str(uuid.uuid4())
+            rows.append({
+                "request_id": request_id,
+                "filename": "stack.ome.tif",
+                "dimensions": "(2, 43, 10, 512, 512)",
+                "file_path": f"media/{request_id}_stack.ome.tif",
+                "upload_time": "2026-10-18T00:00:00",
+            })
+        session.execute(insert(ImageMetadata), rows)
+        session.commit()
+        current += len(rows)
+    return [r for (r,) in session.query(ImageMetadata.request_id).order_by(func.random()).limit(1000)]
+
+
+def time_lookups(session, request_ids, criterion, repeat):
+    start = time.perf_counter()
+    for i in range(repeat):
+        request_id = request_ids[i % len(request_ids)]
+        assert session.query(ImageMetadata).filter(criterion(request_id)).first() is not None
+    return (time.perf_counter() - start) / repeat * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000, 100000])
+    parser.add_argument('--repeat', type=int, default=200)
+    parser.add_argument('--output', help="write results as JSON to this file")
+    args = parser.parse_args()
+
+    path = os.path.join(tempfile.mkdtemp(), 'bench.db')
+    engine = create_engine('sqlite:///' + path)
+    Base.metadata.create_all(bind=engine)
+    session = sessionmaker(bind=engine)()
+
+    results = []
+    for size in sorted(args.sizes):
+        request_ids = grow(session, size)
+        indexed = time_lookups(session, request_ids, lambda r: ImageMetadata.request_id == r, args.repeat)
+        scan = time_lookups(session, request_ids, lambda r: ImageMetadata.file_path.contains(r),
+                            max(1, args.repeat // 10))
+        results.append({"rows": size, "indexed_us": round(indexed, 1), "like_scan_us": round(scan, 1)})
+        print(f"{size:>10} rows  indexed {indexed:10.1f} us  LIKE scan {scan:12.1f} us")
+
+    session.close()
+    os.remove(path)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({"benchmark": "request_id_lookup", "results": results}, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
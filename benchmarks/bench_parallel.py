@@ -0,0 +1,84 @@
+"""
+Benchmark how whole-stack operations scale with ComputeBackend workers.
+
+Writes a synthetic zlib-compressed (T, Z, C, Y, X) stack, then times
+statistics, PCA, segmentation and a max projection with 1, 2, 4, ...
+workers, reporting throughput in planes per second and the speedup over
+one worker.
+
+    python benchmarks/bench_parallel.py --shape 8 16 3 1024 1024 --executor process
+"""
+import argparse
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import numpy as np
+import tifffile
+from app.views.image_processor import ImageProcessor
+from app.views.parallel import ComputeBackend, available_cpus
+
+
+def operations(workdir):
+    full = (slice(None),) * 5
+    return {
+        "statistics": lambda p: p.calculate_statistics(),
+        "pca": lambda p: p.perform_pca(3, os.path.join(workdir, 'pca.tif')),
+        "segmentation": lambda p: p.save_segmentation(0, os.path.join(workdir, 'mask.tif')),
+        "max_projection": lambda p: p.get_hyperslab(full[:1] + (slice(None),) + full[2:], 'max', 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--shape', type=int, nargs=5, default=[4, 16, 3, 512, 512], metavar=('T', 'Z', 'C', 'Y', 'X'))
+    parser.add_argument('--executor', choices=['thread', 'process'], default='process')
+    parser.add_argument('--workers', type=int, nargs='+',
+                        default=sorted({1, 2, 4, available_cpus()} & set(range(1, available_cpus() + 1))))
+    parser.add_argument('--output', help="write results as JSON to this file")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp()
+    path = os.path.join(workdir, 'stack.tif')
+    data = np.random.default_rng(0).integers(0, 4000, size=args.shape, dtype=np.uint16)
+    tifffile.imwrite(path, data, compression='zlib', imagej=True, metadata={"axes": "TZCYX"})
+    planes = args.shape[0] * args.shape[1] * args.shape[2]
+    del data
+
+    results = []
+    try:
+        for name, operation in operations(workdir).items():
+            baseline = None
+            for workers in args.workers:
+                with ImageProcessor(path, cache=False, backend=ComputeBackend(args.executor, workers)) as processor:
+                    start = time.perf_counter()
+                    result = operation(processor)
+                    elapsed = time.perf_counter() - start
+                    del result
+                baseline = baseline or elapsed
+                results.append({
+                    "operation": name,
+                    "executor": args.executor,
+                    "workers": workers,
+                    "seconds": round(elapsed, 4),
+                    "planes_per_second": round(planes / elapsed, 1),
+                    "speedup": round(baseline / elapsed, 2)
+                })
+                print(f"{name:>15}  {workers:3d} workers  {elapsed:8.3f} s  {planes / elapsed:9.1f} planes/s"
+                      f"  x{baseline / elapsed:.2f}")
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({"benchmark": "parallel_scaling", "shape": args.shape, "cpus": available_cpus(),
+                       "results": results}, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
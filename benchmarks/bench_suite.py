@@ -0,0 +1,254 @@
+"""
+Benchmark the processing and API hot paths on a synthetic stack.
+
+Generates a (T, Z, C, Y, X) stack with benchmarks/synthetic.py, then times
+ImageProcessor operations and Flask endpoints (through the test client,
+with Celery in eager mode) and records each case's peak RSS. Every run of a
+case happens in a fresh process with its own database and working folder,
+so caches start cold and peak RSS belongs to that case alone.
+
+Results go to JSON; with --baseline, cases slower than a previous result
+by more than --tolerance are reported and the exit status is 1.
+
+    python benchmarks/bench_suite.py --shape 2 16 3 1024 1024 --repeat 3 --output bench.json
+    python benchmarks/bench_suite.py --baseline bench.json
+
+Celery runs eagerly with an in-memory result backend unless
+CELERY_BROKER_URL and CELERY_BACKEND_URL are exported, e.g. to a local Redis.
+"""
+import argparse
+import io
+import json
+import logging
+import multiprocessing
+import os
+import platform
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(__file__))
+
+import numpy as np
+import tifffile
+from synthetic import COMPRESSIONS, DTYPES, write_stack
+
+
+def _processor(ctx):
+    from app.views.image_processor import ImageProcessor
+    return ImageProcessor(ctx["path"], cache=False)
+
+
+def _middle(ctx):
+    return tuple(size // 2 for size in ctx["shape"][:3])
+
+
+def _upload(ctx):
+    # Store the stack through the upload task, as /upload does, and return its request_id.
+    from app.tasks import upload_image_task
+    upload_image_task.delay(ctx["path"], "bench")
+    return "bench"
+
+
+def _processor_case(operation):
+    def run(ctx):
+        with _processor(ctx) as processor:
+            return operation(processor, ctx)
+    return {"setup": None, "run": run}
+
+
+def _api_case(method, url, setup=_upload, **kwargs):
+    def run(ctx):
+        response = getattr(ctx["client"], method)(url.format(**ctx), **kwargs)
+        assert response.status_code < 400, response.data[:200]
+        return response
+    return {"setup": setup, "run": run}
+
+
+def _upload_file(ctx):
+    with open(ctx["path"], 'rb') as f:
+        ctx["file"] = f.read()
+
+
+def _warm_statistics(ctx):
+    _upload(ctx)
+    ctx["client"].get('/statistics/bench')
+
+
+def _job(ctx):
+    _upload(ctx)
+    ctx["task_id"] = ctx["client"].get('/statistics/bench').json["task_id"]
+
+
+CASES = {
+    "processor/open": _processor_case(lambda p, ctx: p.shape),
+    "processor/load": _processor_case(lambda p, ctx: np.asarray(p.image).sum()),
+    "processor/slice": _processor_case(lambda p, ctx: p.get_slice(*_middle(ctx))),
+    "processor/statistics": _processor_case(lambda p, ctx: p.calculate_statistics()),
+    "processor/pca": _processor_case(lambda p, ctx: p.perform_pca(3, os.path.join(ctx["workdir"], 'pca.tif'))),
+    "processor/segmentation": _processor_case(
+        lambda p, ctx: p.save_segmentation(0, os.path.join(ctx["workdir"], 'mask.tif'))),
+    "api/upload": {
+        "setup": _upload_file,
+        "run": lambda ctx: ctx["client"].post('/upload', data={'file': (io.BytesIO(ctx["file"]), 'stack.tif')})
+    },
+    "api/metadata": _api_case('get', '/metadata/bench'),
+    "api/slice": _api_case('get', '/slice/bench?time=0&z=0&channel=0'),
+    "api/slice_png": _api_case('get', '/slice/bench?time=0&z=0&channel=0&format=png'),
+    "api/hyperslab_max": _api_case('get', '/hyperslab/bench?channel=0&projection=max&axis=z&format=raw'),
+    "api/tile": _api_case('get', '/tiles/bench/0/0/0?channel=0'),
+    "api/statistics": _api_case('get', '/statistics/bench'),
+    "api/statistics_cached": _api_case('get', '/statistics/bench', setup=_warm_statistics),
+    "api/analyze": _api_case('post', '/analyze/bench', json={"components": 2}),
+    "api/segment": _api_case('post', '/segment/bench', json={"channel": 0}),
+    "api/job": _api_case('get', '/jobs/{task_id}', setup=_job),
+}
+
+
+def _rss_mb():
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS.
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 ** 2 if sys.platform == 'darwin' else 1024)
+
+
+def _run_case(name, path, shape, results):
+    # Runs in a fresh process, from a private working folder and database.
+    workdir = tempfile.mkdtemp()
+    os.chdir(workdir)
+    os.makedirs('logs')
+    os.makedirs('media')
+    os.environ['DATABASE_URI'] = 'sqlite:///' + os.path.join(workdir, 'bench.db')
+    os.environ.setdefault('CELERY_BROKER_URL', 'memory://')
+    os.environ.setdefault('CELERY_BACKEND_URL', 'cache+memory://')
+    try:
+        from app import create_app
+        from app.celery_app import celery
+        from app.models import init_db
+        app, _ = create_app()
+        with app.app_context():
+            init_db()
+        app.config.update({"TESTING": True})
+        celery.conf.update(task_always_eager=True, task_store_eager_result=True)
+        logging.disable(logging.WARNING)
+
+        ctx = {"path": path, "shape": shape, "workdir": workdir, "client": app.test_client()}
+        case = CASES[name]
+        if case["setup"] is not None:
+            case["setup"](ctx)
+        rss_before = _rss_mb()
+        start = time.perf_counter()
+        result = case["run"](ctx)
+        elapsed = time.perf_counter() - start
+        del result
+        results.put({"seconds": elapsed, "peak_rss_mb": _rss_mb(), "rss_growth_mb": _rss_mb() - rss_before})
+    except Exception as e:
+        results.put({"error": f"{type(e).__name__}: {e}"})
+    finally:
+        os.chdir(ROOT)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def run_case(name, path, shape):
+    context = multiprocessing.get_context('spawn')
+    results = context.Queue()
+    process = context.Process(target=_run_case, args=(name, path, shape, results))
+    process.start()
+    result = results.get()
+    process.join()
+    return result
+
+
+def environment():
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=ROOT, capture_output=True, text=True).stdout.strip()
+    except OSError:
+        commit = None
+    return {
+        "commit": commit or None,
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "tifffile": tifffile.__version__,
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "celery_broker": os.environ.get('CELERY_BROKER_URL', 'memory:// (eager)'),
+        "time": time.strftime('%Y-%m-%dT%H:%M:%S%z')
+    }
+
+
+def compare(results, baseline_path, tolerance):
+    """Print cases slower than the baseline by more than ``tolerance`` and return their names."""
+    with open(baseline_path) as f:
+        baseline = {case["case"]: case for case in json.load(f)["results"]}
+    regressions = []
+    for case in results:
+        before = baseline.get(case["case"])
+        if not before or "median_s" not in before or "median_s" not in case:
+            continue
+        ratio = case["median_s"] / before["median_s"] if before["median_s"] else 1.0
+        if ratio > 1 + tolerance:
+            regressions.append(case["case"])
+            print(f"REGRESSION {case['case']:>24}  {before['median_s']:.4f} s -> {case['median_s']:.4f} s"
+                  f"  x{ratio:.2f}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--shape', type=int, nargs=5, default=[2, 8, 3, 512, 512], metavar=('T', 'Z', 'C', 'Y', 'X'))
+    parser.add_argument('--dtype', choices=DTYPES, default='uint16')
+    parser.add_argument('--compression', choices=COMPRESSIONS, default='zlib')
+    parser.add_argument('--cases', nargs='+', choices=list(CASES), default=list(CASES))
+    parser.add_argument('--repeat', type=int, default=3, help="fresh-process runs per case")
+    parser.add_argument('--output', help="write results as JSON to this file")
+    parser.add_argument('--baseline', help="JSON from an earlier run to compare median times against")
+    parser.add_argument('--tolerance', type=float, default=0.2, help="allowed slowdown against the baseline")
+    args = parser.parse_args()
+
+    datadir = tempfile.mkdtemp()
+    path = os.path.join(datadir, 'stack.tif')
+    write_stack(path, args.shape, args.dtype, args.compression)
+    results = []
+    try:
+        for name in args.cases:
+            runs = [run_case(name, path, args.shape) for _ in range(args.repeat)]
+            errors = [run["error"] for run in runs if "error" in run]
+            if errors:
+                results.append({"case": name, "error": errors[0]})
+                print(f"{name:>24}  error: {errors[0]}")
+                continue
+            seconds = [run["seconds"] for run in runs]
+            results.append({
+                "case": name,
+                "runs": len(runs),
+                "median_s": round(float(np.median(seconds)), 4),
+                "min_s": round(min(seconds), 4),
+                "max_s": round(max(seconds), 4),
+                "peak_rss_mb": round(max(run["peak_rss_mb"] for run in runs), 1),
+                "rss_growth_mb": round(max(run["rss_growth_mb"] for run in runs), 1)
+            })
+            case = results[-1]
+            print(f"{name:>24}  median {case['median_s']:8.4f} s  min {case['min_s']:8.4f} s"
+                  f"  peak RSS {case['peak_rss_mb']:7.1f} MB (+{case['rss_growth_mb']:.1f})")
+    finally:
+        shutil.rmtree(datadir, ignore_errors=True)
+
+    report = {
+        "benchmark": "suite",
+        "environment": environment(),
+        "stack": {"shape": args.shape, "dtype": args.dtype, "compression": args.compression},
+        "results": results
+    }
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    if args.baseline and compare(results, args.baseline, args.tolerance):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
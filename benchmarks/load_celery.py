@@ -0,0 +1,138 @@
+"""
+Load-test Celery queue latency under mixed light and heavy traffic.
+
+Starts real workers on a local broker (kombu's filesystem transport,
+unless CELERY_BROKER_URL and CELERY_BACKEND_URL are exported), queues a burst of long "heavy" jobs, then a steady stream of
+quick "light" jobs, and reports how long each waited between being sent
+and starting. Two layouts are compared:
+
+  shared  one worker on one queue with Celery's default prefetch of 4
+  split   a light worker and a heavy worker on their own queues, as in
+          app.celery_app, with prefetch 1 for the heavy one
+
+    python benchmarks/load_celery.py --heavy 6 --heavy-seconds 2 --light 40
+"""
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, ROOT)
+
+if __name__ == '__main__' or 'LOAD_CELERY_DIR' in os.environ:
+    # Workers inherit the broker folder from the parent through the environment.
+    os.environ.setdefault('LOAD_CELERY_DIR', tempfile.mkdtemp())
+    BROKER_DIR = os.environ['LOAD_CELERY_DIR']
+    os.environ.setdefault('CELERY_BROKER_URL', 'filesystem://')
+    os.environ.setdefault('CELERY_BACKEND_URL', 'file://' + os.path.join(BROKER_DIR, 'results'))
+
+import numpy as np
+from app.celery_app import HEAVY_QUEUE, LIGHT_QUEUE, celery
+
+if celery.conf.broker_url.startswith('filesystem'):
+    for folder in ('queue', 'processed', 'control', 'results'):
+        os.makedirs(os.path.join(BROKER_DIR, folder), exist_ok=True)
+    celery.conf.broker_transport_options = {
+        "data_folder_in": os.path.join(BROKER_DIR, 'queue'),
+        "data_folder_out": os.path.join(BROKER_DIR, 'queue'),
+        "processed_folder": os.path.join(BROKER_DIR, 'processed'),
+        "control_folder": os.path.join(BROKER_DIR, 'control'),
+        "polling_interval": 0.01,
+    }
+
+
+@celery.task(name='load_celery.probe')
+def probe(sent_at, seconds):
+    started = time.time()
+    time.sleep(seconds)
+    return started - sent_at
+
+
+LAYOUTS = {
+    "shared": [{"queues": [LIGHT_QUEUE], "concurrency": 2, "prefetch": 4}],
+    "split": [{"queues": [LIGHT_QUEUE], "concurrency": 1, "prefetch": 4},
+              {"queues": [HEAVY_QUEUE], "concurrency": 1, "prefetch": 1}],
+}
+
+
+def start_workers(layout):
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join([os.path.dirname(__file__), ROOT]))
+    workers = []
+    for i, worker in enumerate(LAYOUTS[layout]):
+        workers.append(subprocess.Popen([
+            sys.executable, '-m', 'celery', '-A', 'load_celery.celery', 'worker',
+            '-Q', ','.join(worker["queues"]), '-c', str(worker["concurrency"]),
+            '--prefetch-multiplier', str(worker["prefetch"]), '-n', f'{layout}{i}@%h',
+            '--without-gossip', '--without-mingle', '--loglevel', 'warning'
+        ], env=env, cwd=ROOT, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL))
+    return workers
+
+
+def run_layout(layout, heavy, heavy_seconds, light, light_interval):
+    workers = start_workers(layout)
+    try:
+        # Wait until every worker answers, so startup time is not counted as queueing.
+        deadline = time.time() + 60
+        while len(celery.control.ping(timeout=0.5) or []) < len(workers):
+            if time.time() > deadline:
+                raise RuntimeError("Workers did not start")
+        heavy_queue = HEAVY_QUEUE if layout == "split" else LIGHT_QUEUE
+        heavy_results = [probe.apply_async((time.time(), heavy_seconds), queue=heavy_queue) for _ in range(heavy)]
+        light_results = []
+        for _ in range(light):
+            light_results.append(probe.apply_async((time.time(), 0), queue=LIGHT_QUEUE))
+            time.sleep(light_interval)
+        timeout = heavy * heavy_seconds + 60
+        waits = {
+            "light": [r.get(timeout=timeout) for r in light_results],
+            "heavy": [r.get(timeout=timeout) for r in heavy_results]
+        }
+    finally:
+        for worker in workers:
+            worker.terminate()
+        for worker in workers:
+            worker.wait()
+    return {
+        kind: {
+            "jobs": len(values),
+            "p50_s": round(float(np.percentile(values, 50)), 3),
+            "p95_s": round(float(np.percentile(values, 95)), 3),
+            "max_s": round(float(np.max(values)), 3)
+        }
+        for kind, values in waits.items()
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--layouts', nargs='+', choices=list(LAYOUTS), default=list(LAYOUTS))
+    parser.add_argument('--heavy', type=int, default=6)
+    parser.add_argument('--heavy-seconds', type=float, default=2.0)
+    parser.add_argument('--light', type=int, default=40)
+    parser.add_argument('--light-interval', type=float, default=0.1)
+    parser.add_argument('--output', help="write results as JSON to this file")
+    args = parser.parse_args()
+
+    results = {}
+    try:
+        for layout in args.layouts:
+            results[layout] = run_layout(layout, args.heavy, args.heavy_seconds, args.light, args.light_interval)
+            for kind, stats in results[layout].items():
+                print(f"{layout:>7} {kind:>6}  p50 {stats['p50_s']:7.3f} s  p95 {stats['p95_s']:7.3f} s"
+                      f"  max {stats['max_s']:7.3f} s")
+    finally:
+        if os.environ.get('CELERY_BROKER_URL', '').startswith('filesystem'):
+            shutil.rmtree(BROKER_DIR, ignore_errors=True)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({"benchmark": "celery_queue_latency", "parameters": vars(args), "results": results}, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
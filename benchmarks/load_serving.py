@@ -0,0 +1,214 @@
+"""
+Load-test the web tier with slow downloads and API requests at once.
+
+Ingests a synthetic stack, then starts gunicorn on it once per layout and
+runs two kinds of client together for ``--seconds``. ``--slow`` clients
+download the stack from /media at ``--slow-rate`` bytes per second, as
+viewers on slow links do, each asking for a different byte range.
+``--api`` clients request PNG tiles and /metadata, each sending its next
+request as soon as the last one is answered. The report covers API
+throughput and latency, and the bytes the slow clients received. Two
+layouts are compared:
+
+  sync     gunicorn's default sync workers, one connection per process
+  gthread  gunicorn.conf.py: threaded workers that sendfile from /media
+
+    python benchmarks/load_serving.py --workers 2 --slow 8 --api 4 --seconds 10
+"""
+import argparse
+import http.client
+import json
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, ROOT)
+
+import numpy as np
+from synthetic import write_stack
+
+LAYOUTS = {
+    "sync": ['--worker-class', 'sync', '--threads', '1'],
+    "gthread": [],
+}
+REQUEST_ID = "load-serving"
+
+
+def ingest(path, shape, workdir):
+    """Store the stack in a private database, building its pyramid, as an upload would."""
+    os.environ['DATABASE_URI'] = 'sqlite:///' + os.path.join(workdir, 'serving.db')
+    os.environ.setdefault('CELERY_BROKER_URL', 'memory://')
+    os.environ.setdefault('CELERY_BACKEND_URL', 'cache+memory://')
+    os.environ['CHUNK_STORE_ENABLED'] = 'false'
+    os.makedirs(os.path.join(ROOT, 'logs'), exist_ok=True)
+    from app import create_app
+    from app.celery_app import celery
+    from app.models import SessionLocal, init_db
+    from app.models.image_process import ImageMetadata
+    from app.tasks import upload_image_task
+    app, _ = create_app()
+    with app.app_context():
+        init_db()
+    celery.conf.update(task_always_eager=True)
+    write_stack(path, shape, compression='none')
+    upload_image_task.delay(path, REQUEST_ID)
+    db = SessionLocal()
+    pyramid = db.query(ImageMetadata).filter(ImageMetadata.request_id == REQUEST_ID).one().pyramid
+    db.close()
+    return pyramid
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def start_server(layout, port, workers, workdir):
+    env = dict(os.environ, METRICS_DIR=os.path.join(workdir, 'metrics'))
+    server = subprocess.Popen([
+        sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py', '--bind', f'127.0.0.1:{port}',
+        '--workers', str(workers), *LAYOUTS[layout], 'wsgi:app'
+    ], env=env, cwd=ROOT, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    deadline = time.time() + 60
+    while True:
+        try:
+            connection = http.client.HTTPConnection('127.0.0.1', port, timeout=1)
+            connection.request('GET', f'/metadata/{REQUEST_ID}')
+            if connection.getresponse().status == 200:
+                return server
+        except OSError:
+            pass
+        if server.poll() is not None or time.time() > deadline:
+            server.kill()
+            raise RuntimeError(f"gunicorn ({layout}) did not start")
+        time.sleep(0.2)
+
+
+def slow_client(port, url, start, rate, deadline, received):
+    # Reads a byte range 64 KiB at a time, no faster than ``rate`` bytes per second.
+    connection = http.client.HTTPConnection('127.0.0.1', port, timeout=60)
+    try:
+        connection.request('GET', url, headers={'Range': f'bytes={start}-'})
+        response = connection.getresponse()
+        began = time.time()
+        total = 0
+        while time.time() < deadline:
+            data = response.read(64 * 1024)
+            if not data:
+                break
+            total += len(data)
+            time.sleep(max(0.0, began + total / rate - time.time()))
+        received.append(total)
+    except OSError:
+        received.append(0)
+    finally:
+        connection.close()
+
+
+def api_client(port, urls, deadline, latencies, errors):
+    i = 0
+    while time.time() < deadline:
+        url = urls[i % len(urls)]
+        i += 1
+        start = time.perf_counter()
+        try:
+            connection = http.client.HTTPConnection('127.0.0.1', port, timeout=60)
+            connection.request('GET', url)
+            response = connection.getresponse()
+            response.read()
+            connection.close()
+            if response.status != 200:
+                errors.append(response.status)
+                continue
+        except OSError as e:
+            errors.append(type(e).__name__)
+            continue
+        latencies.append(time.perf_counter() - start)
+
+
+def run_layout(layout, args, pyramid, media_path, workdir):
+    port = free_port()
+    server = start_server(layout, port, args.workers, workdir)
+    size = os.path.getsize(media_path)
+    media_url = '/media/' + os.path.relpath(media_path, os.path.join(ROOT, 'media')).replace(os.sep, '/')
+    height, width = pyramid["levels"][0]["shape"][-2:]
+    tiles = [f'/tiles/{REQUEST_ID}/0/{y}/{x}?format=png&window=auto&time={t}'
+             for t in range(pyramid["shape"][0])
+             for y in range(-(-height // pyramid["tile_size"])) for x in range(-(-width // pyramid["tile_size"]))]
+    urls = tiles + [f'/metadata/{REQUEST_ID}']
+    received, latencies, errors = [], [], []
+    try:
+        deadline = time.time() + args.seconds
+        threads = [threading.Thread(target=slow_client,
+                                    args=(port, media_url, i * size // max(1, args.slow), args.slow_rate,
+                                          deadline, received))
+                   for i in range(args.slow)]
+        for thread in threads:
+            thread.start()
+        # Let the slow clients take their connections first, as a long-running viewer would.
+        time.sleep(0.5)
+        api = [threading.Thread(target=api_client, args=(port, urls, deadline, latencies, errors))
+               for _ in range(args.api)]
+        for thread in api:
+            thread.start()
+        for thread in threads + api:
+            thread.join()
+        elapsed = time.time() - deadline + args.seconds
+    finally:
+        server.terminate()
+        server.wait()
+    return {
+        "api_requests": len(latencies),
+        "api_errors": len(errors),
+        "api_per_s": round(len(latencies) / elapsed, 1),
+        "api_p50_ms": round(1000 * float(np.percentile(latencies, 50)), 1) if latencies else None,
+        "api_p95_ms": round(1000 * float(np.percentile(latencies, 95)), 1) if latencies else None,
+        "slow_mb": round(sum(received) / 1024 ** 2, 1)
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--layouts', nargs='+', choices=list(LAYOUTS), default=list(LAYOUTS))
+    parser.add_argument('--shape', type=int, nargs=5, default=[2, 8, 2, 1024, 1024], metavar=('T', 'Z', 'C', 'Y', 'X'))
+    parser.add_argument('--workers', type=int, default=2, help="gunicorn worker processes")
+    parser.add_argument('--slow', type=int, default=8, help="concurrent slow downloads")
+    parser.add_argument('--slow-rate', type=float, default=512 * 1024, help="bytes per second per slow download")
+    parser.add_argument('--api', type=int, default=4, help="concurrent API clients")
+    parser.add_argument('--seconds', type=float, default=10)
+    parser.add_argument('--output', help="write results as JSON to this file")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp()
+    media_dir = tempfile.mkdtemp(prefix='load-serving-', dir=os.path.join(ROOT, 'media'))
+    pyramid = None
+    results = {}
+    try:
+        media_path = os.path.join(media_dir, 'stack.tif')
+        pyramid = ingest(media_path, args.shape, workdir)
+        for layout in args.layouts:
+            results[layout] = stats = run_layout(layout, args, pyramid, media_path, workdir)
+            p50 = '-' if stats['api_p50_ms'] is None else f"{stats['api_p50_ms']:.1f}"
+            p95 = '-' if stats['api_p95_ms'] is None else f"{stats['api_p95_ms']:.1f}"
+            print(f"{layout:>8}  api {stats['api_per_s']:7.1f}/s  p50 {p50:>7} ms  p95 {p95:>7} ms"
+                  f"  errors {stats['api_errors']:4d}  slow downloads {stats['slow_mb']:7.1f} MB")
+    finally:
+        if pyramid is not None:
+            os.remove(pyramid["file_path"])
+        shutil.rmtree(media_dir, ignore_errors=True)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({"benchmark": "serving_concurrency", "parameters": vars(args), "results": results}, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,79 @@
+"""
+Generate synthetic (T, Z, C, Y, X) TIFF stacks for benchmarks.
+
+Each channel holds Gaussian blobs that drift with time and fade with depth
+over a noisy background, so compression, thresholds and PCA see data shaped
+like fluorescence microscopy rather than uniform noise. Planes are written
+one at a time; stacks larger than memory are fine.
+
+    python benchmarks/synthetic.py stack.tif --shape 4 16 3 1024 1024 --dtype uint16 --compression zlib
+"""
+import argparse
+import os
+import sys
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import numpy as np
+import tifffile
+
+DTYPES = ('uint8', 'uint16', 'float32')
+COMPRESSIONS = ('none', 'zlib', 'lzw', 'zstd')
+
+
+def _blobs(rng, height, width, count):
+    # Sum of Gaussians at random centres and widths, peaking at about 1.
+    y, x = np.ogrid[:height, :width]
+    image = np.zeros((height, width), dtype=np.float32)
+    for _ in range(count):
+        cy, cx = rng.uniform(0, height), rng.uniform(0, width)
+        sigma = rng.uniform(0.01, 0.05) * min(height, width) + 1
+        image += np.exp(-((y - cy) ** 2 + (x - cx) ** 2) / (2 * sigma ** 2)).astype(np.float32)
+    return np.clip(image, 0, 1)
+
+
+def iter_planes(shape, dtype='uint16', seed=0, blobs=24, noise=0.05):
+    """Yield the (Y, X) planes of a synthetic stack in (T, Z, C) order."""
+    t_size, z_size, c_size, height, width = shape
+    dtype = np.dtype(dtype)
+    high = 1.0 if dtype.kind == 'f' else float(np.iinfo(dtype).max)
+    rng = np.random.default_rng(seed)
+    channels = [_blobs(rng, height, width, blobs) for _ in range(c_size)]
+    for t in range(t_size):
+        for z in range(z_size):
+            # Blobs drift a few pixels per time point and fade away from the middle slice.
+            depth = np.exp(-((z - (z_size - 1) / 2) / max(1, z_size / 3)) ** 2)
+            for c, base in enumerate(channels):
+                plane = np.roll(base, (2 * t * (c + 1), 3 * t), axis=(0, 1)) * (0.8 * depth)
+                plane += rng.random((height, width), dtype=np.float32) * noise + 0.05
+                yield (np.clip(plane, 0, 1) * high).astype(dtype)
+
+
+def write_stack(path, shape, dtype='uint16', compression='zlib', seed=0):
+    """
+    Write a synthetic stack to ``path`` as an ImageJ hyperstack with TZCYX
+    axes and return its shape. ``compression`` is one of COMPRESSIONS;
+    'lzw' and 'zstd' need imagecodecs.
+    """
+    shape = tuple(shape)
+    tifffile.imwrite(
+        path, iter_planes(shape, dtype, seed), shape=shape, dtype=dtype, imagej=True,
+        metadata={"axes": "TZCYX"}, compression=None if compression == 'none' else compression
+    )
+    return shape
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('path')
+    parser.add_argument('--shape', type=int, nargs=5, default=[2, 8, 3, 512, 512], metavar=('T', 'Z', 'C', 'Y', 'X'))
+    parser.add_argument('--dtype', choices=DTYPES, default='uint16')
+    parser.add_argument('--compression', choices=COMPRESSIONS, default='zlib')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    write_stack(args.path, args.shape, args.dtype, args.compression, args.seed)
+    print(f"{args.path}: {os.path.getsize(args.path) / 1024 ** 2:.1f} MB")
+
+
+if __name__ == '__main__':
+    main()
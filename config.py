@@ -2,11 +2,102 @@ import os
 
 basedir = os.path.abspath(os.path.dirname(__file__))
 
+
+def available_cpus():
+    """Cores this process may run on."""
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
 class Config:
     SECRET_KEY = os.environ.get('SECRET_KEY')
     SQLALCHEMY_DATABASE_URI = os.environ.get('DATABASE_URI')\
         or 'sqlite:///' + os.path.join(basedir, 'app.db')
     SQLALCHEMY_TRACK_MODIFICATIONS = False
+    SQLALCHEMY_ECHO = os.environ.get('SQLALCHEMY_ECHO', 'False').lower() in ['true', '1', 't', 'y', 'yes']
+
+    # Connection pool of the shared engine for server databases, and WAL
+    # journaling plus a lock timeout for single-node SQLite deployments
+    DB_POOL_SIZE = int(os.environ.get('DB_POOL_SIZE', 5))
+    DB_MAX_OVERFLOW = int(os.environ.get('DB_MAX_OVERFLOW', 10))
+    DB_POOL_RECYCLE = int(os.environ.get('DB_POOL_RECYCLE', 1800))
+    SQLITE_WAL = os.environ.get('SQLITE_WAL', 'True').lower() in ['true', '1', 't', 'y', 'yes']
+    SQLITE_BUSY_TIMEOUT = int(os.environ.get('SQLITE_BUSY_TIMEOUT', 30000))
+
+    # Result cache: total size of cached files kept under media/cache (files
+    # of recorded PCA and segmentation results are kept on top of it), and
+    # number of hot results kept in each process's memory
+    RESULT_CACHE_MAX_BYTES = int(os.environ.get('RESULT_CACHE_MAX_BYTES', 10 * 1024 ** 3))
+    RESULT_CACHE_MEMORY_ITEMS = int(os.environ.get('RESULT_CACHE_MEMORY_ITEMS', 256))
+
+    # Tile edge, in pixels, of the multi-resolution pyramids built after upload
+    PYRAMID_TILE_SIZE = int(os.environ.get('PYRAMID_TILE_SIZE', 256))
+
+    # Chunked analysis store written after upload and read in place of the
+    # TIFF: (T, Z, C, Y, X) chunk shape as "t,z,c,y,x", and 'zlib' (level 1)
+    # or 'none' for raw, memory-mappable chunks
+    CHUNK_STORE_ENABLED = os.environ.get('CHUNK_STORE_ENABLED', 'True').lower() in ['true', '1', 't', 'y', 'yes']
+    CHUNK_STORE_CHUNKS = tuple(int(n) for n in os.environ.get('CHUNK_STORE_CHUNKS', '1,1,1,256,256').split(','))
+    CHUNK_STORE_COMPRESSOR = os.environ.get('CHUNK_STORE_COMPRESSOR', 'zlib')
+
+    # Histogram bins of the per-plane summaries computed at ingest, and the
+    # percent of pixels clipped at each end by the auto-contrast limits
+    PLANE_INDEX_BINS = int(os.environ.get('PLANE_INDEX_BINS', 256))
+    AUTO_CONTRAST_SATURATION = float(os.environ.get('AUTO_CONTRAST_SATURATION', 0.35))
+
+    # Parallel compute inside a task: 'thread' or 'process' pools over (T, Z)
+    # chunks. Decoding, NumPy and BLAS release the GIL, so threads are the
+    # default; 'process' falls back to threads inside Celery's daemonic
+    # prefork children, which may not start processes. COMPUTE_WORKERS=0
+    # gives each task the cores left by the Celery worker's concurrency,
+    # which also sizes BLAS thread pools; set the concurrency here rather
+    # than with `celery worker -c` so both agree.
+    COMPUTE_EXECUTOR = os.environ.get('COMPUTE_EXECUTOR', 'thread')
+    COMPUTE_WORKERS = int(os.environ.get('COMPUTE_WORKERS', 0))
+    CELERY_WORKER_CONCURRENCY = int(os.environ.get('CELERY_WORKER_CONCURRENCY', 1))
+
+    # Celery workers: tasks prefetched per process (1 keeps long jobs from
+    # holding others back), soft time limits in seconds for light and heavy
+    # tasks, retries of transient database errors, and how long results stay
+    CELERY_PREFETCH_MULTIPLIER = int(os.environ.get('CELERY_PREFETCH_MULTIPLIER', 1))
+    CELERY_LIGHT_TIME_LIMIT = int(os.environ.get('CELERY_LIGHT_TIME_LIMIT', 300))
+    CELERY_HEAVY_TIME_LIMIT = int(os.environ.get('CELERY_HEAVY_TIME_LIMIT', 4 * 3600))
+    CELERY_MAX_RETRIES = int(os.environ.get('CELERY_MAX_RETRIES', 5))
+    CELERY_RESULT_EXPIRES = int(os.environ.get('CELERY_RESULT_EXPIRES', 24 * 3600))
+
+    # Largest hyperslab, in bytes, returned by a single /hyperslab request
+    HYPERSLAB_MAX_BYTES = int(os.environ.get('HYPERSLAB_MAX_BYTES', 512 * 1024 ** 2))
+
+    # Largest number of request_ids accepted by one /batch request
+    BATCH_MAX_ITEMS = int(os.environ.get('BATCH_MAX_ITEMS', 1000))
+
+    # Open TIFF handles and bytes of decoded pages kept by each process
+    STACK_CACHE_MAX_HANDLES = int(os.environ.get('STACK_CACHE_MAX_HANDLES', 32))
+    PAGE_CACHE_MAX_BYTES = int(os.environ.get('PAGE_CACHE_MAX_BYTES', 512 * 1024 ** 2))
+
+    # Web tier (gunicorn.conf.py): WEB_WORKERS processes (0 for one per
+    # core), each serving WEB_THREADS requests at once, so a slow client or a
+    # large download holds a thread rather than a whole process. Files under
+    # media/ may be cached by clients for MEDIA_MAX_AGE seconds; with
+    # MEDIA_ACCEL_PREFIX, an nginx internal location over media/, /media
+    # hands each file to nginx by X-Accel-Redirect instead of sending it.
+    WEB_WORKERS = int(os.environ.get('WEB_WORKERS', 0))
+    WEB_THREADS = int(os.environ.get('WEB_THREADS', 32))
+    WEB_TIMEOUT = int(os.environ.get('WEB_TIMEOUT', 120))
+    WEB_KEEPALIVE = int(os.environ.get('WEB_KEEPALIVE', 5))
+    MEDIA_MAX_AGE = int(os.environ.get('MEDIA_MAX_AGE', 3600))
+    MEDIA_ACCEL_PREFIX = os.environ.get('MEDIA_ACCEL_PREFIX', '')
+
+    # Metrics served at /metrics: the folder where every web and worker
+    # process leaves its snapshot, and how often a web process refreshes its
+    # own. PROFILE_REQUESTS lets requests with an X-Profile header be run
+    # under cProfile, with the stats written to PROFILE_DIR.
+    METRICS_DIR = os.environ.get('METRICS_DIR', os.path.join('logs', 'metrics'))
+    METRICS_FLUSH_SECONDS = float(os.environ.get('METRICS_FLUSH_SECONDS', 5))
+    PROFILE_REQUESTS = os.environ.get('PROFILE_REQUESTS', 'False').lower() in ['true', '1', 't', 'y', 'yes']
+    PROFILE_DIR = os.environ.get('PROFILE_DIR', os.path.join('logs', 'profiles'))
 
     # Ensure SQLALCHEMY_DATABASE_URI is set
     if not SQLALCHEMY_DATABASE_URI:
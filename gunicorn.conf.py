@@ -0,0 +1,21 @@
+# gunicorn.conf.py - Threaded web workers, so slow clients and large downloads do not starve the API
+import os
+# Only config is imported: the arbiter never loads the app, its models or Celery.
+from config import Config, available_cpus
+
+bind = f"0.0.0.0:{os.environ.get('PORT', 8001)}"
+# Each process polls its keep-alive connections and runs requests on a pool
+# of threads; a sync worker would be held by every connection it serves.
+worker_class = 'gthread'
+workers = Config.WEB_WORKERS or available_cpus()
+threads = Config.WEB_THREADS
+timeout = Config.WEB_TIMEOUT
+keepalive = Config.WEB_KEEPALIVE
+# Whole files from /media leave through os.sendfile, without passing through Python.
+sendfile = True
+
+
+def worker_exit(server, worker):
+    # Runs in the exiting worker, which has the app loaded already; the arbiter never calls it.
+    from app.views.metrics import snapshots
+    snapshots.remove()
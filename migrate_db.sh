@@ -3,16 +3,12 @@
 # Set the Flask application
 export FLASK_APP=run.py
 
-# Initialize the database (only needed for the first time)
-flask db init
-
-# Create a new migration
-flask db migrate -m "Initial migration"
-
-# Apply the migration
+# Apply the migrations in migrations/versions. Run this once per deploy,
+# before starting the web and Celery workers; the app does not upgrade
+# the database itself when it starts.
 flask db upgrade
 
-# To create and apply new migrations in the future, use:
+# To create a new migration after changing the models, use:
 # flask db migrate -m "Description of changes"
 # flask db upgrade
 
@@ -46,9 +46,10 @@ target_db = current_app.extensions['migrate'].db
 
 
 def get_metadata():
-    if hasattr(target_db, 'metadatas'):
-        return target_db.metadatas[None]
-    return target_db.metadata
+    # The models are declared on app.models.Base rather than on the
+    # Flask-SQLAlchemy instance, so autogenerate must compare against that.
+    from app.models import Base
+    return Base.metadata
 
 
 def run_migrations_offline():
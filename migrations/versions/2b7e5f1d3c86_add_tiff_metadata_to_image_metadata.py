@@ -0,0 +1,26 @@
+"""Add tiff_metadata to image_metadata
+
+Revision ID: 2b7e5f1d3c86
+Revises: 9d4f6b2e8a13
+Create Date: 2026-10-18 17:21:49.205317
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '2b7e5f1d3c86'
+down_revision = '9d4f6b2e8a13'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('image_metadata', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('tiff_metadata', sa.JSON(), nullable=True))
+
+
+def downgrade():
+    with op.batch_alter_table('image_metadata', schema=None) as batch_op:
+        batch_op.drop_column('tiff_metadata')
@@ -0,0 +1,40 @@
+"""Add batch_jobs
+
+Revision ID: 4f8a2c6e1b95
+Revises: 2b7e5f1d3c86
+Create Date: 2026-10-18 19:42:07.318264
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '4f8a2c6e1b95'
+down_revision = '2b7e5f1d3c86'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('batch_jobs',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('batch_id', sa.String(), nullable=False),
+    sa.Column('operations', sa.JSON(), nullable=False),
+    sa.Column('components', sa.Integer(), nullable=True),
+    sa.Column('shared_basis', sa.JSON(), nullable=True),
+    sa.Column('items', sa.JSON(), nullable=False),
+    sa.Column('status', sa.String(), nullable=False),
+    sa.Column('created_time', sa.String(), nullable=False),
+    sa.Column('finished_time', sa.String(), nullable=True),
+    sa.PrimaryKeyConstraint('id')
+    )
+    with op.batch_alter_table('batch_jobs', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_batch_jobs_batch_id'), ['batch_id'], unique=True)
+
+
+def downgrade():
+    with op.batch_alter_table('batch_jobs', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_batch_jobs_batch_id'))
+
+    op.drop_table('batch_jobs')
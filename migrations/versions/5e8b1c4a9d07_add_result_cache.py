@@ -0,0 +1,48 @@
+"""Add result cache and image content hash
+
+Revision ID: 5e8b1c4a9d07
+Revises: a3f9c2d71b4e
+Create Date: 2026-10-18 11:40:03.862150
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5e8b1c4a9d07'
+down_revision = 'a3f9c2d71b4e'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('result_cache',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('key', sa.String(), nullable=False),
+    sa.Column('content_hash', sa.String(), nullable=False),
+    sa.Column('operation', sa.String(), nullable=False),
+    sa.Column('params', sa.JSON(), nullable=False),
+    sa.Column('result', sa.JSON(), nullable=True),
+    sa.Column('file_path', sa.String(), nullable=True),
+    sa.Column('size_bytes', sa.Integer(), nullable=False),
+    sa.Column('last_access', sa.DateTime(), nullable=False),
+    sa.PrimaryKeyConstraint('id')
+    )
+    with op.batch_alter_table('result_cache', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_result_cache_key'), ['key'], unique=True)
+        batch_op.create_index(batch_op.f('ix_result_cache_last_access'), ['last_access'], unique=False)
+
+    with op.batch_alter_table('image_metadata', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('content_hash', sa.String(), nullable=True))
+
+
+def downgrade():
+    with op.batch_alter_table('image_metadata', schema=None) as batch_op:
+        batch_op.drop_column('content_hash')
+
+    with op.batch_alter_table('result_cache', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_result_cache_last_access'))
+        batch_op.drop_index(batch_op.f('ix_result_cache_key'))
+
+    op.drop_table('result_cache')
@@ -0,0 +1,26 @@
+"""Add chunk_store to image_metadata
+
+Revision ID: 8c3e6a1f5d27
+Revises: 4f8a2c6e1b95
+Create Date: 2026-10-18 19:12:41.530267
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '8c3e6a1f5d27'
+down_revision = '4f8a2c6e1b95'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('image_metadata', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('chunk_store', sa.JSON(), nullable=True))
+
+
+def downgrade():
+    with op.batch_alter_table('image_metadata', schema=None) as batch_op:
+        batch_op.drop_column('chunk_store')
@@ -0,0 +1,37 @@
+"""Add segmentation_results
+
+Revision ID: 9d4f6b2e8a13
+Revises: e41b7a3c9f52
+Create Date: 2026-10-18 15:58:21.640973
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '9d4f6b2e8a13'
+down_revision = 'e41b7a3c9f52'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('segmentation_results',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('image_id', sa.Integer(), nullable=False),
+    sa.Column('channel', sa.Integer(), nullable=False),
+    sa.Column('method', sa.String(), nullable=False),
+    sa.Column('threshold', sa.Float(), nullable=False),
+    sa.Column('file_path', sa.String(), nullable=False),
+    sa.PrimaryKeyConstraint('id')
+    )
+    with op.batch_alter_table('segmentation_results', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_segmentation_results_image_id'), ['image_id'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('segmentation_results', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_segmentation_results_image_id'))
+
+    op.drop_table('segmentation_results')
@@ -0,0 +1,26 @@
+"""Add page_index to image_metadata
+
+Revision ID: a3f9c2d71b4e
+Revises: 6c1ed9eacc01
+Create Date: 2026-10-18 09:12:44.301527
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a3f9c2d71b4e'
+down_revision = '6c1ed9eacc01'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('image_metadata', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('page_index', sa.JSON(), nullable=True))
+
+
+def downgrade():
+    with op.batch_alter_table('image_metadata', schema=None) as batch_op:
+        batch_op.drop_column('page_index')
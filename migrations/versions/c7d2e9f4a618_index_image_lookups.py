@@ -0,0 +1,37 @@
+"""Index image lookups by request_id and image_id
+
+Revision ID: c7d2e9f4a618
+Revises: 5e8b1c4a9d07
+Create Date: 2026-10-18 13:02:27.519744
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = 'c7d2e9f4a618'
+down_revision = '5e8b1c4a9d07'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('image_metadata', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_image_metadata_request_id'), ['request_id'], unique=True)
+
+    with op.batch_alter_table('image_statistics', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_image_statistics_image_id'), ['image_id'], unique=False)
+
+    with op.batch_alter_table('pca_results', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_pca_results_image_id'), ['image_id'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('pca_results', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_pca_results_image_id'))
+
+    with op.batch_alter_table('image_statistics', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_image_statistics_image_id'))
+
+    with op.batch_alter_table('image_metadata', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_image_metadata_request_id'))
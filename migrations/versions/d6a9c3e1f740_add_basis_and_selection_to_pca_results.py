@@ -0,0 +1,28 @@
+"""Add basis and selection to pca_results
+
+Revision ID: d6a9c3e1f740
+Revises: 8c3e6a1f5d27
+Create Date: 2026-10-18 21:40:12.904518
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd6a9c3e1f740'
+down_revision = '8c3e6a1f5d27'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('pca_results', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('basis', sa.JSON(), nullable=True))
+        batch_op.add_column(sa.Column('selection', sa.JSON(), nullable=True))
+
+
+def downgrade():
+    with op.batch_alter_table('pca_results', schema=None) as batch_op:
+        batch_op.drop_column('selection')
+        batch_op.drop_column('basis')
@@ -0,0 +1,26 @@
+"""Add pyramid to image_metadata
+
+Revision ID: e41b7a3c9f52
+Revises: c7d2e9f4a618
+Create Date: 2026-10-18 14:37:05.118392
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e41b7a3c9f52'
+down_revision = 'c7d2e9f4a618'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('image_metadata', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('pyramid', sa.JSON(), nullable=True))
+
+
+def downgrade():
+    with op.batch_alter_table('image_metadata', schema=None) as batch_op:
+        batch_op.drop_column('pyramid')
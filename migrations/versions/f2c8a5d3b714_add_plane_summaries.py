@@ -0,0 +1,49 @@
+"""Add plane_summaries and plane_index to image_metadata
+
+Revision ID: f2c8a5d3b714
+Revises: d6a9c3e1f740
+Create Date: 2026-10-18 23:12:47.318205
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'f2c8a5d3b714'
+down_revision = 'd6a9c3e1f740'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('plane_summaries',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('image_id', sa.Integer(), nullable=False),
+    sa.Column('time', sa.Integer(), nullable=False),
+    sa.Column('z', sa.Integer(), nullable=False),
+    sa.Column('channel', sa.Integer(), nullable=False),
+    sa.Column('count', sa.Integer(), nullable=False),
+    sa.Column('sum', sa.Float(), nullable=False),
+    sa.Column('sum_sq', sa.Float(), nullable=False),
+    sa.Column('min', sa.Float(), nullable=False),
+    sa.Column('max', sa.Float(), nullable=False),
+    sa.Column('hist_offset', sa.Integer(), nullable=False),
+    sa.Column('histogram', sa.JSON(), nullable=False),
+    sa.PrimaryKeyConstraint('id')
+    )
+    with op.batch_alter_table('plane_summaries', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_plane_summaries_image_id'), ['image_id'], unique=False)
+
+    with op.batch_alter_table('image_metadata', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('plane_index', sa.JSON(), nullable=True))
+
+
+def downgrade():
+    with op.batch_alter_table('image_metadata', schema=None) as batch_op:
+        batch_op.drop_column('plane_index')
+
+    with op.batch_alter_table('plane_summaries', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_plane_summaries_image_id'))
+
+    op.drop_table('plane_summaries')
@@ -1,2 +1,2 @@
 #!/bin/bash
-exec gunicorn -b 0.0.0.0:${PORT:-8001} wsgi:app
+exec gunicorn -c gunicorn.conf.py wsgi:app
@@ -1,5 +1,120 @@
 import sys
 import os
+import shutil
+import tempfile
+import numpy as np
+import pytest
+import tifffile
 
 # Add the directory containing the app module to the Python path
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+# Keep the tests off the development database
+os.environ.setdefault('DATABASE_URI', 'sqlite:///' + os.path.join(tempfile.mkdtemp(), 'test.db'))
+
+
+@pytest.fixture(scope="session", autouse=True)
+def database():
+    # The app no longer migrates on start, so upgrade the test database once, as a deploy would.
+    from app import create_app
+    from app.models import init_db
+    os.makedirs('logs', exist_ok=True)
+    app, _ = create_app()
+    with app.app_context():
+        init_db()
+
+
+def remove_image(request_id):
+    """
+    Delete an uploaded image and whatever ingest and analysis left behind:
+    the uploaded file, pyramid, chunk store and plane summaries, statistics,
+    PCA and segmentation results and, unless another image has the same
+    content, its result files and cached results.
+    """
+    from app.models import SessionLocal
+    from app.models.image_process import (
+        CachedResult, ImageMetadata, ImageStatistics, PCAResults, PlaneSummary, SegmentationResults,
+    )
+    from app.views.result_cache import result_cache
+    db = SessionLocal()
+    image = db.query(ImageMetadata).filter(ImageMetadata.request_id == request_id).first()
+    if image is None:
+        db.close()
+        return
+    files = [image.file_path]
+    if image.pyramid:
+        files.append(image.pyramid["file_path"])
+    if image.chunk_store:
+        shutil.rmtree(image.chunk_store["path"], ignore_errors=True)
+    shared = image.content_hash and db.query(ImageMetadata.id).filter(
+        ImageMetadata.content_hash == image.content_hash, ImageMetadata.id != image.id).first()
+    for model in (PCAResults, SegmentationResults):
+        rows = db.query(model).filter(model.image_id == image.id)
+        if not shared:
+            files.extend(row.file_path for row in rows)
+        rows.delete()
+    for model in (PlaneSummary, ImageStatistics):
+        db.query(model).filter(model.image_id == image.id).delete()
+    if image.content_hash and not shared:
+        cached = db.query(CachedResult).filter(CachedResult.content_hash == image.content_hash)
+        for row in cached:
+            if row.file_path:
+                files.append(row.file_path)
+            result_cache._forget(row.key)
+        cached.delete()
+    db.delete(image)
+    db.commit()
+    db.close()
+    for path in set(files):
+        if os.path.exists(path):
+            os.remove(path)
+
+
+@pytest.fixture
+def uploaded_image():
+    """
+    Register a TIFF file under a request_id through upload_image_task, as
+    /upload does; every image registered is removed after the test. Tasks
+    run eagerly once the ``app`` fixture is in use.
+    """
+    from app.tasks import upload_image_task
+    request_ids = []
+
+    def upload(path, request_id):
+        request_ids.append(request_id)
+        upload_image_task.delay(path, request_id)
+        return request_id
+
+    yield upload
+    for request_id in request_ids:
+        remove_image(request_id)
+
+
+@pytest.fixture
+def stack_data():
+    rng = np.random.default_rng(0)
+    return rng.integers(0, 4000, size=(2, 3, 2, 16, 20), dtype=np.uint16)
+
+
+@pytest.fixture
+def stack_file(tmp_path, stack_data):
+    path = str(tmp_path / "stack.tif")
+    tifffile.imwrite(path, stack_data, imagej=True, metadata={"axes": "TZCYX"})
+    return path
+
+
+@pytest.fixture
+def app():
+    from app import create_app
+    from app.celery_app import celery
+    os.makedirs('logs', exist_ok=True)
+    app, _ = create_app()
+    app.config.update({"TESTING": True})
+    celery.conf.update(task_always_eager=True)
+    yield app
+    celery.conf.update(task_always_eager=False)
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
@@ -1,61 +1,234 @@
 import pytest
+import hashlib
 import io
-from app import create_app, db
+import os
+import runpy
+import subprocess
+import sys
+import numpy as np
+import tifffile
+from app.models import SessionLocal, engine
 from app.models.image_process import ImageMetadata
+from conftest import remove_image
+from config import Config, available_cpus
 
 @pytest.fixture
-def app():
-    app, _ = create_app()
-    app.config.update({
-        "TESTING": True,
-    })
-
-    with app.app_context():
-        db.create_all()
-        # Insert test data
-        test_image = ImageMetadata(
-            request_id="request_id",
-            filename="test.tif",
-            dimensions="512x512",
-            file_path="media/test_request_id_test.tif",
-            upload_time="2025-02-23 22:53:10"
-        )
-        db.session.add(test_image)
-        db.session.commit()
-        yield app
-        db.session.remove()
-        db.drop_all()
+def stack_path(tmp_path):
+    # A real (T, Z, C, Y, X) stack
+    path = str(tmp_path / "test.tif")
+    data = np.random.default_rng(0).integers(0, 4000, size=(2, 3, 2, 32, 32), dtype=np.uint16)
+    tifffile.imwrite(path, data, imagej=True, metadata={"axes": "TZCYX"})
+    return path
 
 @pytest.fixture
-def client(app):
-    return app.test_client()
+def app(app, stack_path, uploaded_image):
+    # Stored through the same task as /upload
+    uploaded_image(stack_path, "request_id")
+    return app
 
 def test_home_page(client):
     response = client.get('/')
     assert response.status_code == 200
     assert b"Home" in response.data
 
-def test_upload_image(client):
-    response = client.post('/upload', data={'file': (io.BytesIO(b"fake image data"), 'test.tif')})
+def test_upload_image(client, stack_path):
+    with open(stack_path, 'rb') as f:
+        content = f.read()
+    response = client.post('/upload', data={'file': (io.BytesIO(content), 'test.tif')})
     assert response.status_code == 202
-    assert b"request_id" in response.data
+    request_id = response.json["request_id"]
+
+    db = SessionLocal()
+    image = db.query(ImageMetadata).filter(ImageMetadata.request_id == request_id).one()
+    db.close()
+    assert image.dimensions == "(2, 3, 2, 32, 32)"
+    # Hashed while the upload streamed to disk; the TIFF metadata comes from the heavy follow-up task.
+    assert image.content_hash == hashlib.sha256(content).hexdigest()
+    assert image.tiff_metadata["page_count"] == 12
+    remove_image(request_id)
+
+    response = client.post('/upload', data={'file': (io.BytesIO(b"fake image data"), 'test.png')})
+    assert response.status_code == 400
 
 def test_get_metadata(client):
     response = client.get('/metadata/request_id')
     assert response.status_code == 200
-    assert b"metadata" in response.data
+    assert response.json["messages"] == "Metadata successfully retrieved"
+    assert response.json["data"]["dimensions"] == "(2, 3, 2, 32, 32)"
+    assert response.json["data"]["dtype"] == "uint16"
+    assert client.get('/metadata/unknown').status_code == 404
 
 def test_get_slice(client):
-    response = client.get('/slice/request_id')
+    response = client.get('/slice/request_id?time=1&z=2&channel=0')
     assert response.status_code == 200
-    assert b"slice" in response.data
+    assert response.json["messages"] == "Slice successfully retrieved"
+    assert response.json["data"]["url"].endswith('.tif')
+    assert client.get('/slice/request_id?channel=5').status_code == 404
+
+def test_get_slice_without_content_hash(client):
+    # Rows that predate content hashing are keyed on the file, never hashed on the request thread.
+    db = SessionLocal()
+    db.query(ImageMetadata).filter(ImageMetadata.request_id == "request_id").update({"content_hash": None})
+    db.commit()
+    first = client.get('/slice/request_id?time=1&z=2&channel=0&format=raw')
+    assert first.status_code == 200
+    assert client.get('/slice/request_id?time=1&z=2&channel=0&format=raw',
+                      headers={"If-None-Match": first.headers["ETag"]}).status_code == 304
+    assert client.get('/slice/request_id?time=1&z=2&channel=0').status_code == 200
+    assert client.get('/hyperslab/request_id?time=0&z=0').status_code == 200
+    assert db.query(ImageMetadata).filter(ImageMetadata.request_id == "request_id").one().content_hash is None
+    db.close()
 
 def test_analyze_image(client):
-    response = client.post('/analyze/request_id', json={'components': 3})
+    response = client.post('/analyze/request_id', json={'components': 2})
+    assert response.status_code == 202
+    assert response.json["task_id"]
+    assert response.json["data"]["components"] == 2
+
+    # Eager tasks fill the result cache, so asking again is answered directly.
+    response = client.post('/analyze/request_id', json={'components': 2})
     assert response.status_code == 200
-    assert b"analysis" in response.data
+    assert response.json["data"]["pca_result"] == [2, 3, 2, 32, 32]
+
+def test_get_statistics(client, stack_path, monkeypatch):
+    data = tifffile.imread(stack_path).astype(np.float64)
+
+    # The plane index built at ingest answers at once, without reading pixels;
+    # the whole stack comes from its stored totals, without loading a PlaneSummary row.
+    with monkeypatch.context() as patched:
+        patched.setattr("app.tasks._plane_rows", None)
+        response = client.get('/statistics/request_id')
+    assert response.status_code == 200
+    stats = response.json["data"]["statistics"]
+    assert [stat["channel"] for stat in stats] == [0, 1]
+    for stat in stats:
+        channel = data[:, :, stat["channel"]]
+        assert stat["mean"] == pytest.approx(channel.mean())
+        assert stat["std"] == pytest.approx(channel.std())
+        assert (stat["min"], stat["max"]) == (channel.min(), channel.max())
+
+    response = client.get('/statistics/request_id?time=1&z=0:2&percentiles=50')
+    assert response.status_code == 200
+    stat = response.json["data"]["statistics"][1]
+    assert stat["mean"] == pytest.approx(data[1, 0:2, 1].mean())
+    # Percentiles are read off bins 16 values wide.
+    assert stat["percentiles"]["50.0"] == pytest.approx(np.median(data[1, 0:2, 1]), abs=16)
+    stat = client.get('/statistics/request_id?z=0:3:2').json["data"]["statistics"][0]
+    assert stat["mean"] == pytest.approx(data[:, 0:3:2, 0].mean())
+    assert client.get('/statistics/request_id?percentiles=120').status_code == 400
+    assert client.get('/statistics/request_id?z=5').status_code == 404
+
+    # Images without an index are measured by a task.
+    db = SessionLocal()
+    db.query(ImageMetadata).filter(ImageMetadata.request_id == "request_id").update({"plane_index": None})
+    db.commit()
+    db.close()
+    response = client.get('/statistics/request_id')
+    assert response.status_code == 202
+    assert response.json["task_id"]
 
-def test_get_statistics(client):
     response = client.get('/statistics/request_id')
     assert response.status_code == 200
-    assert b"statistics" in response.data
+    assert [stat["channel"] for stat in response.json["data"]["statistics"]] == [0, 1]
+
+def test_get_planes(client, stack_path):
+    data = tifffile.imread(stack_path).astype(np.float64)
+
+    response = client.get('/planes/request_id?z=1&per_page=2&page=2')
+    assert response.status_code == 200
+    planes = response.json["data"]["planes"]
+    assert planes["total"] == 4
+    assert [(p["time"], p["z"], p["channel"]) for p in planes["items"]] == [(1, 1, 0), (1, 1, 1)]
+    assert planes["items"][0]["mean"] == pytest.approx(data[1, 1, 0].mean())
+    assert planes["items"][0]["std"] == pytest.approx(data[1, 1, 0].std())
+    for channel in response.json["data"]["channels"]:
+        low, high = channel["contrast_limits"]
+        assert 0 <= low < channel["threshold"] < high <= 4000
+
+    # Planes with signal: every pixel is below 4000, and at least 0.
+    items = client.get('/planes/request_id?threshold=4000').json["data"]["planes"]["items"]
+    assert [item["foreground"] for item in items] == [0] * 12
+    items = client.get('/planes/request_id?threshold=-1').json["data"]["planes"]["items"]
+    assert [item["foreground"] for item in items] == [1] * 12
+
+    assert client.get('/planes/request_id?saturation=60').status_code == 400
+    assert client.get('/planes/request_id?time=3').status_code == 404
+    assert client.get('/planes/unknown').status_code == 404
+
+def test_analyze_region_and_stored_basis(client):
+    selection = {'components': 2, 'time': 1, 'z': '0:2', 'y': '4:20', 'x': ':16', 'sample_fraction': 0.5}
+    response = client.post('/analyze/request_id', json=selection)
+    assert response.status_code == 202
+    assert response.json["data"]["selection"] == {
+        "region": [[1, 2, 1], [0, 2, 1], [4, 20, 1], [0, 16, 1]], "sample": 0.5
+    }
+
+    response = client.post('/analyze/request_id', json=selection)
+    assert response.status_code == 200
+    fitted = response.json["data"]
+    assert fitted["pca_result"] == [1, 2, 2, 16, 16]
+    assert fitted["basis"]["n_components"] == 2
+
+    # The stored basis projects another region without a refit.
+    applied = {'basis_id': fitted["pca_result_id"], 'x': '16:32'}
+    assert client.post('/analyze/request_id', json=applied).status_code == 202
+    response = client.post('/analyze/request_id', json=applied)
+    assert response.status_code == 200
+    assert response.json["data"]["pca_result"] == [2, 3, 2, 32, 16]
+    assert response.json["data"]["basis"]["components"] == fitted["basis"]["components"]
+    assert response.json["data"]["selection"]["basis_id"] == fitted["pca_result_id"]
+
+    assert client.post('/analyze/request_id', json=dict(applied, sample_count=10)).status_code == 400
+    assert client.post('/analyze/request_id', json={'basis_id': 999999}).status_code == 404
+    assert client.post('/analyze/request_id', json={'y': '40:50'}).status_code == 404
+    assert client.post('/analyze/request_id', json={'y': 'a'}).status_code == 400
+    for components in ('2', 0, -1, 1.5, True, 3):
+        assert client.post('/analyze/request_id', json={'components': components}).status_code == 400
+
+def test_media_ranges_and_accel_redirect(app, client):
+    content = bytes(range(256)) * 4
+    path = os.path.join(app.config['MEDIA_ROOT'], 'range-test.bin')
+    with open(path, 'wb') as f:
+        f.write(content)
+    try:
+        response = client.get('/media/range-test.bin', headers={'Range': 'bytes=100-199'})
+        assert response.status_code == 206
+        assert response.headers['Content-Range'] == 'bytes 100-199/1024'
+        assert response.data == content[100:200]
+
+        response = client.get('/media/range-test.bin')
+        assert response.status_code == 200 and response.data == content
+        assert response.cache_control.max_age == app.config['MEDIA_MAX_AGE']
+        assert client.get('/media/range-test.bin', headers={'If-None-Match': response.headers['ETag']}).status_code == 304
+
+        # Behind nginx, the file itself is left to an internal location.
+        app.config['MEDIA_ACCEL_PREFIX'] = '/protected-media/'
+        response = client.get('/media/range-test.bin')
+        assert response.headers['X-Accel-Redirect'] == '/protected-media/range-test.bin'
+        assert response.data == b''
+        assert client.get('/media/missing.bin').status_code == 404
+        assert client.get('/media/../config.py').status_code == 404
+    finally:
+        os.remove(path)
+
+def test_flask_sqlalchemy_shares_the_engine_pool(app):
+    # Flask-Migrate's engine opens no connections of its own; it borrows them from the models' pool.
+    from app import db
+    with app.app_context():
+        checked_out = engine.pool.checkedout()
+        with db.engine.connect() as connection:
+            assert connection.exec_driver_sql("SELECT 1").scalar() == 1
+            assert engine.pool.checkedout() == checked_out + 1
+        assert engine.pool.checkedout() == checked_out
+
+def test_gunicorn_config():
+    settings = runpy.run_path(os.path.join(os.path.dirname(__file__), '..', 'gunicorn.conf.py'))
+    # The arbiter imports config only, never the app, its models or Celery.
+    root = os.path.join(os.path.dirname(__file__), '..')
+    loaded = subprocess.run([sys.executable, '-c', "import runpy, sys; runpy.run_path('gunicorn.conf.py'); "
+                             "print(sorted(m for m in sys.modules if m == 'app' or m.startswith('app.')))"],
+                            cwd=root, capture_output=True, text=True, check=True).stdout
+    assert loaded.strip() == '[]'
+    assert settings["worker_class"] == 'gthread' and settings["sendfile"]
+    assert settings["threads"] == Config.WEB_THREADS
+    assert settings["workers"] == (Config.WEB_WORKERS or available_cpus())
@@ -0,0 +1,148 @@
+import numpy as np
+import pytest
+import tifffile
+from celery.backends.cache import CacheBackend
+from app.celery_app import celery
+from app.models import SessionLocal
+from app.models.image_process import BatchJob, ImageMetadata, ImageStatistics, PCAResults
+from app.views.stream_pca import StreamingPCA
+
+
+@pytest.fixture
+def images(tmp_path, uploaded_image):
+    rng = np.random.default_rng(0)
+    stacks = {
+        "batch-a": rng.integers(0, 4000, size=(2, 3, 3, 16, 20), dtype=np.uint16),
+        "batch-b": rng.integers(0, 1000, size=(1, 4, 3, 16, 20), dtype=np.uint16),
+        "batch-two-channels": rng.integers(0, 1000, size=(1, 2, 2, 16, 20), dtype=np.uint16),
+    }
+    for request_id, data in stacks.items():
+        path = str(tmp_path / f"{request_id}.tif")
+        tifffile.imwrite(path, data, imagej=True, metadata={"axes": "TZCYX"})
+        uploaded_image(path, request_id)
+    yield stacks
+
+    db = SessionLocal()
+    db.query(BatchJob).delete()
+    db.commit()
+    db.close()
+
+
+def _run_batch(client, **body):
+    response = client.post('/batch', json=body)
+    assert response.status_code == 202, response.json
+    response = client.get(response.json["data"]["job_url"].replace('http://localhost', ''))
+    assert response.status_code == 200
+    return response.json["data"]
+
+
+def test_batch_statistics_and_pca_are_stored_in_bulk(client, images):
+    data = _run_batch(client, request_ids=["batch-a", "batch-b"], operations=["statistics", "pca"], components=2)
+    assert data["state"] == "finished"
+    assert data["counts"] == {"SUCCESS": 4}
+    assert [(item["request_id"], item["operation"]) for item in data["items"]] == [
+        ("batch-a", "statistics"), ("batch-b", "statistics"), ("batch-a", "pca"), ("batch-b", "pca")
+    ]
+    means = [stat["mean"] for stat in data["items"][0]["result"]["statistics"]]
+    np.testing.assert_allclose(means, images["batch-a"].mean(axis=(0, 1, 3, 4)))
+    assert data["items"][2]["result_url"].endswith('.tif')
+
+    db = SessionLocal()
+    image_ids = [image.id for image in db.query(ImageMetadata).filter(
+        ImageMetadata.request_id.in_(["batch-a", "batch-b"]))]
+    assert db.query(ImageStatistics).filter(ImageStatistics.image_id.in_(image_ids)).count() == 6
+    assert db.query(PCAResults).filter(PCAResults.image_id.in_(image_ids)).count() == 2
+    db.close()
+
+    # Re-running the batch comes from the result cache and adds no duplicate rows.
+    assert _run_batch(client, request_ids=["batch-a", "batch-b"], components=2)["counts"] == {"SUCCESS": 4}
+    db = SessionLocal()
+    assert db.query(ImageStatistics).filter(ImageStatistics.image_id.in_(image_ids)).count() == 6
+    assert db.query(PCAResults).filter(PCAResults.image_id.in_(image_ids)).count() == 2
+    db.close()
+
+
+def test_batch_pca_is_recorded_next_to_region_results(client, images):
+    # A region PCA with the same component count is a different output, not a duplicate.
+    assert client.post('/analyze/batch-a', json={"components": 2, "time": "0:1"}).status_code == 202
+    _run_batch(client, request_ids=["batch-a"], operations=["pca"], components=2)
+    db = SessionLocal()
+    image = db.query(ImageMetadata).filter(ImageMetadata.request_id == "batch-a").one()
+    rows = db.query(PCAResults).filter(PCAResults.image_id == image.id).all()
+    db.close()
+    assert len(rows) == 2
+    assert sorted(row.selection is None for row in rows) == [False, True]
+
+
+def test_batch_shared_pca_basis(client, images):
+    data = _run_batch(client, request_ids=["batch-a", "batch-b"], operations=["pca"], components=2,
+                      shared_basis=True)
+    assert data["counts"] == {"SUCCESS": 2}
+
+    pixels = np.concatenate([images[r].transpose(0, 1, 3, 4, 2).reshape(-1, 3) for r in ("batch-a", "batch-b")])
+    expected = StreamingPCA(2).partial_fit(pixels).finalize()
+    np.testing.assert_allclose(data["shared_basis"]["components"], expected.components_, atol=1e-9)
+    db = SessionLocal()
+    rows = {row.file_path: row for row in db.query(PCAResults).filter(
+        PCAResults.file_path.in_([item["result"]["file_path"] for item in data["items"]]))}
+    db.close()
+    assert len(rows) == 2
+    for item in data["items"]:
+        assert item["result"]["explained_variance"] == data["shared_basis"]["explained_variance"]
+        row = rows[item["result"]["file_path"]]
+        assert row.basis == data["shared_basis"] and list(row.selection) == ["batch_id"]
+        reduced = tifffile.imread(item["result"]["file_path"])
+        expected_reduced = expected.transform(
+            images[item["request_id"]].transpose(0, 1, 3, 4, 2).reshape(-1, 3))
+        np.testing.assert_allclose(reduced.transpose(0, 1, 3, 4, 2).reshape(-1, 2), expected_reduced,
+                                   rtol=1e-5, atol=1e-3)
+
+    data = _run_batch(client, request_ids=["batch-a", "batch-two-channels"], operations=["pca"],
+                      components=2, shared_basis=True)
+    assert data["counts"] == {"FAILURE": 2}
+    assert "equal channel counts" in data["shared_basis"]["error"]
+
+
+def test_running_batch_items_take_one_backend_round_trip(client, monkeypatch):
+    backend = CacheBackend(app=celery, backend="memory")
+    monkeypatch.setattr(celery._local, "backend", backend, raising=False)
+    backend.store_result("batch-task-progress", {"progress": 40}, "PROGRESS")
+    backend.mark_as_failure("batch-task-failed", ValueError("bad plane"))
+    mgets = []
+    mget = backend.mget
+    monkeypatch.setattr(backend, "mget", lambda keys: mgets.append(keys) or mget(keys))
+
+    db = SessionLocal()
+    db.add(BatchJob(batch_id="batch-running", operations=["statistics"], status="running", created_time="", items=[
+        {"request_id": f"batch-{n}", "operation": "statistics", "task_id": task_id}
+        for n, task_id in enumerate(["batch-task-progress", "batch-task-failed", "batch-task-queued"])
+    ]))
+    db.commit()
+    db.close()
+
+    data = client.get('/batch/batch-running').json["data"]
+    assert len(mgets) == 1
+    assert data["counts"] == {"PROGRESS": 1, "FAILURE": 1, "PENDING": 1}
+    assert data["items"][0]["progress"] == 40
+    assert data["items"][1]["error"] == "bad plane"
+
+    db = SessionLocal()
+    db.query(BatchJob).filter(BatchJob.batch_id == "batch-running").delete()
+    db.commit()
+    db.close()
+
+
+def test_batch_validation(client, images):
+    assert client.post('/batch', data="x").status_code == 415
+    assert client.post('/batch', json={"request_ids": []}).status_code == 400
+    assert client.post('/batch', json={"request_ids": ["batch-a"], "operations": ["median"]}).status_code == 400
+    for components in ('2', 0, 1.5, True):
+        assert client.post('/batch', json={"request_ids": ["batch-a"], "components": components}).status_code == 400
+    # Every image is checked before queueing, so no item fails in the worker for want of channels.
+    response = client.post('/batch', json={"request_ids": ["batch-a", "batch-two-channels"], "components": 3})
+    assert response.status_code == 400
+    assert "batch-two-channels" in response.json["messages"] and "batch-a " not in response.json["messages"]
+    response = client.post('/batch', json={"request_ids": ["batch-a", "nope"]})
+    assert response.status_code == 404
+    assert "nope" in response.json["messages"]
+    assert client.get('/batch/unknown').status_code == 404
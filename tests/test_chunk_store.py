@@ -0,0 +1,99 @@
+import numpy as np
+import pytest
+import tifffile
+from app.models import SessionLocal
+from app.models.image_process import ImageMetadata
+from app.views.chunk_store import ChunkStore, is_chunk_store, open_stack, write_chunk_store
+from app.views.image_processor import ImageProcessor
+from app.views.stack_cache import PageCache
+from app.views.tiff_stack import TiffStack
+
+
+@pytest.fixture
+def stack_data():
+    rng = np.random.default_rng(0)
+    return rng.integers(0, 4000, size=(3, 4, 2, 20, 24), dtype=np.uint16)
+
+
+@pytest.fixture(params=["zlib", "none"])
+def store(request, tmp_path, stack_file):
+    path = str(tmp_path / "stack.zarr")
+    with TiffStack(stack_file) as stack:
+        write_chunk_store(stack, path, chunks=(2, 1, 1, 8, 16), compressor=request.param)
+    return path
+
+
+def test_round_trip(store, stack_data):
+    assert is_chunk_store(store)
+    with open_stack(store) as stack:
+        assert isinstance(stack, ChunkStore)
+        assert stack.shape == stack_data.shape and stack.dtype == stack_data.dtype
+        assert stack.is_memmapped == (stack.compressor == 'none')
+        np.testing.assert_array_equal(stack.asarray(), stack_data)
+        np.testing.assert_array_equal(stack.plane(2, 3, 1), stack_data[2, 3, 1])
+        np.testing.assert_array_equal(stack.read(z=1), stack_data[:, 1])
+        for t, z, c, plane in stack.iter_planes(channel=1):
+            np.testing.assert_array_equal(plane, stack_data[t, z, c])
+
+
+def test_read_region_decodes_only_overlapping_chunks(store, stack_data):
+    stack = ChunkStore(store)
+    stack.page_cache = PageCache(1024 ** 2)
+    stack.cache_key = store
+
+    # A region of interest inside one Y/X chunk of one plane.
+    np.testing.assert_array_equal(stack.read_region((1, 2, 0, slice(2, 7), slice(3, 12))),
+                                  stack_data[1, 2, 0, 2:7, 3:12])
+    # The time course of one pixel, strided regions and edge chunks.
+    np.testing.assert_array_equal(stack.read_region((slice(None), 1, 1, 9, 20)), stack_data[:, 1, 1, 9, 20])
+    index = (slice(0, 3, 2), slice(1, 4), slice(None), slice(5, 20, 3), slice(None, None, 5))
+    np.testing.assert_array_equal(stack.read_region(index), stack_data[index])
+
+    if stack.compressor == 'zlib':
+        stack.page_cache = PageCache(1024 ** 2)
+        stack.read_region((slice(None), 1, 1, 9, 20))
+        # Three time points in chunks of two, one Y/X chunk: two chunks decoded.
+        assert stack.page_cache.misses == 2
+
+
+def test_processor_reads_store_like_tiff(tmp_path, store, stack_file):
+    with ImageProcessor(stack_file, cache=False) as processor:
+        expected = processor.calculate_statistics(histogram=True)
+        _, pca_expected = processor.perform_pca(2, str(tmp_path / "tiff-pca.tif"))
+    with ImageProcessor(store, cache=False) as processor:
+        assert processor.shape == (3, 4, 2, 20, 24)
+        assert processor.calculate_statistics(histogram=True) == expected
+        _, pca = processor.perform_pca(2, str(tmp_path / "store-pca.tif"))
+    np.testing.assert_allclose(pca.explained_variance_ratio_, pca_expected.explained_variance_ratio_, rtol=1e-5)
+    np.testing.assert_allclose(tifffile.imread(str(tmp_path / "store-pca.tif")),
+                               tifffile.imread(str(tmp_path / "tiff-pca.tif")), rtol=1e-4, atol=1e-3)
+
+
+def test_parallel_write(tmp_path, stack_file, stack_data):
+    progress = []
+    with TiffStack(stack_file) as stack:
+        store = write_chunk_store(stack, str(tmp_path / "parallel.zarr"), chunks=(1, 2, 1, 16, 16),
+                                  workers=2, executor='thread', progress=lambda done, total: progress.append(total))
+    assert store["chunks"] == [1, 2, 1, 16, 16] and store["compressor"] == "zlib"
+    assert progress and store["stored_bytes"] > 0
+    np.testing.assert_array_equal(ChunkStore(str(tmp_path / "parallel.zarr")).asarray(), stack_data)
+
+    with TiffStack(stack_file) as stack:
+        with pytest.raises(ValueError):
+            write_chunk_store(stack, str(tmp_path / "bad.zarr"), compressor='blosc')
+
+
+def test_upload_builds_store(client, uploaded_image, stack_file, stack_data):
+    request_id = uploaded_image(stack_file, "chunk-store-test")
+
+    db = SessionLocal()
+    image = db.query(ImageMetadata).filter(ImageMetadata.request_id == request_id).first()
+    db.close()
+    assert is_chunk_store(image.chunk_store["path"])
+    with ImageProcessor.from_image(image, cache=False) as processor:
+        assert isinstance(processor.stack, ChunkStore)
+        np.testing.assert_array_equal(processor.image, stack_data)
+
+    response = client.get(f'/hyperslab/{request_id}?time=1&channel=0&y=2:9&format=raw')
+    assert response.status_code == 200
+    assert client.get(f'/statistics/{request_id}').status_code == 200
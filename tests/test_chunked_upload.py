@@ -0,0 +1,98 @@
+import hashlib
+import io
+import numpy as np
+import pytest
+import tifffile
+from app.models import SessionLocal
+from app.models.image_process import ImageMetadata
+from conftest import remove_image
+
+
+@pytest.fixture
+def tiff_bytes():
+    data = np.arange(2 * 3 * 2 * 8 * 8, dtype=np.uint16).reshape(2, 3, 2, 8, 8)
+    buffer = io.BytesIO()
+    tifffile.imwrite(buffer, data, imagej=True, metadata={"axes": "TZCYX"})
+    return buffer.getvalue()
+
+
+def test_chunked_upload_resumes_and_registers_metadata(client, tiff_bytes):
+    response = client.post('/uploads', json={"filename": "stack.tif", "size": len(tiff_bytes)})
+    assert response.status_code == 201
+    request_id = response.json["request_id"]
+
+    middle = len(tiff_bytes) // 2
+    response = client.put(f'/uploads/{request_id}?offset=0', data=tiff_bytes[:middle])
+    assert response.json["data"]["offset"] == middle
+
+    # A chunk that skips ahead is refused with the offset to resume from.
+    response = client.put(f'/uploads/{request_id}?offset={middle + 10}', data=tiff_bytes[middle + 10:])
+    assert response.status_code == 409
+    assert response.json["data"]["offset"] == middle
+
+    assert client.post(f'/uploads/{request_id}/finalize').status_code == 409
+    assert client.get(f'/uploads/{request_id}').json["data"]["offset"] == middle
+    client.put(f'/uploads/{request_id}?offset={middle}', data=tiff_bytes[middle:])
+
+    response = client.post(f'/uploads/{request_id}/finalize')
+    assert response.status_code == 202
+
+    db = SessionLocal()
+    image = db.query(ImageMetadata).filter(ImageMetadata.request_id == request_id).first()
+    db.close()
+    assert image.dimensions == str((2, 3, 2, 8, 8))
+    assert image.content_hash == hashlib.sha256(tiff_bytes).hexdigest()
+    assert image.page_index["shape"][:5] == [2, 3, 2, 8, 8]
+    with open(image.file_path, 'rb') as f:
+        assert f.read() == tiff_bytes
+    remove_image(request_id)
+
+
+def test_chunked_upload_rejects_non_tiff(client):
+    request_id = client.post('/uploads', json={"filename": "stack.tif"}).json["request_id"]
+    response = client.put(f'/uploads/{request_id}?offset=0', data=b"not a tiff at all")
+    assert response.status_code == 400
+    assert client.get(f'/uploads/{request_id}').json["data"]["offset"] == 0
+    assert client.post('/uploads', json={"filename": "stack.png"}).status_code == 400
+
+
+def test_chunked_upload_checks_the_header_across_chunks(client, tiff_bytes):
+    request_id = client.post('/uploads', json={"filename": "stack.tif", "size": len(tiff_bytes)}).json["request_id"]
+    # A first chunk shorter than the TIFF signature is a legal split.
+    for start, end in ((0, 1), (1, 3), (3, 10), (10, len(tiff_bytes))):
+        response = client.put(f'/uploads/{request_id}?offset={start}', data=tiff_bytes[start:end])
+        assert response.status_code == 200
+    assert client.post(f'/uploads/{request_id}/finalize').status_code == 202
+    remove_image(request_id)
+
+
+@pytest.mark.parametrize("size", ["abc", "1024", [1], -1, 10.5, True])
+def test_chunked_upload_rejects_bad_sizes(client, size):
+    response = client.post('/uploads', json={"filename": "stack.tif", "size": size})
+    assert response.status_code == 400
+    assert "size" in response.json["messages"]
+
+
+@pytest.mark.parametrize("head", [
+    b"I",                                  # not a byte order mark once the next byte arrives
+    b"II+\x00\x04\x00\x00\x00",       # BigTIFF with 4-byte offsets
+    b"II*\x00\x04\x00\x00\x00",       # first IFD inside the header
+    b"II*\x00\x00\x00\x01\x00",       # first IFD past the declared size
+])
+def test_chunked_upload_rejects_bad_headers(client, head):
+    request_id = client.post('/uploads', json={"filename": "stack.tif", "size": 1024}).json["request_id"]
+    if head == b"I":
+        assert client.put(f'/uploads/{request_id}?offset=0', data=head).status_code == 200
+        response = client.put(f'/uploads/{request_id}?offset=1', data=b"X" + b"\0" * 100)
+    else:
+        response = client.put(f'/uploads/{request_id}?offset=0', data=head + b"\0" * 100)
+    assert response.status_code == 400
+    assert client.get(f'/uploads/{request_id}').json["data"]["offset"] == 0
+
+
+def test_chunked_upload_finalize_parses_the_file(client):
+    # A valid header whose first IFD is garbage.
+    data = b"II*\x00\x08\x00\x00\x00" + b"\xff" * 24
+    request_id = client.post('/uploads', json={"filename": "stack.tif"}).json["request_id"]
+    assert client.put(f'/uploads/{request_id}?offset=0', data=data).status_code == 200
+    assert client.post(f'/uploads/{request_id}/finalize').status_code == 400
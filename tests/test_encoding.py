@@ -0,0 +1,78 @@
+import io
+import numpy as np
+import pytest
+import tifffile
+from PIL import Image
+from app.views.encoding import apply_window, encode_array, parse_window
+
+
+@pytest.fixture
+def plane():
+    return np.arange(12 * 10, dtype=np.uint16).reshape(12, 10) * 500
+
+
+def test_parse_window():
+    assert parse_window(None) is None
+    assert parse_window('auto') == 'auto'
+    assert parse_window('100,2000') == (100.0, 2000.0)
+    for value in ('100', '5,1', 'a,b'):
+        with pytest.raises(ValueError):
+            parse_window(value)
+
+
+def test_window_maps_to_8_bit(plane):
+    windowed = apply_window(plane, (1000, 11000))
+    assert windowed.dtype == np.uint8
+    assert windowed[0, 0] == 0 and windowed[-1, -1] == 255
+    assert windowed[1, 0] == round((5000 - 1000) * 255 / 10000)
+    auto = apply_window(plane, 'auto')
+    assert auto.min() == 0 and auto.max() == 255
+
+
+def test_encodings_round_trip(plane):
+    body, mimetype, headers = encode_array(plane, 'png')
+    assert mimetype == 'image/png'
+    np.testing.assert_array_equal(np.array(Image.open(io.BytesIO(body))), plane)
+
+    body, mimetype, _ = encode_array(plane, 'tiff')
+    np.testing.assert_array_equal(tifffile.imread(io.BytesIO(body)), plane)
+
+    stack = plane.astype('>f4').reshape(2, 6, 10)
+    body, mimetype, headers = encode_array(stack, 'raw')
+    assert headers == {"X-Array-Shape": "2,6,10", "X-Array-Dtype": "<f4"}
+    np.testing.assert_array_equal(np.frombuffer(body, '<f4').reshape(2, 6, 10), stack)
+
+    with pytest.raises(ValueError):
+        encode_array(stack, 'png')
+    with pytest.raises(ValueError):
+        encode_array(plane, 'jpeg')
+
+
+def test_slice_is_streamed_in_the_requested_format(client, uploaded_image, tmp_path):
+    data = np.random.default_rng(0).integers(0, 60000, size=(2, 3, 2, 16, 20), dtype=np.uint16)
+    path = str(tmp_path / "stack.tif")
+    tifffile.imwrite(path, data, imagej=True, metadata={"axes": "TZCYX"})
+    request_id = uploaded_image(path, "encoding-test")
+
+    response = client.get(f'/slice/{request_id}?time=1&z=2&channel=0&format=png')
+    assert response.mimetype == 'image/png'
+    np.testing.assert_array_equal(np.array(Image.open(io.BytesIO(response.data))), data[1, 2, 0])
+    etag = response.headers["ETag"]
+    assert client.get(f'/slice/{request_id}?time=1&z=2&channel=0&format=png',
+                      headers={"If-None-Match": etag}).status_code == 304
+
+    response = client.get(f'/slice/{request_id}?time=1&z=2&channel=0&format=png&window=auto')
+    assert response.headers["ETag"] != etag
+    assert np.array(Image.open(io.BytesIO(response.data))).dtype == np.uint8
+
+    response = client.get(f'/slice/{request_id}?channel=1&format=raw')
+    shape = tuple(int(n) for n in response.headers["X-Array-Shape"].split(","))
+    np.testing.assert_array_equal(
+        np.frombuffer(response.data, response.headers["X-Array-Dtype"]).reshape(shape), data[:, :, 1])
+
+    response = client.get(f'/slice/{request_id}?channel=1&format=tiff')
+    np.testing.assert_array_equal(tifffile.imread(io.BytesIO(response.data)), data[:, :, 1])
+
+    assert client.get(f'/slice/{request_id}?channel=1&format=png').status_code == 400
+    assert client.get(f'/slice/{request_id}?time=1&z=2&channel=0&window=9').status_code == 400
+    assert client.get(f'/slice/{request_id}?time=5&format=raw').status_code == 404
@@ -0,0 +1,88 @@
+import io
+import numpy as np
+import pytest
+import tifffile
+from app.views.hyperslab import parse_index, read_hyperslab
+from app.views.tiff_stack import TiffStack
+from config import Config
+
+INDEXES = [
+    (slice(None), slice(0, 4, 2), 1, slice(2, 10), slice(None, None, 3)),
+    (1, slice(None), slice(None), 5, slice(1, 5)),
+    (slice(None),) * 5,
+    (0, 1, 1, 2, 3),
+]
+
+
+@pytest.fixture
+def stack_data():
+    rng = np.random.default_rng(0)
+    return rng.integers(0, 60000, size=(3, 4, 2, 16, 20), dtype=np.uint16)
+
+
+@pytest.fixture(params=["plain", "zlib"])
+def stack_file(request, tmp_path, stack_data):
+    path = str(tmp_path / f"{request.param}.tif")
+    tifffile.imwrite(path, stack_data, compression=None if request.param == "plain" else "zlib",
+                     photometric="minisblack", metadata={"axes": "TZCYX"})
+    return path
+
+
+def test_parse_index():
+    assert parse_index(None, 5, "z") == slice(None)
+    assert parse_index("3", 5, "z") == 3
+    assert parse_index("1:4:2", 5, "z") == slice(1, 4, 2)
+    assert parse_index("::2", 5, "z") == slice(None, None, 2)
+    for value in ("a", "1:2:3:4", "::0"):
+        with pytest.raises(ValueError):
+            parse_index(value, 5, "z")
+    for value in ("5", "-1", "7:9"):
+        with pytest.raises(IndexError):
+            parse_index(value, 5, "z")
+
+
+@pytest.mark.parametrize("index", INDEXES)
+def test_hyperslab_matches_numpy(stack_file, stack_data, index):
+    with TiffStack(stack_file) as stack:
+        np.testing.assert_array_equal(read_hyperslab(stack, index), stack_data[index])
+        for axis in range(5):
+            if not isinstance(index[axis], slice):
+                continue
+            numpy_axis = sum(isinstance(i, slice) for i in index[:axis])
+            np.testing.assert_array_equal(read_hyperslab(stack, index, 'max', axis),
+                                          stack_data[index].max(axis=numpy_axis))
+            mean = read_hyperslab(stack, index, 'mean', axis)
+            assert mean.dtype == np.float32
+            np.testing.assert_allclose(mean, stack_data[index].mean(axis=numpy_axis), rtol=1e-6)
+        with pytest.raises(ValueError):
+            read_hyperslab(stack, index, 'median', 0)
+
+
+def test_hyperslab_endpoint(client, uploaded_image, tmp_path, stack_data, monkeypatch):
+    path = str(tmp_path / "stack.tif")
+    tifffile.imwrite(path, stack_data, imagej=True, metadata={"axes": "TZCYX"})
+    request_id = uploaded_image(path, "hyperslab-test")
+
+    # Max projection over Z of a ROI time course, in one call.
+    response = client.get(f'/hyperslab/{request_id}?channel=1&y=4:12&x=0:20:2&projection=max&axis=z')
+    assert response.status_code == 200
+    shape = tuple(int(n) for n in response.headers["X-Array-Shape"].split(","))
+    data = np.frombuffer(response.data, response.headers["X-Array-Dtype"]).reshape(shape)
+    np.testing.assert_array_equal(data, stack_data[:, :, 1, 4:12, 0:20:2].max(axis=1))
+
+    etag = response.headers["ETag"]
+    assert client.get(f'/hyperslab/{request_id}?channel=1&y=4:12&x=0:20:2&projection=max&axis=z',
+                      headers={"If-None-Match": etag}).status_code == 304
+
+    response = client.get(f'/hyperslab/{request_id}?time=2&z=1:3&format=tiff')
+    np.testing.assert_array_equal(tifffile.imread(io.BytesIO(response.data)), stack_data[2, 1:3])
+
+    assert client.get(f'/hyperslab/{request_id}?z=9').status_code == 404
+    assert client.get(f'/hyperslab/{request_id}?projection=max&axis=w').status_code == 400
+    assert client.get(f'/hyperslab/{request_id}?z=1&projection=max&axis=z').status_code == 400
+
+    # Mean projections are sized by their float64 accumulator plus the float32 result.
+    elements = stack_data[:, 0, 1].size
+    monkeypatch.setattr(Config, "HYPERSLAB_MAX_BYTES", elements * 8)
+    assert client.get(f'/hyperslab/{request_id}?channel=1&projection=max&axis=z').status_code == 200
+    assert client.get(f'/hyperslab/{request_id}?channel=1&projection=mean&axis=z').status_code == 413
@@ -0,0 +1,228 @@
+import json
+import numpy as np
+import pytest
+import tifffile
+from skimage.filters import threshold_otsu
+from sklearn.decomposition import PCA
+from app.views.chunk_store import open_stack
+from app.views.image_processor import ImageProcessor
+from app.views.parallel import ComputeBackend
+from app.views.stream_pca import StreamingPCA, sample_fraction, sample_planes
+from app.views.stream_stats import RunningStats, channel_statistics
+from app.views.sub_stack import SubStack, region_bounds
+from app.views.tiff_stack import TiffStack
+
+
+@pytest.fixture
+def stack_data():
+    rng = np.random.default_rng(0)
+    return rng.integers(0, 4000, size=(2, 3, 4, 16, 20), dtype=np.uint16)
+
+
+@pytest.fixture(params=["plain", "zlib", "imagej", "ome_tczyx"])
+def stack_file(request, tmp_path, stack_data):
+    path = str(tmp_path / f"{request.param}.tif")
+    if request.param == "plain":
+        tifffile.imwrite(path, stack_data)
+    elif request.param == "zlib":
+        tifffile.imwrite(path, stack_data, compression="zlib")
+    elif request.param == "imagej":
+        tifffile.imwrite(path, stack_data, imagej=True, metadata={"axes": "TZCYX"})
+    else:
+        # Stored channel-major and compressed; must still be presented as TZCYX.
+        tifffile.imwrite(path, stack_data.transpose(0, 2, 1, 3, 4), compression="zlib",
+                         metadata={"axes": "TCZYX"})
+    return path
+
+
+def test_stack_header_and_memmap(stack_file, stack_data):
+    with TiffStack(stack_file) as stack:
+        assert stack.shape == stack_data.shape
+        assert stack.dtype == stack_data.dtype
+        assert stack.is_memmapped == (not any(k in stack_file for k in ("zlib", "ome")))
+
+
+def test_get_slice_matches_full_array(stack_file, stack_data):
+    with ImageProcessor(stack_file) as processor:
+        np.testing.assert_array_equal(processor.get_slice(1, 2, 3), stack_data[1, 2, 3])
+        np.testing.assert_array_equal(processor.get_slice(z=1), stack_data[:, 1])
+        np.testing.assert_array_equal(processor.get_slice(channel=0), stack_data[:, :, 0])
+        np.testing.assert_array_equal(processor.get_slice(), stack_data)
+        with pytest.raises(IndexError):
+            processor.get_slice(channel=4)
+
+
+def test_calculate_statistics(stack_file, stack_data):
+    with ImageProcessor(stack_file) as processor:
+        stats = processor.calculate_statistics()
+    for stat in stats:
+        channel = stack_data[:, :, stat["channel"]]
+        assert stat["mean"] == pytest.approx(channel.mean())
+        assert stat["std"] == pytest.approx(channel.std())
+        assert stat["min"] == channel.min()
+        assert stat["max"] == channel.max()
+
+
+def test_float_statistics_with_percentiles(tmp_path):
+    path = str(tmp_path / "float.tif")
+    data = np.random.default_rng(2).normal(0, 1, size=(2, 3, 2, 16, 20)).astype(np.float32)
+    tifffile.imwrite(path, data, metadata={"axes": "TZCYX"})
+    with ImageProcessor(path) as processor:
+        stats = processor.calculate_statistics(percentiles=[50])
+    width = (data.max() - data.min()) / 256
+    for stat in stats:
+        channel = data[:, :, stat["channel"]]
+        assert abs(stat["percentiles"]["50"] - np.median(channel)) <= width
+        assert channel.min() <= stat["otsu_threshold"] <= channel.max()
+
+
+def test_segment_channel_otsu(stack_file, stack_data):
+    with ImageProcessor(stack_file) as processor:
+        mask = processor.segment_channel(2)
+    assert mask.shape == stack_data[:, :, 2].shape
+    assert mask.dtype == np.uint8
+
+
+def test_stored_page_index_reads_single_page(stack_file, stack_data, monkeypatch):
+    with TiffStack(stack_file) as stack:
+        page_index = json.loads(json.dumps(stack.page_index))
+
+    # With a stored index the series (and so every IFD) is never parsed.
+    monkeypatch.setattr(tifffile.TiffFile, "series", property(lambda self: pytest.fail("series parsed")))
+    with ImageProcessor(stack_file, page_index) as processor:
+        if not processor.stack.is_memmapped:
+            decoded = []
+            read_page = processor.stack.read_page
+            monkeypatch.setattr(processor.stack, "read_page", lambda n, *args: decoded.append(n) or read_page(n, *args))
+        np.testing.assert_array_equal(processor.get_slice(1, 2, 3), stack_data[1, 2, 3])
+        if not processor.stack.is_memmapped:
+            assert len(decoded) == 1
+
+
+def test_streaming_statistics_merge_across_workers(stack_file, stack_data):
+    with TiffStack(stack_file) as stack:
+        serial = channel_statistics(stack, histogram=True, chunk_bytes=128)
+        threaded = channel_statistics(stack, histogram=True, workers=3)
+    for a, b in zip(serial.to_list(percentiles=[50]), threaded.to_list(percentiles=[50])):
+        assert a.pop("percentiles") == b.pop("percentiles")
+        assert a == pytest.approx(b)
+    for ch in range(stack_data.shape[2]):
+        channel = stack_data[:, :, ch]
+        assert serial.otsu_threshold(ch) == threshold_otsu(channel)
+        assert serial.percentile(ch, 50) == np.percentile(channel, 50, method="inverted_cdf")
+
+
+def test_streaming_pca_matches_sklearn(stack_file, stack_data, tmp_path):
+    pixels = stack_data.transpose(0, 1, 3, 4, 2).reshape(-1, stack_data.shape[2])
+    expected = PCA(n_components=2).fit(pixels)
+    output_path = str(tmp_path / "pca.tif")
+    with ImageProcessor(stack_file) as processor:
+        reduced, pca = processor.perform_pca(2, output_path, chunk_bytes=256)
+    np.testing.assert_allclose(pca.explained_variance_, expected.explained_variance_)
+    np.testing.assert_allclose(np.abs(pca.components_), np.abs(expected.components_), atol=1e-8)
+
+    projected = expected.transform(pixels) * np.sign(np.sum(pca.components_ * expected.components_, axis=1))
+    written = tifffile.imread(output_path)
+    assert written.shape == reduced.shape == (2, 3, 2, 16, 20)
+    assert written.dtype == np.float32
+    np.testing.assert_allclose(written.transpose(0, 1, 3, 4, 2).reshape(-1, 2), projected, rtol=1e-5, atol=1e-3)
+
+
+def test_pca_rescaled_to_source_dtype(stack_file, stack_data, tmp_path):
+    pixels = stack_data.transpose(0, 1, 3, 4, 2).reshape(-1, stack_data.shape[2])
+    with ImageProcessor(stack_file) as processor:
+        reduced, pca = processor.perform_pca(2, str(tmp_path / "pca.tif"), chunk_bytes=256, dtype='source')
+        in_memory, _ = processor.perform_pca(pca=pca, dtype='source')
+        with pytest.raises(ValueError):
+            processor.perform_pca(2, dtype='int8')
+    assert reduced.dtype == in_memory.dtype == np.uint16
+    np.testing.assert_array_equal(reduced, in_memory)
+
+    # Inverting the documented linear map recovers the projection to within one step.
+    low, high = pca.projection_range()
+    stored = reduced.transpose(0, 1, 3, 4, 2).reshape(-1, 2).astype(np.float64)
+    recovered = low + stored * (high - low) / 65535
+    np.testing.assert_allclose(recovered, pca.transform(pixels), atol=np.max(high - low) / 65535)
+
+
+def test_pca_on_region(stack_file, stack_data, tmp_path):
+    index = (slice(1, 2), slice(0, 3, 2), slice(None), slice(2, 14), slice(5, 17, 3))
+    region = region_bounds(stack_data.shape, index[:2] + index[3:])
+    assert region == [[1, 2, 1], [0, 3, 2], [2, 14, 1], [5, 17, 3]]
+    assert region_bounds(stack_data.shape, (slice(None),) * 4) is None
+    selected = stack_data[index]
+    pixels = selected.transpose(0, 1, 3, 4, 2).reshape(-1, stack_data.shape[2])
+    expected = PCA(n_components=2).fit(pixels)
+
+    with ImageProcessor(stack_file) as processor:
+        reduced, pca = processor.perform_pca(2, str(tmp_path / "pca.tif"), chunk_bytes=256, region=region)
+        # A stored basis projects another region with no refit: one matrix product per chunk.
+        basis = StreamingPCA.from_basis(pca.basis())
+        whole, _ = processor.perform_pca(pca=basis)
+        with pytest.raises(ValueError):
+            processor.perform_pca(pca=StreamingPCA.from_basis(dict(pca.basis(), mean=[0.0, 0.0])))
+    assert reduced.shape == (1, 2, 2, 12, 4)
+    np.testing.assert_allclose(pca.explained_variance_, expected.explained_variance_)
+    signs = np.sign(np.sum(pca.components_ * expected.components_, axis=1))
+    np.testing.assert_allclose(reduced.transpose(0, 1, 3, 4, 2).reshape(-1, 2), expected.transform(pixels) * signs,
+                               rtol=1e-5, atol=1e-3)
+    np.testing.assert_allclose(whole[index[:2]][..., 2:14, 5:17:3], reduced, rtol=1e-5, atol=1e-3)
+
+    # Worker processes reopen the view from its page index.
+    with TiffStack(stack_file) as stack:
+        view = SubStack(stack, region)
+        with open_stack(view.file_path, view.page_index) as reopened:
+            assert reopened.shape == view.shape == selected.shape
+            np.testing.assert_array_equal(reopened.read(), selected)
+        with pytest.raises(IndexError):
+            SubStack(stack, [[1, 1, 1], [0, 3, 1], [0, 16, 1], [0, 20, 1]])
+
+
+def test_sampled_pca_fit(stack_file, stack_data, tmp_path):
+    assert sample_fraction(stack_data.shape) == 1.0
+    assert sample_fraction(stack_data.shape, count=96) == 96 / (2 * 3 * 16 * 20)
+    for fraction, count in ((0, None), (1.5, None), (None, 0), (0.5, 10), ("half", None)):
+        with pytest.raises(ValueError):
+            sample_fraction(stack_data.shape, fraction, count)
+    # Few planes are decoded, spread over T and Z, and thinned to the requested share.
+    assert sample_planes((4, 5), 0.5) == ([(0, 0), (0, 2), (0, 4), (1, 1), (1, 3), (2, 1), (2, 3), (3, 0), (3, 2),
+                                           (3, 4)], 1.0)
+    planes, share = sample_planes((1, 1), 0.25)
+    assert planes == [(0, 0)] and share == 0.25
+
+    with ImageProcessor(stack_file) as processor:
+        _, full = processor.perform_pca(2, str(tmp_path / "full.tif"))
+        _, sampled = processor.perform_pca(2, str(tmp_path / "sampled.tif"), chunk_bytes=256, sample=0.3)
+    with ImageProcessor(stack_file, backend=ComputeBackend('thread', 2)) as processor:
+        _, parallel = processor.perform_pca(2, str(tmp_path / "parallel.tif"), chunk_bytes=256, sample=0.3)
+    assert sampled.n_samples_seen_ == parallel.n_samples_seen_
+    assert abs(sampled.n_samples_seen_ - 0.3 * full.n_samples_seen_) < 0.05 * full.n_samples_seen_
+    np.testing.assert_allclose(parallel.mean_, sampled.mean_)
+    np.testing.assert_allclose(parallel._comoment, sampled._comoment)
+    np.testing.assert_allclose(sampled.mean_, full.mean_, rtol=0.05)
+
+
+def test_statistics_keep_precision_without_float64_copies():
+    # A narrow spread far from zero is where float32 arithmetic would lose digits.
+    rng = np.random.default_rng(1)
+    data = rng.integers(60000, 60010, size=(1, 2, 1, 64, 64), dtype=np.uint16)
+    stats = RunningStats(1, data.dtype)
+    for plane in data.reshape(-1, 64, 64):
+        stats.update(0, plane)
+    assert stats.mean[0] == pytest.approx(data.mean(), rel=1e-12)
+    assert np.sqrt(stats.m2[0] / stats.count[0]) == pytest.approx(data.std(), rel=1e-6)
+
+    signed = data.astype(np.int16) - 30000
+    stats = RunningStats(1, signed.dtype, histogram=True)
+    stats.update(0, signed)
+    assert stats.percentile(0, 50) == np.percentile(signed, 50, method="inverted_cdf")
+
+
+def test_progress_is_reported_per_plane(stack_file, tmp_path):
+    calls = []
+    with ImageProcessor(stack_file) as processor:
+        processor.calculate_statistics(progress=lambda done, total: calls.append((done, total)))
+        assert calls[-1] == (6, 6)
+        calls.clear()
+        processor.perform_pca(2, str(tmp_path / "pca.tif"), progress=lambda done, total: calls.append((done, total)))
+        assert calls == [(done, 12) for done in range(1, 13)]
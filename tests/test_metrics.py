@@ -0,0 +1,128 @@
+import os
+import pstats
+import time
+import numpy as np
+import pytest
+import tifffile
+from sqlalchemy import create_engine, text
+from sqlalchemy.exc import OperationalError
+from app.views.metrics import Registry, Snapshots, instrument_engine, metrics, timed
+
+
+def test_render_counters_and_histograms():
+    registry = Registry()
+    requests = registry.counter('requests_total', "Requests", ('path',))
+    latency = registry.histogram('latency_seconds', "Latency", ('path',), buckets=(0.1, 1))
+    requests.inc(1, '/a')
+    requests.inc(2, '/a')
+    requests.inc(1, 'say "hi"\n')
+    for value in (0.05, 0.5, 5):
+        latency.observe(value, '/a')
+
+    lines = registry.render([registry.snapshot()]).splitlines()
+    assert '# TYPE requests_total counter' in lines
+    assert 'requests_total{path="/a"} 3' in lines
+    assert r'requests_total{path="say \"hi\"\n"} 1' in lines
+    # Buckets are cumulative and end with +Inf, which equals the count.
+    assert 'latency_seconds_bucket{path="/a",le="0.1"} 1' in lines
+    assert 'latency_seconds_bucket{path="/a",le="1"} 2' in lines
+    assert 'latency_seconds_bucket{path="/a",le="+Inf"} 3' in lines
+    assert 'latency_seconds_sum{path="/a"} 5.55' in lines
+    assert 'latency_seconds_count{path="/a"} 3' in lines
+
+
+def test_snapshots_of_processes_are_added_up(tmp_path):
+    registry = Registry()
+    requests = registry.counter('requests_total', "Requests", ('path',))
+    latency = registry.histogram('latency_seconds', "Latency", buckets=(1,))
+    requests.inc(2, '/a')
+    latency.observe(0.5)
+    other = registry.snapshot()
+    requests.inc(1, '/b')
+    latency.observe(2)
+
+    merged = registry.merge([registry.snapshot(), other])
+    assert merged['requests_total'] == {('/a',): 4, ('/b',): 1}
+    assert merged['latency_seconds'] == {(): [2, 1, 3.0]}
+
+    # Another process's snapshot file is added to this process's live metrics.
+    snapshots = Snapshots(str(tmp_path), interval=60)
+    with open(tmp_path / "worker-1.json", 'w') as f:
+        f.write('{"hdip_tasks_total": [[["app.tasks.example_task", "SUCCESS"], 2]]}')
+    assert 'hdip_tasks_total{task="app.tasks.example_task",state="SUCCESS"} 2' in snapshots.render().splitlines()
+    snapshots.flush(force=False)
+    assert os.path.exists(snapshots.path)
+
+
+def test_snapshots_of_dead_processes_are_dropped(tmp_path):
+    snapshots = Snapshots(str(tmp_path), interval=60)
+    for name in ("live", "dead"):
+        with open(tmp_path / f"{name}.json", 'w') as f:
+            f.write(f'{{"hdip_tasks_total": [[["app.tasks.example_task", "{name}"], 1]]}}')
+    old = time.time() - Snapshots.STALE_INTERVALS * 60 - 1
+    os.utime(tmp_path / "dead.json", (old, old))
+    lines = snapshots.render().splitlines()
+    assert 'hdip_tasks_total{task="app.tasks.example_task",state="live"} 1' in lines
+    assert not any('state="dead"' in line for line in lines)
+    assert sorted(os.listdir(tmp_path)) == ["live.json"]
+
+    # A process that exits cleanly takes its file with it.
+    snapshots.flush()
+    assert os.path.exists(snapshots.path)
+    snapshots.remove()
+    assert sorted(os.listdir(tmp_path)) == ["live.json"]
+
+
+def test_timed_records_failed_stages():
+    stage = metrics.metrics['hdip_stage_seconds']
+    before = sum(stage.values.get(('test.failing',), [0])[:-1])
+    with pytest.raises(ValueError):
+        with timed('test.failing'):
+            raise ValueError
+    assert sum(stage.values[('test.failing',)][:-1]) == before + 1
+
+
+def test_failed_statements_leave_no_timer_behind():
+    statements = metrics.metrics['hdip_db_statement_seconds']
+    before = sum(statements.values.get(('SELECT',), [0])[:-1])
+    engine = create_engine('sqlite://')
+    instrument_engine(engine)
+    with engine.connect() as conn:
+        with pytest.raises(OperationalError):
+            conn.execute(text('SELECT * FROM missing'))
+        assert conn.execute(text('SELECT 1')).scalar() == 1
+        assert 'metrics_start' not in conn.info
+    assert sum(statements.values[('SELECT',)][:-1]) == before + 1
+
+
+@pytest.fixture
+def app(app, tmp_path, monkeypatch):
+    monkeypatch.setattr("app.views.metrics.snapshots.directory", str(tmp_path / "metrics"))
+    app.config.update({"PROFILE_REQUESTS": True, "PROFILE_DIR": str(tmp_path / "profiles")})
+    return app
+
+
+def test_metrics_endpoint(client, uploaded_image, tmp_path):
+    path = str(tmp_path / "stack.tif")
+    tifffile.imwrite(path, np.arange(2 * 2 * 3 * 8 * 8, dtype=np.uint16).reshape(2, 2, 3, 8, 8),
+                     imagej=True, metadata={"axes": "TZCYX"})
+    request_id = uploaded_image(path, "metrics-test")
+
+    response = client.post(f'/analyze/{request_id}', json={'components': 2}, headers={'X-Profile': '1'})
+    assert response.status_code == 202
+    profile = os.path.join(str(tmp_path / "profiles"), response.headers['X-Profile-File'])
+    assert pstats.Stats(profile).total_calls > 0
+    assert 'X-Profile-File' not in client.get(f'/metadata/{request_id}').headers
+
+    response = client.get('/metrics')
+    assert response.status_code == 200
+    assert response.content_type.startswith('text/plain; version=0.0.4')
+    lines = response.data.decode().splitlines()
+    for sample in ('hdip_http_requests_total{endpoint="analyze_image",method="POST",status="202"}',
+                   'hdip_tasks_total{task="app.tasks.analyze_image_task",state="SUCCESS"}',
+                   'hdip_stage_seconds_count{stage="pca.fit"}',
+                   'hdip_stage_seconds_count{stage="pca.transform"}',
+                   'hdip_db_statement_seconds_count{statement="SELECT"}',
+                   'hdip_bytes_written_total{kind="pca"}',
+                   'hdip_cache_lookups_total{cache="result",result="miss"}'):
+        assert any(line.startswith(sample + ' ') for line in lines), sample
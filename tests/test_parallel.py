@@ -0,0 +1,104 @@
+import multiprocessing
+import numpy as np
+import pytest
+import tifffile
+from app.views.hyperslab import read_hyperslab
+from app.views.image_processor import ImageProcessor
+from app.views.parallel import ComputeBackend, split_planes
+from app.views.stream_pca import StreamingPCA
+from app.views.tiff_stack import TiffStack
+
+
+@pytest.fixture
+def stack_data():
+    rng = np.random.default_rng(0)
+    return rng.integers(0, 4000, size=(3, 4, 3, 24, 20), dtype=np.uint16)
+
+
+@pytest.fixture
+def stack_file(tmp_path, stack_data):
+    path = str(tmp_path / "stack.tif")
+    tifffile.imwrite(path, stack_data, compression="zlib", imagej=True, metadata={"axes": "TZCYX"})
+    return path
+
+
+def _square(x):
+    return x * x
+
+
+def _run_in_daemon(queue):
+    backend = ComputeBackend('process', 2)
+    queue.put((backend.executor, backend.run(_square, [(n,) for n in range(4)])))
+
+
+def test_process_backend_runs_inside_daemonic_workers():
+    # Celery's prefork children are daemonic: a process pool there cannot start.
+    queue = multiprocessing.Queue()
+    daemon = multiprocessing.Process(target=_run_in_daemon, args=(queue,), daemon=True)
+    daemon.start()
+    executor, results = queue.get(timeout=60)
+    daemon.join()
+    assert executor == 'thread' and results == [0, 1, 4, 9]
+
+
+def test_split_planes_and_run_order():
+    groups = split_planes((3, 4), 5)
+    assert len(groups) == 5
+    assert [plane for group in groups for plane in group] == [(t, z) for t in range(3) for z in range(4)]
+
+    calls = []
+    backend = ComputeBackend('process', 3)
+    assert backend.run(_square, [(n,) for n in range(7)], sizes=[2] * 7,
+                       progress=lambda done, total: calls.append((done, total))) == [n * n for n in range(7)]
+    assert calls[-1] == (14, 14)
+    with pytest.raises(ValueError):
+        ComputeBackend('gpu', 2)
+
+
+@pytest.mark.parametrize("executor", ["thread", "process"])
+def test_parallel_operations_match_serial(stack_file, stack_data, tmp_path, executor):
+    with ImageProcessor(stack_file, cache=False) as serial, \
+            ImageProcessor(stack_file, cache=False, backend=ComputeBackend(executor, 3)) as parallel:
+        for got, want in zip(parallel.calculate_statistics(percentiles=[50]),
+                             serial.calculate_statistics(percentiles=[50])):
+            assert got.pop('mean') == pytest.approx(want.pop('mean'))
+            assert got.pop('std') == pytest.approx(want.pop('std'))
+            assert got == want
+
+        expected, expected_pca = serial.perform_pca(2, str(tmp_path / "serial.tif"))
+        reduced, pca = parallel.perform_pca(2, str(tmp_path / f"{executor}.tif"))
+        np.testing.assert_allclose(pca.components_, expected_pca.components_, atol=1e-9)
+        np.testing.assert_allclose(reduced, expected, atol=1e-6)
+        del expected, reduced
+
+        assert parallel.save_segmentation(1, str(tmp_path / "mask.tif")) == \
+            serial.save_segmentation(1, str(tmp_path / "mask_serial.tif"))
+        np.testing.assert_array_equal(tifffile.imread(str(tmp_path / "mask.tif")),
+                                      tifffile.imread(str(tmp_path / "mask_serial.tif")))
+
+
+@pytest.mark.parametrize("index, projection, axis", [
+    ((slice(None), slice(1, 4), 1, slice(2, 20), slice(None)), None, None),
+    ((slice(None), slice(None), 2, slice(None), slice(None)), 'max', 1),
+    ((slice(None), 2, slice(None), slice(None), slice(None, None, 2)), 'mean', 0),
+    ((slice(None), 1, 0, slice(None), slice(None)), 'max', 0),
+    ((0, slice(None), slice(None), slice(None), slice(None)), 'mean', 3),
+])
+def test_parallel_hyperslab_matches_numpy(stack_file, stack_data, index, projection, axis):
+    with TiffStack(stack_file) as stack:
+        out = read_hyperslab(stack, index, projection, axis, workers=2)
+    expected = stack_data[index]
+    if projection:
+        numpy_axis = sum(1 for i in range(axis) if isinstance(index[i], slice))
+        expected = expected.max(axis=numpy_axis) if projection == 'max' else expected.mean(axis=numpy_axis)
+    assert out.shape == expected.shape
+    np.testing.assert_allclose(out, expected, rtol=1e-6)
+
+
+def test_streaming_pca_merge_equals_single_pass(stack_data):
+    pixels = stack_data.transpose(0, 1, 3, 4, 2).reshape(-1, 3)
+    whole = StreamingPCA(2).partial_fit(pixels).finalize()
+    merged = StreamingPCA(2).merge(StreamingPCA(2).partial_fit(pixels[:1000]))
+    merged.merge(StreamingPCA(2).partial_fit(pixels[1000:])).finalize()
+    np.testing.assert_allclose(merged.components_, whole.components_, atol=1e-9)
+    np.testing.assert_allclose(merged.explained_variance_, whole.explained_variance_)
@@ -0,0 +1,115 @@
+import numpy as np
+import pytest
+import tifffile
+from app.views.plane_index import _summarize, build_plane_index, index_edges, merge_rows, merge_totals, plane_summary
+from app.views.stream_stats import channel_statistics
+from app.views.tiff_stack import TiffStack
+
+
+@pytest.fixture(params=[np.uint16, np.int16, np.float32])
+def stack_file(request, tmp_path):
+    path = str(tmp_path / "stack.tif")
+    data = np.random.default_rng(0).normal(500, 200, size=(3, 4, 2, 20, 24)).astype(request.param)
+    tifffile.imwrite(path, data, metadata={"axes": "TZCYX"})
+    return path
+
+
+class Row:
+    # Stands in for a stored PlaneSummary row.
+    def __init__(self, row):
+        self.__dict__.update(row)
+
+
+def _rows(index):
+    return [Row(row) for row in index.rows(image_id=1)]
+
+
+def test_index_merges_into_channel_statistics(stack_file):
+    with TiffStack(stack_file) as stack:
+        data = stack.asarray().astype(np.float64)
+        index = build_plane_index(stack, bins=64)
+        expected = channel_statistics(stack)
+    assert index.shape == (3, 4, 2) and len(index.edges) <= 65
+
+    info = index.info()
+    stats = merge_totals(info)
+    np.testing.assert_array_equal(stats.count, expected.count)
+    np.testing.assert_allclose(stats.mean, expected.mean, rtol=1e-12)
+    np.testing.assert_allclose(stats.m2, expected.m2, rtol=1e-7)
+    np.testing.assert_array_equal(stats.min, expected.min)
+    np.testing.assert_array_equal(stats.max, expected.max)
+    assert stats.hist.sum(axis=1).tolist() == stats.count.tolist()
+
+    # A T/Z range merges only its own rows.
+    selected_rows = [row for row in _rows(index) if 1 <= row.time < 3 and row.z % 2 == 0]
+    for stat in merge_rows(info, selected_rows).to_list(percentiles=[50]):
+        selected = data[1:3, 0:4:2, stat["channel"]]
+        assert stat["mean"] == pytest.approx(selected.mean())
+        assert stat["std"] == pytest.approx(selected.std())
+        assert (stat["min"], stat["max"]) == (selected.min(), selected.max())
+        width = index.edges[1] - index.edges[0]
+        assert abs(stat["percentiles"]["50"] - np.median(selected)) <= width
+        assert selected.min() <= stat["otsu_threshold"] <= selected.max()
+    with pytest.raises(IndexError):
+        merge_rows(info, [])
+
+
+def test_rows_round_trip_and_parallel_build(stack_file):
+    with TiffStack(stack_file) as stack:
+        data = stack.asarray().astype(np.float64)
+        index = build_plane_index(stack)
+        parallel = build_plane_index(stack, workers=2, executor='thread')
+    for name in ('count', 'total', 'total_sq', 'min', 'max', 'hist', 'edges'):
+        np.testing.assert_array_equal(getattr(parallel, name), getattr(index, name))
+
+    rows = _rows(index)
+    assert len(rows) == 3 * 4 * 2
+    assert all(len(row.histogram) <= len(index.edges) - 1 for row in rows)
+    np.testing.assert_allclose(index_edges(index.info()), index.edges)
+
+    # The stored totals stand for every row, histograms included.
+    info = index.info()
+    merged, totals = merge_rows(info, rows), merge_totals(info)
+    np.testing.assert_array_equal(merged.count, totals.count)
+    np.testing.assert_allclose(merged.mean, totals.mean, rtol=1e-12)
+    np.testing.assert_allclose(merged.m2, totals.m2, rtol=1e-9)
+    np.testing.assert_array_equal(merged.min, totals.min)
+    np.testing.assert_array_equal(merged.max, totals.max)
+    np.testing.assert_array_equal(merged.hist, totals.hist)
+    for c in range(2):
+        np.testing.assert_array_equal(merged.hist[c], np.histogram(data[:, :, c], bins=index.edges)[0])
+
+    row = next(row for row in rows if (row.time, row.z, row.channel) == (2, 3, 1))
+    summary = plane_summary(row, merged.centers, merged.max[1] + 1)
+    assert summary["mean"] == pytest.approx(data[2, 3, 1].mean())
+    assert summary["std"] == pytest.approx(data[2, 3, 1].std())
+    assert summary["foreground"] == 0
+
+
+def test_planes_are_reduced_as_they_stream_and_merge_exactly(tmp_path):
+    # Full 16-bit planes next to narrow ones: each keeps at most ``bins`` counts, on grids that nest.
+    path = str(tmp_path / "wide.tif")
+    data = np.random.default_rng(1).integers(0, 65536, size=(2, 3, 2, 32, 32), dtype=np.uint16)
+    data[1] = data[1] // 300 + 1000
+    tifffile.imwrite(path, data, metadata={"axes": "TZCYX"})
+    with TiffStack(path) as stack:
+        rows = _summarize(stack, [(t, z) for t in range(2) for z in range(3)], bins=16)
+        index = build_plane_index(stack, bins=16, workers=2)
+    assert all(len(row[-1]) <= 16 for row in rows)
+    assert len(index.edges) <= 17
+    for t, z, c in np.ndindex(index.shape):
+        np.testing.assert_array_equal(index.hist[t, z, c], np.histogram(data[t, z, c], bins=index.edges)[0])
+
+
+def test_foreground_share_per_plane(tmp_path):
+    path = str(tmp_path / "signal.tif")
+    data = np.zeros((1, 3, 1, 10, 10), dtype=np.uint8)
+    data[0, 1, 0, :5] = 200
+    data[0, 2, 0] = 200
+    tifffile.imwrite(path, data, imagej=True, metadata={"axes": "TZCYX"})
+    with TiffStack(path) as stack:
+        index = build_plane_index(stack)
+    stats = merge_totals(index.info())
+    threshold = stats.otsu_threshold(0)
+    assert 0 <= threshold < 200
+    assert [plane_summary(row, stats.centers, threshold)["foreground"] for row in _rows(index)] == [0, 0.5, 1]
@@ -0,0 +1,85 @@
+import io
+import os
+import numpy as np
+import pytest
+import tifffile
+from PIL import Image
+from app.models import SessionLocal
+from app.models.image_process import ImageMetadata
+from app.views.pyramid import build_pyramid, downsample, level_shapes, read_tile
+from app.views.tiff_stack import TiffStack
+
+
+@pytest.fixture
+def stack_data():
+    rng = np.random.default_rng(0)
+    return rng.integers(0, 4000, size=(2, 2, 3, 150, 260), dtype=np.uint16)
+
+
+def test_level_shapes_halve_until_one_tile():
+    assert level_shapes(150, 260, 64) == [(150, 260), (75, 130), (38, 65), (19, 33)]
+    assert level_shapes(50, 60, 64) == [(50, 60)]
+
+
+def test_pyramid_levels_and_tiles(tmp_path, stack_file, stack_data):
+    calls = []
+    with TiffStack(stack_file) as stack:
+        pyramid = build_pyramid(stack, str(tmp_path / "pyramid.ome.tif"), tile_size=64,
+                                progress=lambda done, total: calls.append((done, total)))
+    assert calls[-1] == (48, 48)
+    assert [level["shape"] for level in pyramid["levels"]] == [[150, 260], [75, 130], [38, 65], [19, 33]]
+
+    with tifffile.TiffFile(pyramid["file_path"]) as tif:
+        series = tif.series[0]
+        assert series.is_pyramidal and len(series.levels) == 4
+        assert tif.pages[0].is_tiled and tif.pages[0].compression == 8
+
+    plane = stack_data[1, 0, 2]
+    np.testing.assert_array_equal(read_tile(pyramid, 0, 1, 0, 2, 1, 2), plane[64:128, 128:192])
+    # Edge tiles are cropped to the plane.
+    np.testing.assert_array_equal(read_tile(pyramid, 1, 1, 0, 2, 1, 2), downsample(plane, 2)[64:, 128:])
+    # Each level is halved from the one above.
+    np.testing.assert_array_equal(read_tile(pyramid, 3, 1, 0, 2, 0, 0),
+                                  downsample(downsample(downsample(plane, 2), 2), 2))
+    assert sorted(os.listdir(tmp_path)) == ["pyramid.ome.tif", "stack.tif"]
+    with pytest.raises(IndexError):
+        read_tile(pyramid, 3, 1, 0, 2, 0, 1)
+    with pytest.raises(IndexError):
+        read_tile(pyramid, 4, 0, 0, 0, 0, 0)
+
+
+def test_tile_endpoint(client, uploaded_image, stack_file, stack_data):
+    request_id = uploaded_image(stack_file, "pyramid-test")
+
+    response = client.get(f'/tiles/{request_id}')
+    assert response.status_code == 200
+    levels = response.json["data"]["levels"]
+    assert levels[0]["shape"] == [150, 260]
+    assert levels[-1]["tiles"] == [1, 1]
+
+    response = client.get(f'/tiles/{request_id}/0/0/1?time=1&z=1&channel=2')
+    assert response.status_code == 200
+    assert response.mimetype == 'image/png'
+    np.testing.assert_array_equal(np.array(Image.open(io.BytesIO(response.data))),
+                                  stack_data[1, 1, 2, :150, 256:260])
+
+    etag = response.headers["ETag"]
+    assert client.get(f'/tiles/{request_id}/0/0/1?time=1&z=1&channel=2',
+                      headers={"If-None-Match": etag}).status_code == 304
+
+    response = client.get(f'/tiles/{request_id}/0/0/1?time=1&z=1&channel=2&format=tiff')
+    assert response.mimetype == 'image/tiff'
+    assert response.headers["ETag"] != etag
+    assert client.get(f'/tiles/{request_id}/9/0/0').status_code == 404
+    assert client.get('/tiles/missing/0/0/0').status_code == 404
+
+
+def test_tiles_of_unhashed_images_have_their_own_etags(client, uploaded_image, stack_file):
+    # The pyramid can be served before the metadata task stores the content hash.
+    request_ids = [uploaded_image(stack_file, "pyramid-unhashed-a"), uploaded_image(stack_file, "pyramid-unhashed-b")]
+    db = SessionLocal()
+    db.query(ImageMetadata).filter(ImageMetadata.request_id.in_(request_ids)).update({"content_hash": None})
+    db.commit()
+    db.close()
+    etags = [client.get(f'/tiles/{request_id}/0/0/0').headers["ETag"] for request_id in request_ids]
+    assert etags[0] != etags[1]
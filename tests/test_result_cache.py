@@ -0,0 +1,74 @@
+import os
+import pytest
+from app import create_app
+from app.models import SessionLocal
+from app.models.image_process import PCAResults
+from app.views.result_cache import ResultCache, cache_key
+
+
+@pytest.fixture
+def cache(tmp_path, monkeypatch):
+    create_app()
+    monkeypatch.setattr("app.views.result_cache.CACHE_DIR", str(tmp_path))
+    return ResultCache(max_bytes=250, memory_items=2)
+
+
+def write_cached_file(cache, content_hash, params, size):
+    path = cache.file_path(content_hash, "slice", params)
+    with open(path, "wb") as f:
+        f.write(b"\0" * size)
+    cache.put(content_hash, "slice", params, file_path=path)
+    return path
+
+
+def test_key_depends_on_content_operation_and_params():
+    assert cache_key("abc", "pca", {"components": 3}) == cache_key("abc", "pca", {"components": 3})
+    assert cache_key("abc", "pca", {"components": 3}) != cache_key("abc", "pca", {"components": 2})
+    assert cache_key("abc", "pca", {}) != cache_key("abd", "pca", {})
+    assert cache_key("abc", "pca", {}) != cache_key("abc", "statistics", {})
+
+
+def test_results_round_trip_through_memory_and_database(cache):
+    stats = [{"channel": 0, "mean": 1.5}]
+    assert cache.get("hash-a", "statistics", {}) is None
+    cache.put("hash-a", "statistics", {}, result=stats)
+    assert cache.get("hash-a", "statistics", {})["result"] == stats
+
+    # A fresh process has an empty memory tier and falls back to the table.
+    other = ResultCache(max_bytes=250, memory_items=2)
+    assert other.get("hash-a", "statistics", {})["result"] == stats
+
+
+def test_files_are_evicted_least_recently_used_first(cache):
+    first = write_cached_file(cache, "hash-b", {"z": 0}, 100)
+    second = write_cached_file(cache, "hash-b", {"z": 1}, 100)
+    assert cache.get("hash-b", "slice", {"z": 0})["file_path"] == first
+
+    write_cached_file(cache, "hash-b", {"z": 2}, 100)
+    assert os.path.exists(first)
+    assert not os.path.exists(second)
+    assert cache.get("hash-b", "slice", {"z": 1}) is None
+
+
+def test_missing_file_is_a_miss(cache):
+    path = write_cached_file(cache, "hash-c", {"z": 0}, 10)
+    os.remove(path)
+    assert cache.get("hash-c", "slice", {"z": 0}) is None
+
+
+def test_files_of_recorded_results_are_pinned(cache):
+    pinned = write_cached_file(cache, "hash-d", {"z": 0}, 200)
+    db = SessionLocal()
+    row = PCAResults(image_id=0, components=1, explained_variance=[1.0], file_path=pinned)
+    db.add(row)
+    db.commit()
+    try:
+        first = write_cached_file(cache, "hash-d", {"z": 1}, 200)
+        second = write_cached_file(cache, "hash-d", {"z": 2}, 100)
+        assert os.path.exists(pinned)
+        assert not os.path.exists(first)
+        assert os.path.exists(second)
+    finally:
+        db.delete(row)
+        db.commit()
+        db.close()
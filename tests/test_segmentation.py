@@ -0,0 +1,94 @@
+import numpy as np
+import pytest
+import tifffile
+from skimage.filters import threshold_otsu
+from sklearn.cluster import KMeans
+from app.models import SessionLocal
+from app.models.image_process import ImageMetadata, SegmentationResults
+from app.views.image_processor import ImageProcessor
+from app.views.segmentation import segmentation_threshold, write_mask
+from app.views.tiff_stack import TiffStack
+
+
+@pytest.fixture
+def stack_data():
+    # Two populations per channel, so both methods have a clear split.
+    rng = np.random.default_rng(0)
+    data = rng.normal(1000, 150, size=(2, 3, 2, 40, 300))
+    data[..., 150:] += 2000
+    return np.clip(data, 0, None).astype(np.uint16)
+
+
+@pytest.fixture
+def stack_file(tmp_path, stack_data):
+    path = str(tmp_path / "stack.tif")
+    tifffile.imwrite(path, stack_data, compression="zlib", metadata={"axes": "TZCYX"})
+    return path
+
+
+def test_thresholds_match_full_channel_methods(tmp_path, stack_file, stack_data):
+    channel = stack_data[:, :, 1]
+    with TiffStack(stack_file) as stack:
+        assert segmentation_threshold(stack, 1, 'otsu') == pytest.approx(threshold_otsu(channel))
+        threshold = segmentation_threshold(stack, 1, 'kmeans', workers=2)
+        with pytest.raises(ValueError):
+            segmentation_threshold(stack, 1, 'watershed')
+
+    labels = KMeans(n_clusters=2, n_init=1, random_state=0).fit_predict(channel.reshape(-1, 1))
+    bright = labels == labels[channel.reshape(-1).argmax()]
+    np.testing.assert_array_equal(channel.reshape(-1) > threshold, bright)
+
+    # Float data is binned over its range, as skimage does.
+    floats = stack_data.astype(np.float32) / 7
+    tifffile.imwrite(tmp_path / "floats.tif", floats, metadata={"axes": "TZCYX"})
+    with TiffStack(str(tmp_path / "floats.tif")) as stack:
+        assert segmentation_threshold(stack, 1, 'otsu') == pytest.approx(threshold_otsu(floats[:, :, 1]))
+
+
+@pytest.mark.parametrize("workers, executor", [(1, 'thread'), (2, 'thread'), (2, 'process')])
+def test_write_mask_matches_in_memory_mask(tmp_path, stack_file, stack_data, workers, executor):
+    output_path = str(tmp_path / "mask.tif")
+    calls = []
+    with TiffStack(stack_file) as stack:
+        shape = write_mask(stack, 0, 1500, output_path, tile_size=32, workers=workers, executor=executor,
+                           progress=lambda done, total: calls.append((done, total)))
+    assert shape == (2, 3, 40, 300)
+    assert calls[-1] == (6, 6)
+    with tifffile.TiffFile(output_path) as tif:
+        assert tif.pages[0].is_tiled and tif.pages[0].compression == 8
+        np.testing.assert_array_equal(tif.asarray(), (stack_data[:, :, 0] > 1500).astype(np.uint8))
+
+
+def test_save_segmentation(tmp_path, stack_file, stack_data):
+    output_path = str(tmp_path / "mask.tif")
+    with ImageProcessor(stack_file) as processor:
+        threshold = processor.save_segmentation(1, output_path, 'kmeans')
+        np.testing.assert_array_equal(tifffile.imread(output_path), processor.segment_channel(1, 'kmeans'))
+        with pytest.raises(IndexError):
+            processor.save_segmentation(2, output_path)
+    assert 1000 < threshold < 3000
+
+
+def test_segment_endpoint(client, uploaded_image, stack_file, stack_data):
+    request_id = uploaded_image(stack_file, "segmentation-test")
+
+    assert client.post(f'/segment/{request_id}', json={"method": "watershed"}).status_code == 400
+    assert client.post(f'/segment/{request_id}', json={"channel": True}).status_code == 400
+    assert client.post(f'/segment/{request_id}', json={"channel": 3}).status_code == 404
+    assert client.post(f'/segment/{request_id}', json={"channel": -1}).status_code == 404
+    response = client.post(f'/segment/{request_id}', json={"channel": 1, "method": "otsu"})
+    assert response.status_code == 202
+
+    db = SessionLocal()
+    image = db.query(ImageMetadata).filter(ImageMetadata.request_id == request_id).first()
+    recorded = db.query(SegmentationResults).filter(SegmentationResults.image_id == image.id).all()
+    db.close()
+    assert len(recorded) == 1
+    assert recorded[0].threshold == pytest.approx(threshold_otsu(stack_data[:, :, 1]))
+    mask = tifffile.imread(recorded[0].file_path)
+    np.testing.assert_array_equal(mask, stack_data[:, :, 1] > recorded[0].threshold)
+
+    # The second request is served from the result cache.
+    response = client.post(f'/segment/{request_id}', json={"channel": 1, "method": "otsu"})
+    assert response.status_code == 200
+    assert response.json["data"]["threshold"] == recorded[0].threshold
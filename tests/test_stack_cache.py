@@ -0,0 +1,94 @@
+import os
+import numpy as np
+import pytest
+import tifffile
+from app.views.image_processor import ImageProcessor
+from app.views.stack_cache import PageCache, StackCache
+
+
+@pytest.fixture
+def stack_file(tmp_path, stack_data):
+    path = str(tmp_path / "stack.tif")
+    tifffile.imwrite(path, stack_data, compression="zlib", photometric="minisblack", metadata={"axes": "TZCYX"})
+    return path
+
+
+def test_handles_and_pages_are_reused(stack_file, stack_data):
+    cache = StackCache(max_handles=2, page_bytes=1024 ** 2)
+    stack = cache.acquire(stack_file)
+    plane = stack.plane(1, 2, 1)
+    cache.release(stack)
+
+    again = cache.acquire(stack_file)
+    assert again is stack
+    np.testing.assert_array_equal(again.plane(1, 2, 1), stack_data[1, 2, 1])
+    cache.release(again)
+    assert cache.stats() == {"handle_hits": 1, "handle_misses": 1, "open_handles": 1,
+                             "page_hits": 1, "page_misses": 1, "page_bytes": plane.nbytes}
+    # Cached pages are shared, so they are handed out read-only.
+    assert not plane.flags.writeable
+
+    # Full scans read through the cache without filling it.
+    stack = cache.acquire(stack_file)
+    list(stack.iter_planes())
+    cache.release(stack)
+    assert cache.stats()["page_bytes"] == plane.nbytes
+
+
+def test_replaced_and_deleted_files_are_invalidated(tmp_path, stack_file, stack_data):
+    cache = StackCache(max_handles=2, page_bytes=1024 ** 2)
+    stack = cache.acquire(stack_file)
+    stack.plane(0, 0, 0)
+
+    # Replaced while in use: the old handle keeps working until released.
+    replacement = str(tmp_path / "replacement.tif")
+    tifffile.imwrite(replacement, stack_data[:, :, :, :8] + 1, compression="zlib", photometric="minisblack",
+                     metadata={"axes": "TZCYX"})
+    os.replace(replacement, stack_file)
+    fresh = cache.acquire(stack_file)
+    assert fresh is not stack and fresh.shape == (2, 3, 2, 8, 20)
+    np.testing.assert_array_equal(fresh.plane(0, 0, 0), stack_data[0, 0, 0, :8] + 1)
+    np.testing.assert_array_equal(stack.plane(1, 0, 0), stack_data[1, 0, 0])
+    cache.release(stack)
+    assert stack._tif.filehandle.closed
+    cache.release(fresh)
+
+    os.remove(stack_file)
+    with pytest.raises(FileNotFoundError):
+        cache.acquire(stack_file)
+    assert cache.stats()["open_handles"] == 0
+    assert fresh._tif.filehandle.closed
+
+
+def test_least_recently_used_handles_and_pages_are_evicted(tmp_path, stack_data):
+    cache = StackCache(max_handles=1, page_bytes=3 * stack_data[0, 0, 0].nbytes)
+    paths = []
+    for name in ("a", "b"):
+        paths.append(str(tmp_path / f"{name}.tif"))
+        tifffile.imwrite(paths[-1], stack_data, compression="zlib", photometric="minisblack",
+                         metadata={"axes": "TZCYX"})
+    first = cache.acquire(paths[0])
+    for z in range(3):
+        first.plane(0, z, 0)
+    cache.release(first)
+    assert cache.stats()["page_bytes"] == 3 * stack_data[0, 0, 0].nbytes
+
+    second = cache.acquire(paths[1])
+    second.plane(0, 0, 0)
+    cache.release(second)
+    assert first._tif.filehandle.closed
+    assert cache.stats()["page_bytes"] == 3 * stack_data[0, 0, 0].nbytes
+
+
+def test_page_cache_skips_pages_larger_than_the_budget():
+    pages = PageCache(max_bytes=100)
+    pages.put("big", np.zeros(200, dtype=np.uint8))
+    assert pages.get("big") is None and pages.nbytes == 0
+
+
+def test_image_processor_shares_cached_stacks(stack_file):
+    with ImageProcessor(stack_file) as first, ImageProcessor(stack_file) as second:
+        assert first.stack is second.stack
+    with ImageProcessor(stack_file, cache=False) as uncached:
+        assert uncached.stack is not first.stack
+    assert not first.stack._tif.filehandle.closed
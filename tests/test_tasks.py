@@ -0,0 +1,55 @@
+import os
+import numpy as np
+import tifffile
+from app.celery_app import HEAVY_QUEUE, LIGHT_QUEUE, celery
+from app.models import SessionLocal
+from app.models.image_process import ImageMetadata, PlaneSummary
+from app.tasks import (
+    analyze_image_task, build_chunk_store_task, build_plane_index_task, build_pyramid_task,
+    build_upload_metadata_task, upload_image_task,
+)
+from config import Config
+
+
+def test_tasks_are_routed_by_weight():
+    route = celery.amqp.router.route
+    assert route({}, 'app.tasks.analyze_image_task')['queue'].name == HEAVY_QUEUE
+    assert route({}, 'app.tasks.build_pyramid_task')['queue'].name == HEAVY_QUEUE
+    assert route({}, 'app.tasks.build_upload_metadata_task')['queue'].name == HEAVY_QUEUE
+    assert route({}, 'app.tasks.upload_image_task')['queue'].name == LIGHT_QUEUE
+    assert route({}, 'app.tasks.finalize_batch_task')['queue'].name == LIGHT_QUEUE
+    assert celery.conf.task_acks_late and celery.conf.worker_prefetch_multiplier == Config.CELERY_PREFETCH_MULTIPLIER
+    # Flask settings are not copied into Celery's configuration.
+    assert 'SQLALCHEMY_DATABASE_URI' not in celery.conf
+
+    assert analyze_image_task.soft_time_limit == Config.CELERY_HEAVY_TIME_LIMIT
+    assert upload_image_task.soft_time_limit == Config.CELERY_LIGHT_TIME_LIMIT
+    assert analyze_image_task.max_retries == Config.CELERY_MAX_RETRIES
+
+
+def test_redelivered_upload_is_idempotent(client, uploaded_image, tmp_path):
+    path = str(tmp_path / "stack.tif")
+    tifffile.imwrite(path, np.zeros((1, 2, 1, 8, 8), dtype=np.uint8), imagej=True, metadata={"axes": "TZCYX"})
+    uploaded_image(path, "redelivered")
+    db = SessionLocal()
+    image = db.query(ImageMetadata).filter(ImageMetadata.request_id == "redelivered").one()
+    pyramid, chunk_store, image_id = image.pyramid, image.chunk_store, image.id
+    db.close()
+    modified = os.path.getmtime(pyramid["file_path"])
+    store_modified = os.path.getmtime(os.path.join(chunk_store["path"], '.zarray'))
+
+    # A second delivery neither duplicates the row nor rebuilds the pyramid or chunk store.
+    upload_image_task.delay(path, "redelivered")
+    assert build_pyramid_task.delay("redelivered").result["levels"] == 1
+    assert os.path.getmtime(pyramid["file_path"]) == modified
+    assert build_chunk_store_task.delay("redelivered").result["chunks"] == chunk_store["chunks"]
+    assert os.path.getmtime(os.path.join(chunk_store["path"], '.zarray')) == store_modified
+    assert build_plane_index_task.delay("redelivered").result["bins"] == 1
+    assert build_upload_metadata_task.delay("redelivered").result["page_count"] == 2
+
+    db = SessionLocal()
+    assert db.query(ImageMetadata).filter(ImageMetadata.request_id == "redelivered").count() == 1
+    # No hash came with the task, so the heavy follow-up read the file for it.
+    assert db.query(ImageMetadata).filter(ImageMetadata.request_id == "redelivered").one().content_hash
+    assert db.query(PlaneSummary).filter(PlaneSummary.image_id == image_id).count() == 2
+    db.close()
@@ -0,0 +1,62 @@
+import numpy as np
+import pytest
+import tifffile
+from app.views.tiff_metadata import extract_metadata, page_tags
+
+
+@pytest.fixture
+def stack_data():
+    return np.zeros((2, 3, 2, 8, 10), dtype=np.uint16)
+
+
+def test_ome_metadata(tmp_path, stack_data):
+    path = str(tmp_path / "stack.ome.tif")
+    tifffile.imwrite(path, stack_data.transpose(0, 2, 1, 3, 4), photometric="minisblack", metadata={
+        "axes": "TCZYX", "PhysicalSizeX": 0.2, "PhysicalSizeY": 0.3, "PhysicalSizeZ": 1.5,
+        "Channel": {"Name": ["DAPI", "GFP"]}
+    })
+    metadata = extract_metadata(path)
+    assert metadata["shape"] == [2, 3, 2, 8, 10]
+    assert metadata["series_axes"].startswith("TCZYX")
+    assert metadata["dtype"] == "uint16"
+    assert metadata["format"]["ome"]
+    assert metadata["channel_names"] == ["DAPI", "GFP"]
+    assert metadata["physical_size"]["x"] == {"value": 0.2, "unit": "µm"}
+    assert metadata["physical_size"]["z"]["value"] == 1.5
+
+
+def test_imagej_metadata_and_deduplicated_tags(tmp_path, stack_data):
+    path = str(tmp_path / "stack.tif")
+    tifffile.imwrite(path, stack_data, imagej=True, resolution=(2.0, 4.0),
+                     metadata={"axes": "TZCYX", "spacing": 0.5, "unit": "um", "finterval": 3})
+    metadata = extract_metadata(path)
+    assert metadata["physical_size"] == {
+        "x": {"value": 0.5, "unit": "um"}, "y": {"value": 0.25, "unit": "um"},
+        "z": {"value": 0.5, "unit": "um"}, "t": {"value": 3.0, "unit": "s"}
+    }
+    assert metadata["imagej_metadata"]["spacing"] == 0.5
+    # Pages differ only in strip offsets, which are left out, and in the first page's Software tag.
+    assert metadata["page_count"] == 12
+    assert metadata["page_groups"] == [[0, 1], [1, 11]]
+    assert "StripOffsets" not in metadata["tag_groups"][0]
+    assert "ImageDescription" not in metadata["tag_groups"][0]
+    assert [p["index"] for p in page_tags(metadata, 10, 20)] == [10, 11]
+
+
+def test_metadata_endpoint(client, uploaded_image, tmp_path, stack_data):
+    path = str(tmp_path / "stack.tif")
+    tifffile.imwrite(path, stack_data, photometric="minisblack", metadata={"axes": "TZCYX"})
+    request_id = uploaded_image(path, "metadata-test")
+
+    data = client.get(f'/metadata/{request_id}').json["data"]
+    assert data["shape"] == [2, 3, 2, 8, 10]
+    assert data["page_count"] == 12
+    assert "pages" not in data
+
+    data = client.get(f'/metadata/{request_id}?fields=dtype,pages&page=3&per_page=5').json["data"]
+    assert data["dtype"] == "uint16" and "shape" not in data
+    assert data["pages"]["total"] == 12
+    assert [p["index"] for p in data["pages"]["items"]] == [10, 11]
+    assert data["pages"]["items"][0]["tags"]["ImageWidth"] == 10
+
+    assert client.get(f'/metadata/{request_id}?fields=nope').status_code == 400